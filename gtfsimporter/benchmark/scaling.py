@@ -0,0 +1,239 @@
+import gc
+import math
+import time
+
+from ..common_elements import Schedule
+from ..conflation.stops import StopConflator
+from ..gtfs.elements import GtfsRoute, GtfsStop, GtfsTrip
+
+
+def fit_exponent(sizes, times):
+    """
+    Slope of the least squares fit of log(time) against log(size), i.e. k
+    for a time growing as size^k
+    """
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+
+    num = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    den = sum((x - mean_x) ** 2 for x in xs)
+    return num / den
+
+
+class ScalingCase(object):
+    """
+    Operation timed at several input sizes
+
+    prepare(n) builds the input of size n and returns a function running the
+    operation on it, only that function is timed. prepare is called before
+    each run, so the operation may modify its input. exponent is the expected
+    growth: 1 for linear operations, n·log n being close enough to 1 on the
+    sizes used.
+    """
+
+    name = None
+    exponent = 1
+
+    def prepare(self, n):
+        raise NotImplementedError("ScalingCase-subclass must implement this")
+
+
+def make_stops(n, prefix="S"):
+    return [GtfsStop(f"{prefix}{i}", 45 + i * 1e-5, -73 - i * 1e-5,
+                     f"Stop {i}", str(i)) for i in range(n)]
+
+
+class AddStopCase(ScalingCase):
+    """
+    Schedule.add_stop with deduplication, i.e. find_duplicate_stop. One stop
+    out of 4 is duplicated.
+    """
+
+    name = "find_duplicate_stop"
+
+    def prepare(self, n):
+        stops = make_stops(n)
+        duplicates = [GtfsStop(f"D{i}", s.lat, s.lon, s.name, f"D{i}")
+                      for i, s in enumerate(stops[::4])]
+
+        def run():
+            schedule = Schedule()
+            for stop in stops + duplicates:
+                schedule.add_stop(stop, deduplicate=True)
+        return run
+
+
+class StopByRefCase(ScalingCase):
+
+    name = "get_stop_by_ref"
+
+    def prepare(self, n):
+        schedule = Schedule()
+        for stop in make_stops(n):
+            schedule.add_stop(stop)
+        refs = [str(i) for i in range(0, n, 2)] + ["missing"] * (n // 2)
+
+        def run():
+            for ref in refs:
+                schedule.get_stop_by_ref(ref)
+        return run
+
+
+class SyntheticTrip(GtfsTrip):
+
+    @property
+    def name(self):
+        return self.headsign
+
+
+class SyntheticRoute(GtfsRoute):
+
+    @property
+    def name(self):
+        return self._name
+
+
+def make_route_trips(schedule, stops, route_id, n_trips, variants):
+    """
+    Route with n_trips trips of 10 stops, on variants distinct sequences
+    """
+    route = SyntheticRoute(route_id, route_id, route_id)
+    schedule.add_route(route)
+
+    for k in range(n_trips):
+        variant = k % variants
+        trip = SyntheticTrip(f"{route_id}-{k}", route_id, "A",
+                             shape_id=f"{route_id}-{variant}")
+        for seq in range(10):
+            trip.add_stop(seq, stops[(variant + seq) % len(stops)])
+        route.add_trip(trip)
+        schedule.add_trip(trip)
+
+    return route
+
+
+class DropTripsCase(ScalingCase):
+    """
+    Schedule.drop_trips called once per route, as remove_duplicated_trips
+    does, on routes of 20 trips
+    """
+
+    name = "drop_trips"
+
+    def prepare(self, n):
+        stops = make_stops(100)
+        schedule = Schedule()
+        routes = [make_route_trips(schedule, stops, f"R{r}", 20, 4)
+                  for r in range(n // 20)]
+        trip_ids = [[t.id for t in route.trips[::2]] for route in routes]
+
+        def run():
+            for ids in trip_ids:
+                schedule.drop_trips(ids)
+        return run
+
+
+class RemoveDuplicatedTripsCase(ScalingCase):
+    """
+    GtfsRoute.remove_duplicated_trips on a route with n trips, half of them
+    distinct
+    """
+
+    name = "remove_duplicated_trips"
+
+    def prepare(self, n):
+        stops = make_stops(n)
+        schedule = Schedule()
+        route = make_route_trips(schedule, stops, "R", n, n // 2)
+        return route.remove_duplicated_trips
+
+
+class MissingStopsCase(ScalingCase):
+    """
+    StopConflator.stops_with_refs_only_in_gtfs, with 10% of GTFS stops
+    missing in OSM
+    """
+
+    name = "stops_with_refs_only_in_gtfs"
+
+    def prepare(self, n):
+        gtfs_stops = make_stops(n)
+        osm_stops = [s for s in make_stops(n, "O") if int(s.ref) % 10]
+        conflator = StopConflator(gtfs_stops, osm_stops)
+        return conflator.stops_with_refs_only_in_gtfs
+
+
+CASES = [
+    AddStopCase(),
+    StopByRefCase(),
+    DropTripsCase(),
+    RemoveDuplicatedTripsCase(),
+    MissingStopsCase(),
+]
+
+
+class ScalingHarness(object):
+    """
+    Time each case at increasing sizes and fit the growth exponent
+
+    Sizes stop increasing once a run takes more than time_limit seconds, so
+    that a quadratic regression is detected without waiting for it. A case
+    fails when its exponent exceeds the expected one by more than
+    tolerance.
+    """
+
+    def __init__(self, sizes, tolerance=0.3, repeat=3, time_limit=2):
+        self.sizes = sizes
+        self.tolerance = tolerance
+        self.repeat = repeat
+        self.time_limit = time_limit
+
+    def measure(self, case):
+        sizes, times = [], []
+        for n in self.sizes:
+            best = None
+            for _ in range(self.repeat):
+                run = case.prepare(n)
+                # garbage collections triggered by earlier allocations
+                # would add noise unrelated to the operation
+                gc.collect()
+                gc.disable()
+                try:
+                    start = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - start
+                finally:
+                    gc.enable()
+                best = elapsed if best is None else min(best, elapsed)
+
+            sizes.append(n)
+            times.append(best)
+            if best > self.time_limit:
+                break
+
+        return sizes, times
+
+    def run(self, cases=CASES):
+        """
+        Print the exponent of each case, return the cases that failed
+        """
+        failures = []
+        print(f"{'operation':<30}{'exponent':>10}{'expected':>10}")
+        for case in cases:
+            sizes, times = self.measure(case)
+            if len(sizes) < 2:
+                print(f"{case.name:<30}{'-':>10}{case.exponent:>10}  "
+                      f"too slow to be measured")
+                failures.append(case)
+                continue
+
+            exponent = fit_exponent(sizes, times)
+            flag = ""
+            if exponent > case.exponent + self.tolerance:
+                failures.append(case)
+                flag = "  FAILED"
+            print(f"{case.name:<30}{exponent:>10.2f}{case.exponent:>10}{flag}")
+
+        return failures
@@ -0,0 +1,187 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synthetic import FeedGenerator
+
+from ..common_elements import Schedule
+from ..conflation.routes import RouteConflator
+from ..conflation.stops import StopConflator
+from ..gtfs.importer import GTFSImporter
+from ..osm.elements import OsmStop
+from ..osm.export import RouteExporter
+from ..osm.josm import JosmDocument
+from ..osm.overpass import OverpassImporter
+
+# not to be imported when the CLI starts, only by the commands using them
+HEAVY_MODULES = ["overpy", "requests", "haversine", "numpy"]
+
+
+def measure_startup():
+    """
+    Import gtfsimporter.main in a new interpreter, with -X importtime.
+    Return the time spent importing it, in seconds, and the heavy modules
+    it imported.
+    """
+    code = ("import sys, gtfsimporter.main; print(' '.join(m for m in "
+            f"{HEAVY_MODULES!r} if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=root, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+
+    # lines are "import time: <self us> | <cumulative us> | <module>", the
+    # module indented by its nesting level
+    elapsed = 0
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2] in (" gtfsimporter",
+                                              " gtfsimporter.main"):
+            elapsed += int(fields[1])
+
+    return elapsed / 1e6, result.stdout.split()
+
+
+class BenchmarkSuite(object):
+    """
+    Time the main steps of the importer on a synthetic feed
+
+    Each step runs `repeat` times and the following steps use the result of
+    its last run. Results are stored as JSON, and can be compared to the
+    results of a previous run, the baseline.
+    """
+
+    def __init__(self, scale, data_dir, repeat=3, seed=0):
+        self.scale = scale
+        self.data_dir = data_dir
+        self.repeat = repeat
+        self.seed = seed
+        self.results = {}
+
+        self.gtfs_dir = os.path.join(data_dir, "gtfs")
+        self.osm_xml = os.path.join(data_dir, "osm.xml")
+
+    def generate(self):
+        """
+        Generate the feed unless it was already generated with the same
+        parameters in data_dir
+        """
+        params = dict(self.scale.as_dict(), seed=self.seed)
+        params_file = os.path.join(self.data_dir, "params.json")
+
+        try:
+            with open(params_file) as f:
+                if json.load(f) == params:
+                    return False
+        except FileNotFoundError:
+            pass
+
+        generator = FeedGenerator(self.scale, self.seed)
+        generator.write_gtfs(self.gtfs_dir)
+        generator.write_osm(self.osm_xml)
+
+        with open(params_file, 'w') as f:
+            json.dump(params, f)
+        return True
+
+    def measure(self, name, func):
+        runs = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = func()
+            runs.append(time.perf_counter() - start)
+
+        self.results[name] = {
+            "min": min(runs),
+            "median": statistics.median(runs),
+            "runs": runs,
+        }
+        print(f"{name:<20}{min(runs):>10.3f}s")
+        return result
+
+    def load_gtfs(self):
+        return GTFSImporter(self.gtfs_dir).load(unique_trips=True)
+
+    def load_osm(self):
+        with open(self.osm_xml) as f:
+            xml = f.read()
+
+        schedule = Schedule()
+        OverpassImporter(None).load_routes(schedule, xml)
+        return schedule
+
+    def run(self):
+        gtfs = self.measure("gtfs_load", self.load_gtfs)
+        osm = self.measure("osm_load", self.load_osm)
+
+        stops = StopConflator(gtfs.stops, osm.stops)
+        self.measure("stop_conflation", stops.stops_with_refs_only_in_gtfs)
+
+        routes = RouteConflator(gtfs, osm)
+        self.measure("route_conflation", lambda: [
+            routes.find_matching_osm_routes(r) for r in gtfs.routes])
+
+        with tempfile.TemporaryDirectory(prefix="gtfsimporter-") as tmp_dir:
+            out_file = os.path.join(tmp_dir, "out.osm")
+            self.measure("stops_export",
+                         lambda: self.export_stops(gtfs.stops, out_file))
+            self.measure("routes_export",
+                         lambda: RouteExporter(osm).export(gtfs.routes, out_file))
+
+        return self.results
+
+    @classmethod
+    def export_stops(cls, gtfs_stops, out_file):
+        doc = JosmDocument()
+        doc.export_stops([OsmStop.fromGtfs(s) for s in gtfs_stops])
+        with open(out_file, 'w', encoding="utf-8") as f:
+            doc.write(f)
+
+    def as_dict(self):
+        return {
+            "scale": self.scale.as_dict(),
+            "seed": self.seed,
+            "repeat": self.repeat,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": self.results,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def compare(self, baseline, tolerance):
+        """
+        Print the ratio between each step and the baseline, return the
+        steps slower than the baseline by more than tolerance, e.g. 0.1
+        for 10%
+        """
+        if baseline["scale"] != self.scale.as_dict():
+            print("Warning: baseline was measured on a different scale")
+
+        regressions = []
+        print(f"{'step':<20}{'time':>10}{'baseline':>10}{'ratio':>8}")
+        for name, result in self.results.items():
+            base = baseline["results"].get(name)
+            if base is None:
+                print(f"{name:<20}{result['min']:>9.3f}s{'-':>10}")
+                continue
+
+            ratio = result["min"] / base["min"] if base["min"] else 1
+            flag = ""
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+                flag = "  slower"
+            print(f"{name:<20}{result['min']:>9.3f}s{base['min']:>9.3f}s"
+                  f"{ratio:>8.2f}{flag}")
+
+        return regressions
@@ -0,0 +1,240 @@
+import csv
+import os
+import random
+
+from xml.sax.saxutils import quoteattr
+
+from ..gtfs import ExoChamblyAgency, StmAgency
+
+
+class FeedScale(object):
+    """
+    Size of a synthetic feed. Each route has two directions, each direction
+    trips_per_direction trips of about stops_per_trip stops.
+    """
+
+    def __init__(self, name, agency, stops, routes, trips_per_direction,
+                 stops_per_trip, shape_points_per_stop=4):
+        self.name = name
+        self.agency = agency
+        self.stops = stops
+        self.routes = routes
+        self.trips_per_direction = trips_per_direction
+        self.stops_per_trip = stops_per_trip
+        self.shape_points_per_stop = shape_points_per_stop
+
+    def as_dict(self):
+        params = dict(vars(self))
+        params["agency"] = self.agency.id
+        return params
+
+
+SCALES = {
+    scale.name: scale for scale in [
+        FeedScale("exo", ExoChamblyAgency, 400, 20, 20, 25),
+        FeedScale("stl", StmAgency, 2600, 80, 100, 30),
+        FeedScale("stm", StmAgency, 9000, 220, 200, 35),
+        FeedScale("stm10x", StmAgency, 90000, 2200, 200, 35),
+    ]
+}
+
+
+class FeedGenerator(object):
+    """
+    Generate a GTFS dataset and the matching OSM XML, as returned by the
+    Overpass query of 'cache query-osm'.
+
+    Data are random but reproducible for a given seed. OSM data are close
+    to, but not in sync with, the GTFS dataset: some stops and routes are
+    missing, and OSM trips miss a stop and have two stops swapped, so that
+    conflation has work to do. Some GTFS trips are duplicated or truncated.
+    One route out of 10 has a stop missing in OSM and can't be exported.
+    """
+
+    OSM_STOP_RATIO = 0.9
+    OSM_ROUTE_RATIO = 0.8
+
+    # stops are spread over the island of Montreal
+    BBOX = (45.40, -73.95, 45.70, -73.50)
+
+    def __init__(self, scale, seed=0):
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.agency = scale.agency()
+
+        self.stops = self.make_stops()
+        self.osm_stops = set(i for i in range(scale.stops)
+                             if self.random.random() < self.OSM_STOP_RATIO)
+        self.routes = self.make_routes()
+
+    def make_stops(self):
+        south, west, north, east = self.BBOX
+        stops = []
+        for i in range(self.scale.stops):
+            lat = self.random.uniform(south, north)
+            lon = self.random.uniform(west, east)
+            stops.append((f"S{i}", f"Stop {i}", str(50000 + i), lat, lon))
+        return stops
+
+    def make_routes(self):
+        in_osm = sorted(self.osm_stops)
+        missing = sorted(set(range(self.scale.stops)) - self.osm_stops)
+
+        routes = []
+        for r in range(1, self.scale.routes + 1):
+            sequence = self.random.sample(in_osm, self.scale.stops_per_trip)
+            if r % 10 == 0 and missing:
+                sequence[-1] = self.random.choice(missing)
+            routes.append((str(r), sequence))
+        return routes
+
+    def route_row(self, route_id):
+        return {
+            "route_id": route_id,
+            "agency_id": self.agency.id,
+            "route_short_name": route_id,
+            "route_long_name": f"Route {route_id}",
+            "route_type": "3",
+            "route_url": "http://example.com/bus",
+        }
+
+    @classmethod
+    def write_csv(cls, path, header, rows):
+        with open(path, 'w', encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def write_gtfs(self, datadir):
+        os.makedirs(datadir, exist_ok=True)
+        path = lambda name: os.path.join(datadir, name)
+
+        self.write_csv(path("agency.txt"), ["agency_id", "agency_name"],
+                       [(self.agency.id, self.agency.name)])
+
+        self.write_csv(
+            path("stops.txt"),
+            ["stop_id", "stop_name", "stop_code", "stop_lat", "stop_lon",
+             "parent_station"],
+            [(i, name, ref, f"{lat:.6f}", f"{lon:.6f}", "")
+             for i, name, ref, lat, lon in self.stops])
+
+        header = list(self.route_row("").keys())
+        self.write_csv(path("routes.txt"), header,
+                       [list(self.route_row(r).values()) for r, _ in self.routes])
+
+        self.write_csv(
+            path("calendar.txt"),
+            ["service_id", "monday", "tuesday", "wednesday", "thursday",
+             "friday", "saturday", "sunday", "start_date", "end_date"],
+            [("WEEK", 1, 1, 1, 1, 1, 0, 0, "20260101", "20261231")])
+
+        with open(path("trips.txt"), 'w', encoding="utf-8", newline="") as trips_file, \
+                open(path("stop_times.txt"), 'w', encoding="utf-8", newline="") as times_file, \
+                open(path("shapes.txt"), 'w', encoding="utf-8", newline="") as shapes_file:
+            trips = csv.writer(trips_file)
+            times = csv.writer(times_file)
+            shapes = csv.writer(shapes_file)
+
+            trips.writerow(["route_id", "service_id", "trip_id",
+                            "trip_headsign", "shape_id"])
+            times.writerow(["trip_id", "arrival_time", "departure_time",
+                            "stop_id", "stop_sequence"])
+            shapes.writerow(["shape_id", "shape_pt_lat", "shape_pt_lon",
+                             "shape_pt_sequence"])
+
+            for route_id, sequence in self.routes:
+                for direction, stops in (("N", sequence),
+                                         ("S", sequence[::-1])):
+                    shape_id = f"SH{route_id}{direction}"
+                    shapes.writerows(self.shape_rows(shape_id, stops))
+
+                    for k in range(self.scale.trips_per_direction):
+                        trip_id = f"T{route_id}{direction}{k}"
+                        trips.writerow([route_id, "WEEK", trip_id,
+                                        f"{route_id}-{direction}", shape_id])
+
+                        # one trip out of 5 is a short run, truncated
+                        trip_stops = stops if k % 5 else stops[:-3]
+                        start = 5 * 3600 + k * 300
+                        for n, stop in enumerate(trip_stops):
+                            t = start + n * 90
+                            t = f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+                            times.writerow([trip_id, t, t, f"S{stop}", n + 1])
+
+    def shape_rows(self, shape_id, stops):
+        n = self.scale.shape_points_per_stop
+        seq = 0
+        for a, b in zip(stops, stops[1:]):
+            _, _, _, lat1, lon1 = self.stops[a]
+            _, _, _, lat2, lon2 = self.stops[b]
+            for k in range(n):
+                seq += 1
+                lat = lat1 + (lat2 - lat1) * k / n
+                lon = lon1 + (lon2 - lon1) * k / n
+                yield shape_id, f"{lat:.6f}", f"{lon:.6f}", seq
+
+    def write_osm(self, path):
+        route = self.agency.routes.make(self.route_row("0"))
+        network, operator = route.network, route.operator
+        meta = 'version="1" timestamp="2020-01-01T00:00:00Z" changeset="1" ' \
+               'uid="1" user="benchmark"'
+
+        with open(path, 'w', encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<osm version="0.6" generator="gtfsimporter benchmark">\n')
+
+            for i, (_, name, ref, lat, lon) in enumerate(self.stops):
+                if i not in self.osm_stops:
+                    continue
+                f.write(f'<node id="{1000000 + i}" lat="{lat:.6f}" '
+                        f'lon="{lon:.6f}" {meta}>'
+                        f'<tag k="public_transport" v="platform"/>'
+                        f'<tag k="highway" v="bus_stop"/>'
+                        f'<tag k="bus" v="yes"/>'
+                        f'<tag k="ref" v="{ref}"/>'
+                        f'<tag k="name" v={quoteattr(name)}/></node>\n')
+
+            relation_id = 2000000
+            for route_id, sequence in self.routes:
+                if self.random.random() > self.OSM_ROUTE_RATIO:
+                    continue
+
+                # OSM routes only reference stops existing in OSM
+                sequence = [s for s in sequence if s in self.osm_stops]
+
+                trip_ids = []
+                for direction, stops in (("N", sequence),
+                                         ("S", sequence[::-1])):
+                    stops = stops[:3] + stops[4:]
+                    stops[5], stops[8] = stops[8], stops[5]
+
+                    relation_id += 1
+                    trip_ids.append(relation_id)
+                    members = "".join(
+                        f'<member type="node" ref="{1000000 + s}" role="platform"/>'
+                        for s in stops)
+                    f.write(f'<relation id="{relation_id}" {meta}>{members}'
+                            f'<member type="way" ref="{relation_id}" role=""/>'
+                            f'<tag k="type" v="route"/>'
+                            f'<tag k="route" v="bus"/>'
+                            f'<tag k="public_transport:version" v="2"/>'
+                            f'<tag k="ref" v="{route_id}"/>'
+                            f'<tag k="network" v={quoteattr(network)}/>'
+                            f'<tag k="operator" v={quoteattr(operator)}/>'
+                            f'<tag k="name" v="Bus {route_id} {direction}"/>'
+                            f'</relation>\n')
+
+                relation_id += 1
+                members = "".join(f'<member type="relation" ref="{t}" role=""/>'
+                                  for t in trip_ids)
+                f.write(f'<relation id="{relation_id}" {meta}>{members}'
+                        f'<tag k="type" v="route_master"/>'
+                        f'<tag k="route_master" v="bus"/>'
+                        f'<tag k="ref" v="{route_id}"/>'
+                        f'<tag k="network" v={quoteattr(network)}/>'
+                        f'<tag k="operator" v={quoteattr(operator)}/>'
+                        f'<tag k="name" v="Bus {route_id}"/>'
+                        f'</relation>\n')
+
+            f.write('</osm>\n')
@@ -0,0 +1,178 @@
+import sys
+import tempfile
+
+
+class BenchmarkParser(object):
+
+    @classmethod
+    def generate_feed(cls, args):
+        from ..benchmark.synthetic import SCALES, FeedGenerator
+
+        generator = FeedGenerator(SCALES[args.scale], args.seed)
+        generator.write_gtfs(args.output_dir)
+        if args.osm_xml:
+            generator.write_osm(args.osm_xml)
+
+    @classmethod
+    def run_benchmarks(cls, args):
+        # imported here as the suite imports every part of the importer
+        import json
+
+        from ..benchmark.suite import BenchmarkSuite
+        from ..benchmark.synthetic import SCALES
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+
+        with tempfile.TemporaryDirectory(prefix="gtfsimporter-") as tmp_dir:
+            suite = BenchmarkSuite(SCALES[args.scale], args.data_dir or tmp_dir,
+                                   args.repeat, args.seed)
+            if suite.generate():
+                print(f"Generated '{args.scale}' feed in {suite.data_dir}")
+            suite.run()
+
+        if args.output_file:
+            suite.write(args.output_file)
+
+        if baseline is not None:
+            print("")
+            regressions = suite.compare(baseline, args.tolerance)
+            if regressions:
+                print(f"{len(regressions)} step(s) slower than the baseline")
+                sys.exit(1)
+
+    @classmethod
+    def check_scaling(cls, args):
+        from ..benchmark.scaling import CASES, ScalingHarness
+
+        cases = CASES
+        if args.operation:
+            cases = [c for c in CASES if c.name in args.operation.split(",")]
+
+        sizes = [int(s) for s in args.sizes.split(",")]
+        harness = ScalingHarness(sizes, args.tolerance)
+        failures = harness.run(cases)
+        if failures:
+            print(f"{len(failures)} operation(s) grow faster than expected")
+            sys.exit(1)
+
+    @classmethod
+    def check_startup(cls, args):
+        from ..benchmark.suite import measure_startup
+
+        elapsed, modules = measure_startup()
+        print(f"Importing gtfsimporter.main took {elapsed * 1000:.1f} ms")
+
+        failed = False
+        if elapsed > args.budget / 1000:
+            print(f"Above the budget of {args.budget} ms")
+            failed = True
+        if modules:
+            print(f"Heavy modules imported at startup: {', '.join(modules)}")
+            failed = True
+        if failed:
+            sys.exit(1)
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers, help):
+        # imported here, synthetic feeds only depend on agency classes
+        from ..benchmark.synthetic import SCALES
+
+        benchmark_parser = subparsers.add_parser(
+            "benchmark",
+            help=help)
+
+        benchmark_subparsers = benchmark_parser.add_subparsers()
+
+        # COMMAND: benchmark generate
+        generate_parser = benchmark_subparsers.add_parser(
+            "generate",
+            help="Generate a synthetic GTFS dataset and matching OSM data")
+        generate_parser.add_argument(
+            "--scale",
+            choices=SCALES.keys(),
+            default="exo",
+            help="Size of the dataset, 'exo' by default")
+        generate_parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed of the random generator")
+        generate_parser.add_argument(
+            "--output-dir",
+            required=True,
+            help="Directory to store GTFS files")
+        generate_parser.add_argument(
+            "--osm-xml",
+            help="File to store OSM data, as returned by 'cache query-osm'")
+        generate_parser.set_defaults(func=BenchmarkParser.generate_feed)
+
+        # COMMAND: benchmark run
+        run_parser = benchmark_subparsers.add_parser(
+            "run",
+            help="Time loading, conflation and export of a synthetic dataset")
+        run_parser.add_argument(
+            "--scale",
+            choices=SCALES.keys(),
+            default="exo",
+            help="Size of the dataset, 'exo' by default")
+        run_parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed of the random generator")
+        run_parser.add_argument(
+            "--data-dir",
+            help="Directory where the dataset is generated, and kept for "
+                 "next runs. Temporary directory if not set")
+        run_parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of runs of each step, the fastest one is kept")
+        run_parser.add_argument(
+            "--output-file",
+            help="File to store results as JSON")
+        run_parser.add_argument(
+            "--baseline",
+            help="Results of a previous run to compare with")
+        run_parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.1,
+            help="Slowdown relative to the baseline above which a step is "
+                 "reported, 0.1 (10%%) by default")
+        run_parser.set_defaults(func=BenchmarkParser.run_benchmarks)
+
+        # COMMAND: benchmark scaling
+        scaling_parser = benchmark_subparsers.add_parser(
+            "scaling",
+            help="Check that Schedule and conflation operations don't grow "
+                 "faster than expected with the size of their input")
+        scaling_parser.add_argument(
+            "--sizes",
+            default="2000,4000,8000,16000,32000",
+            help="Comma-separated input sizes")
+        scaling_parser.add_argument(
+            "--operation",
+            help="Comma-separated operations to check, all by default")
+        scaling_parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.3,
+            help="Margin above the expected growth exponent, 0.3 by default")
+        scaling_parser.set_defaults(func=BenchmarkParser.check_scaling)
+
+        # COMMAND: benchmark startup
+        startup_parser = benchmark_subparsers.add_parser(
+            "startup",
+            help="Check the time taken to import the CLI, and that it "
+                 "doesn't import heavy dependencies")
+        startup_parser.add_argument(
+            "--budget",
+            type=float,
+            default=50,
+            help="Maximum import time, in milliseconds, 50 by default")
+        startup_parser.set_defaults(func=BenchmarkParser.check_startup)
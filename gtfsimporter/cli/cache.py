@@ -1,8 +1,10 @@
 
+import os
 import pickle
 
-from .loader import DatadirGtfsLoader, GtfsLoader, XmlOsmLoader
-from ..osm.overpass import OverpassImporter
+from .loader import DatadirGtfsLoader, GtfsLoader, OverpassOsmLoader, \
+    PickleGtfsLoader, XmlOsmLoader
+from ..gtfs.filter import GtfsFilter
 
 class CacheParser(object):
 
@@ -12,52 +14,74 @@ class CacheParser(object):
             print("--gtfs-datadir must be specified")
             return
 
-        gtfs_schedule = DatadirGtfsLoader.load_gtfs_datadir(args.gtfs_datadir)
+        if args.without_routes and args.with_shapes:
+            print("--without-routes and --with-shapes are mutually exclusive")
+            return
 
-        with open(args.output_file, 'wb') as f:
-            # Pickle the 'data' dictionary using the highest protocol available.
-            pickle.dump(gtfs_schedule, f, pickle.HIGHEST_PROTOCOL)
+        if args.without_routes:
+            profile = "stops"
+        elif args.with_shapes:
+            profile = "shapes"
+        else:
+            profile = "routes"
+
+        gtfs_schedule = DatadirGtfsLoader.load_profile(
+            args.gtfs_datadir, profile, GtfsFilter.from_args(args),
+            args.trip_policy)
+        PickleGtfsLoader.write_gtfs_pickle(gtfs_schedule, args.output_file,
+                                           profile)
 
     @classmethod
-    def generate_osm_xml(cls, args):
+    def generate_gtfs_sqlite(cls, args):
+        from ..database import SqliteSchedule
 
-        gtfs_schedule = GtfsLoader.load_only_stops(args)
+        # the database is built from scratch, not merged with an older one
+        if os.path.exists(args.output_file):
+            os.remove(args.output_file)
+
+        gtfs_schedule = SqliteSchedule(args.output_file)
+        DatadirGtfsLoader.load_gtfs_datadir(args.gtfs_datadir,
+                                            schedule=gtfs_schedule,
+                                            trip_policy=args.trip_policy)
+        gtfs_schedule.vacuum()
+        gtfs_schedule.close()
+
+    @classmethod
+    def generate_gtfs_columnar(cls, args):
+        from ..columnar import ColumnarCache
 
-        bbox = gtfs_schedule.get_bounding_box(1000)
+        gtfs_schedule = DatadirGtfsLoader.load_gtfs_datadir(
+            args.gtfs_datadir, trip_policy=args.trip_policy)
+        ColumnarCache.write(gtfs_schedule, args.output_dir)
+
+    @classmethod
+    def generate_osm_xml(cls, args):
+        # overpy and requests are slow to import, only load them when needed
+        from ..osm.overpass import OverpassImporter
+
+        bbox = GtfsLoader.load_bounding_box(args, 1000)
         loader = OverpassImporter(bbox)
         loader.generate_cache_routes(args.output_file)
 
     @classmethod
     def generate_osm_pickle(cls, args):
-        try:
-            # This will raise an exception if --osm-xml is not set
+        if args.osm_xml is not None:
             osm_schedule = XmlOsmLoader.load_from_args(args)
-        except:
-            # No XML case, then load GTFS to get the bounding box
-            # to then query OSM and build the schedule
-            # This will potentially also raise an exception
-            try:
-                gtfs_schedule = GtfsLoader.load_from_args(args)
-
-                bbox = gtfs_schedule.get_bounding_box(1000)
-                loader = OverpassImporter(bbox)
-
-                osm_schedule = Schedule()
-                loader.load_routes(osm_schedule, None)
-            except:
-                raise AttributeError(
-                        "--gtfs-datadir, --gtfs-pickle, or --osm-xml must be specified")
+        else:
+            # No XML case, query OSM around the GTFS stops, only their
+            # coordinates being read
+            osm_schedule = OverpassOsmLoader.load_from_args(args)
 
         with open(args.output_file, 'wb') as f:
             pickle.dump(osm_schedule, f, pickle.HIGHEST_PROTOCOL)
 
 
     @classmethod
-    def setup_arguments(cls, top_level_parser, top_level_subparsers):
+    def setup_arguments(cls, top_level_parser, top_level_subparsers, help):
         # setup GtfsLoader as we need to load it
         cache_parser = top_level_subparsers.add_parser(
             "cache",
-            help="Cache-related submenu")
+            help=help)
 
         cache_subparsers = cache_parser.add_subparsers()
 
@@ -65,15 +89,18 @@ class CacheParser(object):
         pickle_gtfs_parser = cache_subparsers.add_parser(
             "pickle-gtfs",
             help="Pickle GTFS dataset to speed up next runs")
-        # TODO: reimplement these features
-        #pickle_gtfs_parser.add_argument(
-        #    "--without-routes",
-        #    action="store_false",
-        #    help="Skip routes, generating a stop-only cache")
-        #pickled_gtfs_parser.add_argument(
-        #    "--with-shapes",
-        #    action="store_true",
-        #    help="include routes' shapes, skipped otherwise")
+        pickle_gtfs_parser.add_argument(
+            "--without-routes",
+            action="store_true",
+            help="Skip routes, generating a stop-only cache")
+        pickle_gtfs_parser.add_argument(
+            "--with-shapes",
+            action="store_true",
+            help="include routes' shapes, skipped otherwise")
+        pickle_gtfs_parser.add_argument(
+            "--route-ref",
+            help="List of route references to cache, comma-separated")
+        GtfsFilter.setup_arguments(pickle_gtfs_parser)
         pickle_gtfs_parser.add_argument(
             "--output-file",
             required=True,
@@ -81,9 +108,42 @@ class CacheParser(object):
 
         DatadirGtfsLoader.setup_arguments(pickle_gtfs_parser, top_level_subparsers,
                                           required=True)
+        DatadirGtfsLoader.setup_policy_argument(pickle_gtfs_parser)
         pickle_gtfs_parser.set_defaults(func=CacheParser.generate_gtfs_pickle)
 
 
+        # COMMAND: cache sqlite-gtfs
+        sqlite_gtfs_parser = cache_subparsers.add_parser(
+            "sqlite-gtfs",
+            help="Store GTFS dataset in a SQLite database, for datasets too "
+                 "large to be pickled")
+        sqlite_gtfs_parser.add_argument(
+            "--output-file",
+            required=True,
+            help="File to store the generated database, replaced if it exists")
+
+        DatadirGtfsLoader.setup_arguments(sqlite_gtfs_parser, top_level_subparsers,
+                                          required=True)
+        DatadirGtfsLoader.setup_policy_argument(sqlite_gtfs_parser)
+        sqlite_gtfs_parser.set_defaults(func=CacheParser.generate_gtfs_sqlite)
+
+
+        # COMMAND: cache columnar-gtfs
+        columnar_gtfs_parser = cache_subparsers.add_parser(
+            "columnar-gtfs",
+            help="Store GTFS dataset as memory-mapped arrays, loaded "
+                 "instantly and shared by concurrent processes")
+        columnar_gtfs_parser.add_argument(
+            "--output-dir",
+            required=True,
+            help="Directory to store the generated arrays")
+
+        DatadirGtfsLoader.setup_arguments(columnar_gtfs_parser, top_level_subparsers,
+                                          required=True)
+        DatadirGtfsLoader.setup_policy_argument(columnar_gtfs_parser)
+        columnar_gtfs_parser.set_defaults(func=CacheParser.generate_gtfs_columnar)
+
+
         # COMMAND: cache query-osm
         query_osm_parser = cache_subparsers.add_parser(
             "query-osm",
@@ -0,0 +1,152 @@
+
+class GtfsParser(object):
+
+    @classmethod
+    def diff_feeds(cls, args):
+        # imported here, only this command needs it
+        from ..gtfs.diff import FeedDiff
+
+        diff = FeedDiff.compare(args.old_feed, args.new_feed)
+        diff.print_summary()
+
+        if args.output_file is not None:
+            diff.write(args.output_file)
+
+    @classmethod
+    def store_add(cls, args):
+        from ..gtfs.store import FeedStore
+
+        store = FeedStore(args.store)
+        try:
+            manifest = store.add(args.feed, args.version)
+        except ValueError as e:
+            print(e)
+            return
+
+        rows = sum(t["rows"] for t in manifest["tables"].values())
+        print(f"Version '{manifest['name']}' stored: {rows} rows, "
+              f"{manifest['written'] // 1024} KiB written, store is "
+              f"{store.size() // 1024} KiB")
+
+    @classmethod
+    def store_list(cls, args):
+        from ..gtfs.store import FeedStore
+
+        store = FeedStore(args.store)
+        for manifest in store.versions():
+            rows = sum(t["rows"] for t in manifest["tables"].values())
+            print(f"{manifest['name']}\t{manifest['added']}\t{rows} rows\t"
+                  f"{manifest['written'] // 1024} KiB written")
+        print(f"Store size: {store.size() // 1024} KiB")
+
+    @classmethod
+    def store_checkout(cls, args):
+        from ..gtfs.store import FeedStore
+
+        try:
+            FeedStore(args.store).checkout(args.version, args.output_dir)
+        except ValueError as e:
+            print(e)
+
+    @classmethod
+    def store_remove(cls, args):
+        from ..gtfs.store import FeedStore
+
+        try:
+            freed = FeedStore(args.store).remove(args.version)
+        except ValueError as e:
+            print(e)
+            return
+        print(f"Version '{args.version}' removed, {freed // 1024} KiB freed")
+
+    @classmethod
+    def setup_store_argument(cls, parser):
+        parser.add_argument(
+            "--store",
+            required=True,
+            help="Directory of the feed store")
+
+    @classmethod
+    def setup_diff_argument(cls, parser):
+        parser.add_argument(
+            "--diff",
+            help="Diff generated by 'gtfs diff', only consider the GTFS "
+                 "routes and stops it reports as changed")
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers, help):
+        gtfs_parser = subparsers.add_parser(
+            "gtfs",
+            help=help)
+
+        gtfs_subparsers = gtfs_parser.add_subparsers()
+
+        # COMMAND: gtfs diff
+        diff_parser = gtfs_subparsers.add_parser(
+            "diff",
+            help="Report stops, routes and stop patterns added, removed or "
+                 "modified between two versions of a GTFS dataset")
+        diff_parser.add_argument(
+            "--old-feed",
+            required=True,
+            help="Directory or zip archive of the previous version")
+        diff_parser.add_argument(
+            "--new-feed",
+            required=True,
+            help="Directory or zip archive of the new version")
+        diff_parser.add_argument(
+            "--output-file",
+            help="File to store the diff as JSON, to be given to route "
+                 "and stop exports with --diff")
+        diff_parser.set_defaults(func=GtfsParser.diff_feeds)
+
+        # COMMAND: gtfs store-add
+        store_add_parser = gtfs_subparsers.add_parser(
+            "store-add",
+            help="Add a version of a GTFS dataset to a feed store, rows "
+                 "identical to the ones of stored versions are not stored "
+                 "again")
+        cls.setup_store_argument(store_add_parser)
+        store_add_parser.add_argument(
+            "--feed",
+            required=True,
+            help="Directory or zip archive of the GTFS dataset")
+        store_add_parser.add_argument(
+            "--version",
+            help="Name of the version, the current date, YYYYMMDD, by "
+                 "default")
+        store_add_parser.set_defaults(func=GtfsParser.store_add)
+
+        # COMMAND: gtfs store-list
+        store_list_parser = gtfs_subparsers.add_parser(
+            "store-list",
+            help="List the versions of a feed store")
+        cls.setup_store_argument(store_list_parser)
+        store_list_parser.set_defaults(func=GtfsParser.store_list)
+
+        # COMMAND: gtfs store-checkout
+        store_checkout_parser = gtfs_subparsers.add_parser(
+            "store-checkout",
+            help="Write the GTFS files of a version of a feed store. "
+                 "Commands can also read it directly with --gtfs-store")
+        cls.setup_store_argument(store_checkout_parser)
+        store_checkout_parser.add_argument(
+            "--version",
+            help="Name of the version, the latest one by default")
+        store_checkout_parser.add_argument(
+            "--output-dir",
+            required=True,
+            help="Directory to write GTFS files to")
+        store_checkout_parser.set_defaults(func=GtfsParser.store_checkout)
+
+        # COMMAND: gtfs store-remove
+        store_remove_parser = gtfs_subparsers.add_parser(
+            "store-remove",
+            help="Remove a version of a feed store, and the data no other "
+                 "version uses")
+        cls.setup_store_argument(store_remove_parser)
+        store_remove_parser.add_argument(
+            "--version",
+            required=True,
+            help="Name of the version")
+        store_remove_parser.set_defaults(func=GtfsParser.store_remove)
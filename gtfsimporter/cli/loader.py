@@ -1,36 +1,92 @@
 
 import argparse
+import os
 import pickle
 
 from ..common_elements import Schedule
 
 from ..gtfs.importer import GTFSImporter
-from ..osm.overpass import OverpassImporter
+from ..gtfs.patterns import PatternStatistics
+from ..profiling import profiled
+
+
+# profiles of GTFS caches, from the cheapest to load to the most complete,
+# each one having everything the previous ones have: stops only, routes
+# without shapes, routes with their shapes
+GTFS_PROFILES = ["stops", "routes", "shapes"]
+
+
+def load_schedule(f):
+    """
+    Load a schedule from a pickle file, skipping its header if any
+    """
+    schedule = pickle.load(f)
+    if isinstance(schedule, dict):
+        schedule = pickle.load(f)
+    return schedule
+
+
+class HeaderUnpickler(pickle.Unpickler):
+    """
+    Unpickler of the header of a pickle file. Headers only hold builtin
+    types, a class is only looked up when there is no header, i.e. a
+    schedule is being loaded, which is then stopped right away.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("No header in this pickle")
 
 
 class DatadirGtfsLoader(object):
 
     @classmethod
-    def load_gtfs_datadir(cls, datadir, route_ids=None, unique_trips=True, shapes=False):
+    def importer(cls, datadir):
+        # versions of a feed store come with their own importer
+        if isinstance(datadir, GTFSImporter):
+            return datadir
+        return GTFSImporter(datadir)
+
+    @classmethod
+    def load_gtfs_datadir(cls, datadir, route_ids=None, unique_trips=True,
+                          shapes=False, truncated_trips=False, schedule=None,
+                          gtfs_filter=None, trip_policy="longest"):
         if datadir is None:
             print("Directory with GTFS files must be specified")
             return
 
-        loader = GTFSImporter(datadir)
+        loader = cls.importer(datadir)
         schedule = loader.load(route_ids, unique_trips=unique_trips,
-                               shapes=shapes)
-        schedule.remove_truncated_trips()
+                               shapes=shapes, schedule=schedule,
+                               gtfs_filter=gtfs_filter)
+        if not truncated_trips:
+            schedule.remove_truncated_trips(trip_policy)
 
         return schedule
 
     @classmethod
-    def load_only_stops(cls, datadir):
-        loader = GTFSImporter(datadir)
+    def load_only_stops(cls, datadir, gtfs_filter=None):
+        loader = cls.importer(datadir)
+
+        if gtfs_filter is not None:
+            return loader.load_filtered_stops(gtfs_filter)
 
         schedule = loader.load_stops()
 
         return schedule
 
+    @classmethod
+    def load_profile(cls, datadir, profile, gtfs_filter=None,
+                     trip_policy="longest"):
+        """
+        Load what profile needs, GTFS files not needed are not read
+        """
+        if profile == "stops":
+            return cls.load_only_stops(datadir, gtfs_filter)
+        else:
+            return cls.load_gtfs_datadir(datadir, shapes=profile == "shapes",
+                                         gtfs_filter=gtfs_filter,
+                                         trip_policy=trip_policy)
+
     @classmethod
     def load_from_args(cls, args):
         if args.gtfs_datadir:
@@ -45,20 +101,115 @@ class DatadirGtfsLoader(object):
             required=required,
             help="directory containing GTFS files")
 
+    @classmethod
+    def setup_policy_argument(cls, parser):
+        parser.add_argument(
+            "--trip-policy",
+            choices=PatternStatistics.POLICIES,
+            default="longest",
+            help="Trips kept for each headsign of a route: the one with the "
+                 "most stops (default), the one with the most occurrences, "
+                 "or the fewest serving all stops. Only applies to GTFS "
+                 "directories, caches are generated with it")
+
+
+class ScheduleCache(object):
+    """
+    Unpickled schedules kept in memory by a long-running process, e.g. the
+    schedule server, so that commands don't load them again. Entries are
+    identified by the absolute path and modification time of the pickle
+    file, a modified file is never served from the cache.
+    """
+
+    _schedules = {}
+
+    @classmethod
+    def _key(cls, path):
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns
+
+    @classmethod
+    def get(cls, path):
+        path, mtime = cls._key(path)
+        entry = cls._schedules.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load path in the cache if it is missing or outdated. Return True if
+        the schedule was (re)loaded.
+        """
+        if cls.get(path) is not None:
+            return False
+
+        abspath, mtime = cls._key(path)
+        with open(abspath, 'rb') as f:
+            schedule = load_schedule(f)
+
+        # swap the entry only once fully loaded
+        cls._schedules[abspath] = (mtime, schedule)
+        return True
+
 
 class PickleGtfsLoader(object):
+    """
+    GTFS pickles start with a header, a dict with the profile of the cache.
+    Pickles generated before headers existed have the routes profile.
+    """
 
     @classmethod
+    @profiled("load_pickle")
     def load_gtfs_pickle(cls, gtfs_pickle):
+        gtfs_schedule = ScheduleCache.get(gtfs_pickle)
+        if gtfs_schedule is not None:
+            return gtfs_schedule
+
         with open(gtfs_pickle, 'rb') as f:
-            gtfs_schedule = pickle.load(f)
+            gtfs_schedule = load_schedule(f)
 
         return gtfs_schedule
 
     @classmethod
-    def load_from_args(cls, args):
+    def write_gtfs_pickle(cls, gtfs_schedule, gtfs_pickle, profile):
+        with open(gtfs_pickle, 'wb') as f:
+            pickle.dump({"profile": profile}, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(gtfs_schedule, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def read_profile(cls, gtfs_pickle):
+        with open(gtfs_pickle, 'rb') as f:
+            try:
+                return HeaderUnpickler(f).load()["profile"]
+            except pickle.UnpicklingError:
+                return "routes"
+
+    @classmethod
+    def select_gtfs_pickle(cls, gtfs_pickles, profile):
+        """
+        Return the cheapest of gtfs_pickles having everything profile has
+        """
+        wanted = GTFS_PROFILES.index(profile)
+
+        candidates = []
+        for path in gtfs_pickles:
+            level = GTFS_PROFILES.index(cls.read_profile(path))
+            if level >= wanted:
+                candidates.append((level, path))
+
+        if not candidates:
+            raise AttributeError(
+                f"No GTFS pickle with {profile} among "
+                f"{', '.join(gtfs_pickles)}, see 'cache pickle-gtfs' options")
+
+        return min(candidates)[1]
+
+    @classmethod
+    def load_from_args(cls, args, profile="routes"):
         if args.gtfs_pickle:
-            return cls.load_pickled_gtfs(args.gtfs_pickle)
+            gtfs_pickle = cls.select_gtfs_pickle(args.gtfs_pickle, profile)
+            return cls.load_gtfs_pickle(gtfs_pickle)
         else:
             raise AttributeError("--gtfs-pickle must be set")
 
@@ -66,40 +217,155 @@ class PickleGtfsLoader(object):
     def setup_arguments(cls, parser, subparsers):
         parser.add_argument(
             "--gtfs-pickle",
-            help="GTFS pickle file, generated by 'cache pickle-gtfs'")
+            action="append",
+            help="GTFS pickle file, generated by 'cache pickle-gtfs'. Can be "
+                 "repeated with pickles of different profiles, the cheapest "
+                 "one having what the command needs is loaded")
+
+
+class SqliteGtfsLoader(object):
+
+    @classmethod
+    def load_gtfs_sqlite(cls, gtfs_sqlite):
+        # sqlite3 is only needed by this backend
+        from ..database import SqliteSchedule
+
+        if not os.path.exists(gtfs_sqlite):
+            raise FileNotFoundError(f"No such GTFS database: '{gtfs_sqlite}'")
+
+        return SqliteSchedule(gtfs_sqlite)
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers):
+        parser.add_argument(
+            "--gtfs-sqlite",
+            help="GTFS database, generated by 'cache sqlite-gtfs'. Slower "
+                 "than a pickle, but elements are only loaded when used")
+
+
+class ColumnarGtfsLoader(object):
+
+    @classmethod
+    def load_gtfs_columnar(cls, gtfs_columnar):
+        # numpy is slow to import, only load it when needed
+        from ..columnar import ColumnarCache
+
+        return ColumnarCache.load(gtfs_columnar)
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers):
+        parser.add_argument(
+            "--gtfs-columnar",
+            help="GTFS columnar cache directory, generated by "
+                 "'cache columnar-gtfs'. Memory-mapped, elements are only "
+                 "created when used")
+
+
+class StoreGtfsLoader(object):
+
+    @classmethod
+    def importer(cls, gtfs_store):
+        from ..gtfs.store import FeedStore
+
+        # DIR@VERSION, the latest version if not set
+        root, _, version = gtfs_store.rpartition("@")
+        if not root:
+            root, version = version, None
+        return FeedStore(root).importer(version)
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers):
+        parser.add_argument(
+            "--gtfs-store",
+            metavar="DIR[@VERSION]",
+            help="Version of a GTFS feed store, filled by 'gtfs store-add', "
+                 "the latest one if not set. Read like --gtfs-datadir")
 
 
 class GtfsLoader(object):
 
     @classmethod
-    def load_from_args(cls, args):
+    def load_from_args(cls, args, shapes=False, truncated_trips=False,
+                       gtfs_filter=None, unique_trips=True):
+        """
+        Load the GTFS schedule set in args. Only the part selected by
+        gtfs_filter is read from a GTFS directory, caches are fully loaded.
+        """
         if args.gtfs_pickle:
-            return PickleGtfsLoader.load_gtfs_pickle(args.gtfs_pickle)
-        elif args.gtfs_datadir:
-            return DatadirGtfsLoader.load_gtfs_datadir(args.gtfs_datadir)
+            profile = "shapes" if shapes else "routes"
+            return PickleGtfsLoader.load_from_args(args, profile)
+        elif args.gtfs_sqlite:
+            return SqliteGtfsLoader.load_gtfs_sqlite(args.gtfs_sqlite)
+        elif args.gtfs_columnar:
+            return ColumnarGtfsLoader.load_gtfs_columnar(args.gtfs_columnar)
+        elif args.gtfs_datadir or args.gtfs_store:
+            datadir = args.gtfs_datadir or \
+                StoreGtfsLoader.importer(args.gtfs_store)
+            return DatadirGtfsLoader.load_gtfs_datadir(
+                datadir, shapes=shapes, unique_trips=unique_trips,
+                truncated_trips=truncated_trips, gtfs_filter=gtfs_filter,
+                trip_policy=getattr(args, "trip_policy", "longest"))
         else:
-            raise AttributeError("--gtfs-datadir or --gtfs-pickle must be set")
+            raise AttributeError("--gtfs-datadir, --gtfs-pickle, --gtfs-sqlite, "
+                                 "--gtfs-columnar or --gtfs-store must be set")
+
+    @classmethod
+    def load_bounding_box(cls, args, margin=None):
+        """
+        Bounding box of the GTFS stops set in args, see
+        Schedule.get_bounding_box. Only their coordinates are read from a
+        GTFS dataset.
+        """
+        importer = cls.importer_from_args(args)
+        if importer is not None:
+            return importer.scan_bounding_box(margin)
+        return cls.load_only_stops(args).get_bounding_box(margin)
+
+    @classmethod
+    def importer_from_args(cls, args):
+        """
+        Importer of the GTFS dataset set in args, None for caches
+        """
+        if args.gtfs_datadir:
+            return DatadirGtfsLoader.importer(args.gtfs_datadir)
+        elif args.gtfs_store:
+            return StoreGtfsLoader.importer(args.gtfs_store)
+        return None
 
     @classmethod
     def load_only_stops(cls, args):
         if args.gtfs_pickle:
-            return PickleGtfsLoader.load_gtfs_pickle(args.gtfs_pickle)
+            return PickleGtfsLoader.load_from_args(args, "stops")
+        elif args.gtfs_sqlite:
+            return SqliteGtfsLoader.load_gtfs_sqlite(args.gtfs_sqlite)
+        elif args.gtfs_columnar:
+            return ColumnarGtfsLoader.load_gtfs_columnar(args.gtfs_columnar)
         elif args.gtfs_datadir:
             return DatadirGtfsLoader.load_only_stops(args.gtfs_datadir)
+        elif args.gtfs_store:
+            return DatadirGtfsLoader.load_only_stops(
+                StoreGtfsLoader.importer(args.gtfs_store))
         else:
-            raise AttributeError("--gtfs-datadir or --gtfs-pickle must be set")
+            raise AttributeError("--gtfs-datadir, --gtfs-pickle, --gtfs-sqlite, "
+                                 "--gtfs-columnar or --gtfs-store must be set")
 
     @classmethod
     def setup_arguments(cls, parser, subparsers, required=True):
         group = parser.add_mutually_exclusive_group(required=required)
         DatadirGtfsLoader.setup_arguments(group, subparsers)
         PickleGtfsLoader.setup_arguments(group, subparsers)
+        SqliteGtfsLoader.setup_arguments(group, subparsers)
+        ColumnarGtfsLoader.setup_arguments(group, subparsers)
+        StoreGtfsLoader.setup_arguments(group, subparsers)
 
 
 class XmlOsmLoader(object):
 
     @classmethod
     def load_from_args(cls, args):
+        # overpy and requests are slow to import, only load them when needed
+        from ..osm.overpass import OverpassImporter
+
         loader = OverpassImporter(None)
 
         if args.osm_xml is None:
@@ -126,9 +392,14 @@ class XmlOsmLoader(object):
 class PickleOsmLoader(object):
 
     @classmethod
+    @profiled("load_pickle")
     def load_osm_pickle(cls, osm_pickle):
+        osm_schedule = ScheduleCache.get(osm_pickle)
+        if osm_schedule is not None:
+            return osm_schedule
+
         with open(osm_pickle, 'rb') as f:
-            osm_schedule = pickle.load(f)
+            osm_schedule = load_schedule(f)
 
         return osm_schedule
 
@@ -146,6 +417,33 @@ class PickleOsmLoader(object):
             help="OSM pickle file, generated by 'cache pickle-osm'")
 
 
+class OverpassOsmLoader(object):
+
+    @classmethod
+    def start_from_args(cls, args):
+        """
+        Send the Overpass query of OSM routes around the GTFS stops set in
+        args, and return the OverpassFetch receiving its response in the
+        background
+        """
+        # overpy and requests are slow to import, only load them when needed
+        from ..osm.overpass import OverpassFetch
+
+        return OverpassFetch(GtfsLoader.load_bounding_box(args, 1000))
+
+    @classmethod
+    def load_from_args(cls, args):
+        return cls.start_from_args(args).load_routes()
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers):
+        parser.add_argument(
+            "--osm-query",
+            action="store_true",
+            help="Query OSM data from the Overpass API around the GTFS "
+                 "stops, while the GTFS dataset is loaded")
+
+
 class OsmLoader(object):
 
     @classmethod
@@ -154,29 +452,35 @@ class OsmLoader(object):
             return PickleOsmLoader.load_from_args(args)
         elif args.osm_xml:
             return XmlOsmLoader.load_from_args(args)
+        elif args.osm_query:
+            return OverpassOsmLoader.load_from_args(args)
         else:
-            raise AttributeError("--osm-xml or --osm-pickle must be set")
+            raise AttributeError("--osm-xml, --osm-pickle or --osm-query must be set")
 
     @classmethod
     def setup_arguments(cls, parser, subparsers):
         group = parser.add_mutually_exclusive_group(required=True)
         XmlOsmLoader.setup_arguments(group, subparsers)
         PickleOsmLoader.setup_arguments(group, subparsers)
+        OverpassOsmLoader.setup_arguments(group, subparsers)
 
 
 class SchedulesLoader(object):
 
     @classmethod
-    def load_from_args(cls, args):
-        gtfs = GtfsLoader.load_from_args(args)
-        osm = OsmLoader.load_from_args(args)
+    def load_from_args(cls, args, shapes=False, gtfs_filter=None):
+        # OSM data is downloaded while the GTFS dataset is loaded
+        fetch = OverpassOsmLoader.start_from_args(args) if args.osm_query else None
+        gtfs = GtfsLoader.load_from_args(args, shapes, gtfs_filter=gtfs_filter)
+        osm = fetch.load_routes() if fetch else OsmLoader.load_from_args(args)
 
         return gtfs, osm
 
     @classmethod
     def load_only_stops(cls, args):
+        fetch = OverpassOsmLoader.start_from_args(args) if args.osm_query else None
         gtfs = GtfsLoader.load_only_stops(args)
-        osm = OsmLoader.load_from_args(args)
+        osm = fetch.load_routes() if fetch else OsmLoader.load_from_args(args)
 
         return gtfs, osm
 
@@ -0,0 +1,80 @@
+from ..gtfs import agencies
+
+
+class PipelineParser(object):
+
+    @classmethod
+    def run_pipeline(cls, args):
+        # imported here, only this command needs it
+        from ..pipeline import Pipeline
+
+        names = None
+        if args.providers:
+            names = args.providers.split(",")
+            known = [a.provider for a in agencies]
+            unknown = [n for n in names if n not in known]
+            if unknown:
+                print(f"Unknown provider(s): {', '.join(unknown)}")
+                print(f"Supported providers: {', '.join(known)}")
+                return
+
+        pipeline = Pipeline.for_agencies(
+            args.work_dir, names, jobs=args.jobs,
+            refresh_sources=not args.no_refresh)
+        pipeline.run()
+
+        print("")
+        pipeline.print_report()
+
+    @classmethod
+    def write_providers(cls, args):
+        from ..pipeline import Provider, write_makefile
+
+        providers = [Provider(a, "") for a in agencies]
+        with open(args.output_file, 'w') as f:
+            write_makefile(providers, f)
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers, help):
+        pipeline_parser = subparsers.add_parser(
+            "pipeline",
+            help=help)
+
+        pipeline_subparsers = pipeline_parser.add_subparsers()
+
+        # COMMAND: pipeline run
+        run_parser = pipeline_subparsers.add_parser(
+            "run",
+            help="Fetch GTFS datasets and OSM data, generate caches and "
+                 "export routes of all providers")
+        run_parser.add_argument(
+            "--work-dir",
+            default="work",
+            help="Directory storing the files of each provider, 'work' "
+                 "by default as in the Makefile")
+        run_parser.add_argument(
+            "--providers",
+            help="List of providers to process, comma-separated, all "
+                 "providers by default")
+        run_parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of stages run concurrently")
+        run_parser.add_argument(
+            "--no-refresh",
+            action="store_true",
+            help="Don't download GTFS archives and query OSM again if "
+                 "files of a previous run exist")
+        run_parser.set_defaults(func=PipelineParser.run_pipeline)
+
+        # COMMAND: pipeline providers
+        providers_parser = pipeline_subparsers.add_parser(
+            "providers",
+            help="Write the make variables of all providers, i.e. "
+                 "providers.mk")
+        providers_parser.add_argument(
+            "--output-file",
+            required=True,
+            help="Output file")
+        providers_parser.set_defaults(func=PipelineParser.write_providers)
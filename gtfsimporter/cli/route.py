@@ -1,64 +1,121 @@
 
 import sys
 
-from .loader import GtfsLoader, SchedulesLoader
+from .gtfs import GtfsParser
+from .loader import DatadirGtfsLoader, GtfsLoader, SchedulesLoader
 
 from ..conflation.routes import RouteConflator
-from ..osm.elements import OsmRoute
+from ..gtfs.filter import GtfsFilter
+from ..gtfs.patterns import PatternStatistics, format_time
 from ..osm.josm import JosmDocument
+from ..profiling import Profiler
 
 class RouteParser(object):
 
     @classmethod
     def generate_routes(cls, args):
-        gtfs, osm = SchedulesLoader.load_from_args(args)
+        gtfs, osm = SchedulesLoader.load_from_args(
+            args, shapes=args.shape_tolerance is not None,
+            gtfs_filter=cls.route_filter(args))
 
-        if args.route_ref is None:
-            selected_routes = gtfs.routes
-        else:
+        selected_routes = cls.diff_routes(args, gtfs.routes)
+        selected_routes = cls.stop_routes(args, gtfs, osm, selected_routes)
+        if args.route_ref is not None:
             wanted_refs = args.route_ref.split(",")
-            selected_routes = [r for r in gtfs.routes if r.ref in wanted_refs]
+            selected_routes = [r for r in selected_routes if r.ref in wanted_refs]
 
-        cls.__export_gtfs_routes(selected_routes, osm, args.output_file)
+        cls.__export_gtfs_routes(selected_routes, osm, args.output_file,
+                                 args.jobs, args.shape_tolerance)
 
 
     @classmethod
     def generate_missing_routes(cls, args):
-        gtfs, osm = SchedulesLoader.load_from_args(args)
+        gtfs, osm = SchedulesLoader.load_from_args(
+            args, shapes=args.shape_tolerance is not None)
 
         missing_routes = []
         conflator = RouteConflator(gtfs, osm)
 
-        for route in gtfs.routes:
-            try:
-                osm_route = cls.get_osm_route(conflator, route)
-                if not osm_route:
-                    missing_routes.append(route)
-            except Exception as e:
-                print(f"Error when looking for OSM route {route.ref}: {e}")
-                continue
+        with Profiler.stage("conflation"):
+            for route in gtfs.routes:
+                try:
+                    osm_route = cls.get_osm_route(conflator, route)
+                    if not osm_route:
+                        missing_routes.append(route)
+                except Exception as e:
+                    print(f"Error when looking for OSM route {route.ref}: {e}")
+                    continue
 
         for route in missing_routes:
             print(f"Exporting route '{route.ref}'")
-        cls.__export_gtfs_routes(missing_routes, osm, args.output_file)
+        cls.__export_gtfs_routes(missing_routes, osm, args.output_file,
+                                 args.jobs, args.shape_tolerance)
 
 
     @classmethod
-    def __export_gtfs_routes(cls, gtfs_routes, osm_schedule, out_file):
-        osm_routes = []
+    def __export_gtfs_routes(cls, gtfs_routes, osm_schedule, out_file, jobs=1,
+                             shape_tolerance=None):
+        # multiprocessing is only needed to export routes
+        from ..osm.export import RouteExporter
 
-        for route in gtfs_routes:
-            try:
-                osm_route = OsmRoute.fromGtfs(route, osm_schedule)
-                osm_routes.append(osm_route)
-            except Exception as e:
-                print(f"Unable to generate route {route.ref}: {e}")
+        exporter = RouteExporter(osm_schedule, jobs, shape_tolerance)
+        failures = exporter.export(gtfs_routes, out_file)
 
-        doc = JosmDocument()
-        doc.export_routes(osm_routes)
-        with open(out_file, 'w', encoding="utf-8") as output_file:
-            doc.write(output_file)
+        if failures:
+            print(f"Unable to generate {len(failures)} route(s):")
+        for route, error in failures:
+            print(f"\t{route.ref}: {error}")
+
+
+    @classmethod
+    def route_filter(cls, args):
+        # only routes with these refs, running on these dates, are read
+        # from a GTFS directory
+        return GtfsFilter.from_args(args)
+
+    @classmethod
+    def diff_routes(cls, args, routes):
+        # caches hold all routes, only keep the ones changed in the diff
+        if args.diff is None:
+            return list(routes)
+
+        from ..gtfs.diff import FeedDiff
+        route_ids = set(FeedDiff.load(args.diff).affected_routes)
+        return [r for r in routes if r.id in route_ids]
+
+    @classmethod
+    def stop_routes(cls, args, gtfs, osm, routes):
+        """
+        Keep the routes serving a stop of --stop-ref, in GTFS or in OSM,
+        OSM routes being matched by ref
+        """
+        if args.stop_ref is None:
+            return list(routes)
+
+        gtfs_routes, osm_routes = cls.find_stop_routes(
+            gtfs, osm, args.stop_ref.split(","))
+        route_ids = set(r.id for r in gtfs_routes)
+        route_refs = set(r.ref for r in osm_routes)
+        return [r for r in routes if r.id in route_ids or r.ref in route_refs]
 
+    @classmethod
+    def find_stop_routes(cls, gtfs, osm, stop_refs):
+        # reverse indexes of schedules, no trip is visited
+        gtfs_stops = [gtfs.get_stop_by_ref(ref) for ref in stop_refs]
+        osm_stops = [osm.get_stop_by_ref(ref) for ref in stop_refs]
+        return (gtfs.get_affected_routes(s.id for s in gtfs_stops if s),
+                osm.get_affected_routes(s.id for s in osm_stops if s))
+
+    @classmethod
+    def list_stop_routes(cls, args):
+        gtfs, osm = SchedulesLoader.load_from_args(args)
+
+        refs = args.stop_ref.split(",")
+        gtfs_routes, osm_routes = cls.find_stop_routes(gtfs, osm, refs)
+        for route in gtfs_routes:
+            print(f"GTFS route '{route.ref}' ({route.id})")
+        for route in osm_routes:
+            print(f"OSM route '{route.ref}' ({route.id})")
 
     @classmethod
     def get_osm_route(cls, conflator, gtfs_route):
@@ -107,46 +164,60 @@ class RouteParser(object):
 
     @classmethod
     def update_routes(cls, args):
-        gtfs, osm = SchedulesLoader.load_from_args(args)
+        gtfs, osm = SchedulesLoader.load_from_args(
+            args, gtfs_filter=cls.route_filter(args))
 
         conflator = RouteConflator(gtfs, osm)
 
+        if args.output_file is None and not args.dry_run:
+            print("--output-file must be specified")
+            return
+
+        gtfs_routes = cls.diff_routes(args, gtfs.routes)
+        gtfs_routes = cls.stop_routes(args, gtfs, osm, gtfs_routes)
+
         modified_routes = []
-        refs = args.route_ref.split(",")
+        if args.route_ref is None:
+            refs = [r.ref for r in gtfs_routes]
+        else:
+            refs = args.route_ref.split(",")
 
-        for gtfs_route in gtfs.routes:
-            if gtfs_route.ref not in refs:
-                continue
+        with Profiler.stage("conflation"):
+            for gtfs_route in gtfs_routes:
+                if gtfs_route.ref not in refs:
+                    continue
 
-            refs.remove(gtfs_route.ref)
+                refs.remove(gtfs_route.ref)
 
-            try:
-                osm_route = cls.get_osm_route(conflator, gtfs_route)
-                if not osm_route:
-                    print(f"Route with '{gtfs_route.ref}' not found in OSM")
+                try:
+                    osm_route = cls.get_osm_route(conflator, gtfs_route)
+                    if not osm_route:
+                        print(f"Route with '{gtfs_route.ref}' not found in OSM")
+                        continue
+                except Exception as e:
+                    print(f"Error when looking for OSM route {gtfs_route.ref}: {e}")
                     continue
-            except Exception as e:
-                print(f"Error when looking for OSM route {gtfs_route.ref}: {e}")
-                continue
 
-            try:
-                osm_route.merge_gtfs(gtfs_route, osm)
-            except Exception as e:
-                print(f"Route '{gtfs_route.ref}' update failed: {e}")
-                continue
+                try:
+                    osm_route.merge_gtfs(gtfs_route, osm)
+                except Exception as e:
+                    print(f"Route '{gtfs_route.ref}' update failed: {e}")
+                    continue
 
-            # check if the route or trips were modified
-            if osm_route.modified or any([t.modified for t in osm_route.trips]):
-                modified_routes.append(osm_route)
-                print(f"Route '{gtfs_route.ref}' updated")
-            else:
-                print(f"Route '{gtfs_route.ref} was not modified', skipping update")
+                # check if the route or trips were modified
+                if osm_route.modified or any([t.modified for t in osm_route.trips]):
+                    modified_routes.append(osm_route)
+                    print(f"Route '{gtfs_route.ref}' updated")
+                    if args.dry_run:
+                        cls.print_stop_edits(osm_route)
+                else:
+                    print(f"Route '{gtfs_route.ref} was not modified', skipping update")
 
         for ref in refs:
             print(f"Route '{ref}' does not match any route in GTFS dataset")
 
         # avoid creating an empty file
-        if not modified_routes:
+        if not modified_routes or args.dry_run:
             return
 
         doc = JosmDocument()
@@ -155,11 +226,127 @@ class RouteParser(object):
             doc.write(output_file)
 
     @classmethod
-    def setup_arguments(cls, parser, subparsers):
+    def match_trips(cls, args):
+        # imported here as numpy is only needed to match trips
+        from ..conflation.trips import TripMatcher
+
+        gtfs, osm = SchedulesLoader.load_from_args(args)
+
+        matcher = TripMatcher(gtfs.trips, threshold=args.threshold,
+                              osm_schedule=osm)
+
+        unmatched = 0
+        for osm_route in osm.routes:
+            for trip in osm_route.trips:
+                if trip.import_failed():
+                    continue
+
+                match = matcher.match(trip)
+                if match is None:
+                    unmatched += 1
+                    print(f"Trip '{trip.ref}' ({trip.id}): no matching GTFS trip")
+                else:
+                    gtfs_trip = match.gtfs_trip
+                    print(f"Trip '{trip.ref}' ({trip.id}): GTFS trip "
+                          f"'{gtfs_trip.ref}' of route '{gtfs_trip.route.ref}', "
+                          f"score {match.score:.2f}")
+
+        if unmatched:
+            print(f"{unmatched} trip(s) without match above {args.threshold}")
+
+    @classmethod
+    def inspect_routes(cls, args):
+        importer = GtfsLoader.importer_from_args(args)
+        # truncated trips are distinct stop sequences worth reporting, and
+        # duplicated ones are kept when read from a dataset, for their times
+        gtfs = GtfsLoader.load_from_args(args, truncated_trips=True,
+                                         unique_trips=importer is None,
+                                         gtfs_filter=cls.route_filter(args))
+
+        if args.route_ref is None:
+            routes = list(gtfs.routes)
+        else:
+            refs = args.route_ref.split(",")
+            routes = [r for r in gtfs.routes if r.ref in refs]
+            for ref in set(refs) - set(r.ref for r in routes):
+                print(f"Route '{ref}' not found in GTFS dataset")
+
+        statistics = PatternStatistics.from_routes(routes)
+        # caches don't have times
+        if importer is not None:
+            statistics.read_times(importer)
+
+        for route in routes:
+            patterns = statistics.get_patterns(route.id)
+            selected = statistics.select(route.id, args.trip_policy)
+            occurrences = sum(p.occurrences for p in patterns)
+            print(f"Route '{route.ref}' ({route.id}): {occurrences} trips, "
+                  f"{len(patterns)} stop patterns")
+
+            for pattern in patterns:
+                details = [f"{pattern.occurrences} occurrences",
+                           f"{len(pattern)} stops"]
+                if pattern.span is not None:
+                    details.append(f"from {format_time(pattern.first_departure)} "
+                                   f"to {format_time(pattern.last_arrival)}")
+                    details.append(f"typically {pattern.duration // 60} min")
+                if pattern in selected:
+                    details.append(f"kept by {args.trip_policy}")
+
+                print(f"Trip '{pattern.ref}' ({', '.join(details)})")
+                for stop in pattern.stops:
+                    print(f"{stop.lat} {stop.lon} * {stop.ref} * {stop.name}")
+                print("")
+
+    @classmethod
+    def print_stop_edits(cls, osm_route):
+        for trip in osm_route.trips:
+            if not trip.stop_edits:
+                continue
+
+            print(f"\tTrip '{trip.ref}' ({trip.id}): {len(trip.stop_edits)} stop edit(s)")
+            for edit in trip.stop_edits:
+                print(f"\t\t{edit}")
+
+    @classmethod
+    def setup_jobs_argument(cls, parser):
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of worker processes used to convert routes. Output "
+                 "is identical whatever the number of jobs")
+
+    @classmethod
+    def setup_geometry_argument(cls, parser):
+        parser.add_argument(
+            "--shape-tolerance",
+            type=float,
+            help="Export trips without ways with the geometry of their GTFS "
+                 "shape, simplified to this tolerance in meters. The GTFS "
+                 "schedule must include shapes")
+
+    @classmethod
+    def setup_stop_argument(cls, parser):
+        parser.add_argument(
+            "--stop-ref",
+            help="List of stop references, comma-separated. Only routes "
+                 "serving one of these stops, in GTFS or OSM, are considered")
+
+    @classmethod
+    def setup_date_argument(cls, parser):
+        parser.add_argument(
+            "--date",
+            help="Only consider trips running on this date, YYYYMMDD, or at "
+                 "least one day of this range, YYYYMMDD-YYYYMMDD. Only "
+                 "applies to --gtfs-datadir, caches are generated with it")
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers, help):
 
         route_parser = subparsers.add_parser(
             "routes",
-            help="route-related submenu")
+            help=help)
 
         route_subparsers = route_parser.add_subparsers()
 
@@ -175,7 +362,13 @@ class RouteParser(object):
             "--output-file",
             required=True,
             help="File to store generated routes")
+        cls.setup_jobs_argument(route_export_parser)
+        cls.setup_geometry_argument(route_export_parser)
+        cls.setup_date_argument(route_export_parser)
+        GtfsParser.setup_diff_argument(route_export_parser)
+        cls.setup_stop_argument(route_export_parser)
 
+        DatadirGtfsLoader.setup_policy_argument(route_export_parser)
         SchedulesLoader.setup_arguments(route_export_parser, subparsers)
         route_export_parser.set_defaults(func=RouteParser.generate_routes)
 
@@ -187,7 +380,10 @@ class RouteParser(object):
             "--output-file",
             required=True,
             help="File to store generated routes")
+        cls.setup_jobs_argument(route_missing_parser)
+        cls.setup_geometry_argument(route_missing_parser)
 
+        DatadirGtfsLoader.setup_policy_argument(route_missing_parser)
         SchedulesLoader.setup_arguments(route_missing_parser, subparsers)
         route_missing_parser.set_defaults(func=RouteParser.generate_missing_routes)
 
@@ -197,13 +393,62 @@ class RouteParser(object):
             help="Update existing OSM route")
         route_update_parser.add_argument(
             "--route-ref",
-            required=True,
             help="List of route references to update, comma-separated "
-                 ", eg. --route-ref 1234,5789")
+                 ", eg. --route-ref 1234,5789. All routes if not set")
         route_update_parser.add_argument(
             "--output-file",
-            required=True,
             help="File to store generated routes")
-
+        route_update_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report stop edits of each trip without generating a file")
+        cls.setup_date_argument(route_update_parser)
+        GtfsParser.setup_diff_argument(route_update_parser)
+        cls.setup_stop_argument(route_update_parser)
+
+        DatadirGtfsLoader.setup_policy_argument(route_update_parser)
         SchedulesLoader.setup_arguments(route_update_parser, subparsers)
         route_update_parser.set_defaults(func=RouteParser.update_routes)
+
+        # COMMAND: route match-trips
+        route_match_parser = route_subparsers.add_parser(
+            "match-trips",
+            help="Match OSM trips to the GTFS trips with the most similar stops")
+        route_match_parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.5,
+            help="Minimal similarity, between 0 and 1, of matching trips")
+
+        DatadirGtfsLoader.setup_policy_argument(route_match_parser)
+        SchedulesLoader.setup_arguments(route_match_parser, subparsers)
+        route_match_parser.set_defaults(func=RouteParser.match_trips)
+
+        # COMMAND: route affected
+        route_affected_parser = route_subparsers.add_parser(
+            "affected",
+            help="List the GTFS and OSM routes serving stops, e.g. to "
+                 "update only them after the stops changed")
+        route_affected_parser.add_argument(
+            "--stop-ref",
+            required=True,
+            help="List of stop references, comma-separated")
+
+        SchedulesLoader.setup_arguments(route_affected_parser, subparsers)
+        route_affected_parser.set_defaults(func=RouteParser.list_stop_routes)
+
+        # COMMAND: route inspect
+        route_inspect_parser = route_subparsers.add_parser(
+            "inspect",
+            help="List the stop patterns of GTFS routes, with their number "
+                 "of trips, and their service span and typical duration when "
+                 "read from a GTFS directory")
+        route_inspect_parser.add_argument(
+            "--route-ref",
+            help="List of route references to inspect, comma-separated "
+                 ", eg. --route-ref 1234,5789. All routes if not set")
+        cls.setup_date_argument(route_inspect_parser)
+
+        DatadirGtfsLoader.setup_policy_argument(route_inspect_parser)
+        GtfsLoader.setup_arguments(route_inspect_parser, subparsers)
+        route_inspect_parser.set_defaults(func=RouteParser.inspect_routes)
@@ -0,0 +1,166 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+
+from .loader import ScheduleCache
+
+
+class ScheduleRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Run one command sent by a client
+
+    A request is a single JSON line: {"argv": [...], "cwd": "..."}. Each
+    request is handled in a process forked from the server, so it sees the
+    schedules loaded by the server without copying them, and commands can
+    freely modify them without affecting other requests. The output of the
+    command is sent back as JSON lines {"out": "..."}, followed by
+    {"status": <exit status>}.
+    """
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            self.run_command(json.loads(self.rfile.readline()))
+        except (BrokenPipeError, ConnectionResetError):
+            # the client went away, there is no one left to report to
+            pass
+        finally:
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+    def run_command(self, request):
+        sys.stdout = sys.stderr = ClientStream(self)
+
+        status = 0
+        try:
+            os.chdir(request["cwd"])
+            parser = self.server.parser_factory(request["argv"])
+            args = parser.parse_args(request["argv"])
+            self.server.dispatch(parser, args, request["argv"])
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+
+        self.send({"status": status})
+
+
+class ClientStream(object):
+    """
+    File-like object forwarding writes to the client
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def write(self, text):
+        if text:
+            self.handler.send({"out": text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class ScheduleServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+
+    def __init__(self, path, pickles, parser_factory, dispatch):
+        self.pickles = pickles
+        self.parser_factory = parser_factory
+        self.dispatch = dispatch
+        super().__init__(path, ScheduleRequestHandler)
+
+    def refresh(self):
+        # schedules are reloaded in the server, before forking, so requests
+        # always see either the previous or the new version of a cache
+        for path in self.pickles:
+            try:
+                if ScheduleCache.load(path):
+                    print(f"Loaded {path}")
+            except Exception as e:
+                print(f"Unable to load {path}, keeping previous version: {e}")
+
+    def process_request(self, request, client_address):
+        self.refresh()
+        super().process_request(request, client_address)
+
+
+class ServerParser(object):
+
+    @classmethod
+    def start_server(cls, args):
+        # imported here to avoid a circular import with main
+        from ..main import build_parser, dispatch
+
+        pickles = [p for p in (args.gtfs_pickle, args.osm_pickle) if p]
+        if not pickles:
+            print("--gtfs-pickle or --osm-pickle must be specified")
+            return
+
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+        with ScheduleServer(args.socket, pickles, build_parser,
+                            dispatch) as server:
+            server.refresh()
+            print(f"Serving requests on {args.socket}")
+
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(args.socket)
+
+    @classmethod
+    def run_remote(cls, socket_path, argv):
+        """
+        Send a command to the server listening on socket_path and print its
+        output. Return the exit status of the command.
+        """
+        request = {"argv": argv, "cwd": os.getcwd()}
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError as e:
+                print(f"Unable to connect to server on {socket_path}: {e}")
+                return 1
+
+            sock.sendall(json.dumps(request).encode() + b"\n")
+
+            with sock.makefile("rb") as responses:
+                for line in responses:
+                    message = json.loads(line)
+                    if "status" in message:
+                        return message["status"]
+                    sys.stdout.write(message["out"])
+
+        print("Connection to the server lost")
+        return 1
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers, help):
+        server_parser = subparsers.add_parser(
+            "server",
+            help=help)
+        server_parser.add_argument(
+            "--socket",
+            required=True,
+            help="Path of the Unix socket to listen on")
+        server_parser.add_argument(
+            "--gtfs-pickle",
+            help="GTFS pickle file, generated by 'cache pickle-gtfs'")
+        server_parser.add_argument(
+            "--osm-pickle",
+            help="OSM pickle file, generated by 'cache pickle-osm'")
+        server_parser.set_defaults(func=ServerParser.start_server)
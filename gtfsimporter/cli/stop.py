@@ -1,23 +1,26 @@
+import sys
 
+from .gtfs import GtfsParser
 from .loader import GtfsLoader, SchedulesLoader
 
-from ..conflation.stops import StopConflator
 from ..osm.elements import OsmStop
 from ..osm.josm import JosmDocument
+from ..profiling import Profiler
 
 class StopParser(object):
 
     @classmethod
     def generate_stops(cls, args):
         gtfs_schedule = GtfsLoader.load_only_stops(args)
+        gtfs_stops = cls.diff_stops(args, gtfs_schedule)
 
         if args.stop_ref is None:
-            osm_stops = [OsmStop.fromGtfs(s) for s in gtfs_schedule.stops]
+            osm_stops = [OsmStop.fromGtfs(s) for s in gtfs_stops]
             wanted_refs = None
         else:
             wanted_refs = args.stop_ref.split(",")
             osm_stops = []
-            for stop in gtfs_schedule.stops:
+            for stop in gtfs_stops:
                 for ref in stop.refs:
                     if ref in wanted_refs:
                         osm_stop = OsmStop.fromGtfs(stop)
@@ -33,25 +36,43 @@ class StopParser(object):
             print("The following refs have not been found and were not exported:")
             print("\t", " ".join(wanted_refs))
 
+    @classmethod
+    def diff_stops(cls, args, gtfs_schedule):
+        if args.diff is None:
+            return gtfs_schedule.stops
+
+        from ..gtfs.diff import FeedDiff
+        changed = set()
+        for stop_id in FeedDiff.load(args.diff).affected_stops:
+            # deduplicated stops are found by the id of any of their aliases
+            stop = gtfs_schedule.get_stop(stop_id, None)
+            if stop is not None:
+                changed.add(stop.id)
+        return [s for s in gtfs_schedule.stops if s.id in changed]
+
     @classmethod
     def generate_missing_stops(cls, args):
-        gtfs, osm = SchedulesLoader.load_only_stops(args)
+        # haversine pulls numpy in, only import it in commands using distances
+        from ..conflation.stops import StopConflator
 
-        conflator = StopConflator(gtfs.stops, osm.stops)
-        missing_stops = conflator.stops_with_refs_only_in_gtfs()
+        gtfs, osm = SchedulesLoader.load_only_stops(args)
 
         missing_osm_stops = []
         partial_ref_stops = {}
 
-        for stop in missing_stops:
-            if len(stop.refs) > 1:
-                matching_stops = conflator.find_matching_osm_stops(stop)
-                if matching_stops:
-                    partial_ref_stops[stop] = matching_stops
-                    continue
+        with Profiler.stage("conflation"):
+            conflator = StopConflator(gtfs.stops, osm.stops)
+            missing_stops = conflator.stops_with_refs_only_in_gtfs()
+
+            for stop in missing_stops:
+                if len(stop.refs) > 1:
+                    matching_stops = conflator.find_matching_osm_stops(stop)
+                    if matching_stops:
+                        partial_ref_stops[stop] = matching_stops
+                        continue
 
-            osm_stop = OsmStop.fromGtfs(stop)
-            missing_osm_stops.append(osm_stop)
+                osm_stop = OsmStop.fromGtfs(stop)
+                missing_osm_stops.append(osm_stop)
 
         if partial_ref_stops:
             print("Following GTFS stops have multiple refs and some exist in OSM. "
@@ -70,11 +91,68 @@ class StopParser(object):
 
 
     @classmethod
-    def setup_arguments(cls, parser, subparsers):
+    def make_issue_sink(cls, report_format, report_file, fil):
+        from ..validator.report import CsvSink, JsonLinesSink, SqliteSink, \
+            TableSink
+
+        if report_format == "sqlite":
+            return SqliteSink(report_file)
+        elif report_format == "jsonl":
+            return JsonLinesSink(fil)
+        elif report_format == "csv":
+            return CsvSink(fil)
+        else:
+            return TableSink(fil)
+
+    @classmethod
+    def validate_stops(cls, args):
+        from ..validator.incremental import IncrementalStopValidator
+        from ..validator.issue import IssueList
+        from ..validator.rules import default_rules
+        from ..validator.validator import StopValidator
+
+        if args.report_format == "sqlite" and args.report_file is None:
+            print("--report-file must be specified for sqlite reports")
+            return
+
+        gtfs, osm = SchedulesLoader.load_only_stops(args)
+
+        if args.report_file is None:
+            fil = sys.stdout
+        elif args.report_format == "sqlite":
+            fil = None
+        else:
+            fil = open(args.report_file, 'w', encoding="utf-8", newline="")
+
+        sink = cls.make_issue_sink(args.report_format, args.report_file, fil)
+        issues = IssueList([sink], keep=False,
+                           max_per_type=args.max_issues_per_type,
+                           sample_every=args.sample_every)
+
+        rules = default_rules(args.max_distance)
+        if args.state_file:
+            validator = IncrementalStopValidator(issues, gtfs.stops, osm.stops,
+                                                 args.state_file, rules)
+        else:
+            validator = StopValidator(issues, gtfs.stops, osm.stops, rules)
+        validator.validate(args.jobs)
+
+        issues.close()
+        if fil not in (None, sys.stdout):
+            fil.close()
+
+        if args.report_file is not None:
+            issues.print_summary()
+        if args.state_file:
+            print(f"{validator.revalidated} refs validated, issues of "
+                  f"{validator.carried_over} unchanged refs carried over")
+
+    @classmethod
+    def setup_arguments(cls, parser, subparsers, help):
 
         stop_parser = subparsers.add_parser(
             "stops",
-            help="stop-related submenu")
+            help=help)
 
         stop_subparsers = stop_parser.add_subparsers()
 
@@ -90,6 +168,7 @@ class StopParser(object):
             "--output-file",
             required=True,
             help="File to store generated stop list")
+        GtfsParser.setup_diff_argument(stop_export_parser)
 
         GtfsLoader.setup_arguments(stop_export_parser, subparsers)
         stop_export_parser.set_defaults(func=StopParser.generate_stops)
@@ -105,3 +184,42 @@ class StopParser(object):
 
         SchedulesLoader.setup_arguments(stop_missing_parser, subparsers)
         stop_missing_parser.set_defaults(func=StopParser.generate_missing_stops)
+
+        # COMMAND: stop validate
+        stop_validate_parser = stop_subparsers.add_parser(
+            "validate",
+            help="Report inconsistencies between GTFS and OSM stops")
+        stop_validate_parser.add_argument(
+            "--max-distance",
+            type=float,
+            default=50,
+            help="Distance in meters above which stops with the same ref "
+                 "are reported")
+        stop_validate_parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of worker processes used to validate stops")
+        stop_validate_parser.add_argument(
+            "--report-format",
+            choices=["table", "jsonl", "csv", "sqlite"],
+            default="table",
+            help="Format of the report, table by default")
+        stop_validate_parser.add_argument(
+            "--report-file",
+            help="File to store the report, standard output if not set")
+        stop_validate_parser.add_argument(
+            "--max-issues-per-type",
+            type=int,
+            help="Report at most this number of issues of each type")
+        stop_validate_parser.add_argument(
+            "--sample-every",
+            type=int,
+            help="Report only one issue out of this number for each type")
+        stop_validate_parser.add_argument(
+            "--state-file",
+            help="File storing fingerprints of stops and issues between "
+                 "runs, to only validate stops that changed since last run")
+
+        SchedulesLoader.setup_arguments(stop_validate_parser, subparsers)
+        stop_validate_parser.set_defaults(func=StopParser.validate_stops)
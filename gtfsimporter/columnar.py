@@ -0,0 +1,429 @@
+import os
+import pickle
+
+import numpy as np
+
+from .common_elements import Schedule
+from .gtfs.elements import WayUnordered
+
+
+# attributes of the elements stored in columns, elements with other
+# attributes can't be stored
+_STOP_ATTRIBUTES = {"id", "lat", "lon", "name", "ref", "refs"}
+_TRIP_ATTRIBUTES = {"id", "headsign", "route_id", "network", "operator",
+                    "from_stop", "to_stop", "_stops_dict", "_stops",
+                    "_stops_list_generated", "way", "shape_id", "occurrences",
+                    "route"}
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _stop_trips(columns):
+    """
+    Trips serving each stop, as the indexes of trips sorted by stop and
+    their offsets per stop, computed from trip patterns
+    """
+    n_stops = len(columns["stop_lat"])
+    n_trips = len(columns["trip_pattern"])
+    pattern_offsets = columns["pattern_offsets"]
+
+    starts = pattern_offsets[columns["trip_pattern"]]
+    lengths = pattern_offsets[columns["trip_pattern"] + 1] - starts
+    trips = np.repeat(np.arange(n_trips, dtype=np.int64), lengths)
+    # position of each stop of each trip in pattern_stop
+    positions = np.arange(lengths.sum()) - np.repeat(_offsets(lengths)[:-1],
+                                                     lengths)
+    stops = columns["pattern_stop"][np.repeat(starts, lengths) + positions]
+
+    # a stop may be served twice by a trip
+    keys = np.unique(stops.astype(np.int64) * max(n_trips, 1) + trips)
+    stop_trip = (keys % max(n_trips, 1)).astype(np.int32)
+    counts = np.bincount(keys // max(n_trips, 1), minlength=n_stops)
+    return stop_trip, _offsets(counts)
+
+
+def _strings(values):
+    # at least one character, numpy can't save zero-length strings
+    return np.array(list(values) or [""], dtype=str)
+
+
+class ColumnarCache(object):
+    """
+    GTFS schedule stored as NumPy arrays, one .npy file per array in a
+    directory, with a pickle of the few elements that are not columns:
+    routes without their trips and the classes of stops and trips.
+
+    Stops, trips and shape points are indexed by their position in the
+    arrays. Trips with the same stops share a pattern, stop sequences being
+    stored once per pattern. Lookup keys, i.e. stop ids, stop refs and trip
+    ids, are stored sorted with the index of their element, and searched
+    with numpy.searchsorted. The trips serving each stop are stored too,
+    see Schedule.stop_usage.
+    """
+
+    META_FILE = "meta.pickle"
+
+    @classmethod
+    def write(cls, schedule, path):
+        os.makedirs(path, exist_ok=True)
+        columns = {}
+
+        stops = list(schedule.stops)
+        stop_index = {id(stop): i for i, stop in enumerate(stops)}
+        stop_classes = []
+        for stop in stops:
+            cls.check_attributes(stop, _STOP_ATTRIBUTES)
+            if type(stop) not in stop_classes:
+                stop_classes.append(type(stop))
+
+        columns["stop_class"] = np.array(
+            [stop_classes.index(type(s)) for s in stops], dtype=np.int8)
+        columns["stop_lat"] = np.array([s.lat for s in stops], dtype=np.float64)
+        columns["stop_lon"] = np.array([s.lon for s in stops], dtype=np.float64)
+        columns["stop_id"] = _strings(s.id for s in stops)
+        columns["stop_name"] = _strings(s.name for s in stops)
+        columns["stop_ref"] = _strings(ref for s in stops for ref in s.refs)
+        columns["stop_ref_offsets"] = _offsets([len(s.refs) for s in stops])
+
+        # stops merged by Schedule.find_duplicate_stop keep their id as key
+        stop_keys = {stop_id: stop_index[id(stop)]
+                     for stop_id, stop in schedule._stops_by_id.items()}
+        cls.add_sorted_keys(columns, "stop_id_key", stop_keys)
+
+        ref_keys = {ref: stop_index[id(stop)]
+                    for ref, stop in schedule._stops_by_ref.items()}
+        cls.add_sorted_keys(columns, "stop_ref_key", ref_keys)
+
+        routes = list(schedule.routes)
+        route_index = {route.id: i for i, route in enumerate(routes)}
+        trips = list(schedule.trips)
+        trip_index = {trip.id: i for i, trip in enumerate(trips)}
+        trip_classes = []
+        for trip in trips:
+            cls.check_attributes(trip, _TRIP_ATTRIBUTES)
+            if (trip.network, trip.operator) != \
+                    (trip.route.network, trip.route.operator):
+                raise ValueError(f"Trip {trip.id} has its own network or "
+                                 f"operator, which can't be stored in columns")
+            if type(trip) not in trip_classes:
+                trip_classes.append(type(trip))
+
+        shape_ids = sorted(set(t.shape_id for t in trips), key=str)
+        shape_index = {shape_id: i for i, shape_id in enumerate(shape_ids)}
+
+        patterns = {}
+        for trip in trips:
+            key = tuple((seq, stop_index[id(stop)])
+                        for seq, stop in sorted(trip._stops_dict.items()))
+            patterns.setdefault(key, len(patterns))
+
+        columns["trip_id"] = _strings(t.id for t in trips)
+        columns["trip_class"] = np.array(
+            [trip_classes.index(type(t)) for t in trips], dtype=np.int8)
+        columns["trip_headsign"] = _strings(t.headsign for t in trips)
+        columns["trip_route"] = np.array(
+            [route_index[t.route.id] for t in trips], dtype=np.int32)
+        columns["trip_shape"] = np.array(
+            [shape_index[t.shape_id] for t in trips], dtype=np.int32)
+        columns["trip_occurrences"] = np.array(
+            [getattr(t, "occurrences", 1) for t in trips], dtype=np.int32)
+        columns["trip_pattern"] = np.array(
+            [patterns[tuple((seq, stop_index[id(stop)])
+                            for seq, stop in sorted(t._stops_dict.items()))]
+             for t in trips], dtype=np.int32)
+        cls.add_sorted_keys(columns, "trip_id_key", trip_index)
+
+        columns["pattern_stop"] = np.array(
+            [stop for key in patterns for _, stop in key], dtype=np.int32)
+        columns["pattern_seq"] = np.array(
+            [seq for key in patterns for seq, _ in key], dtype=np.int32)
+        columns["pattern_offsets"] = _offsets([len(key) for key in patterns])
+
+        columns["route_trip"] = np.array(
+            [trip_index[t.id] for r in routes for t in r.trips], dtype=np.int32)
+        columns["route_trip_offsets"] = _offsets([len(r.trips) for r in routes])
+
+        # trips with the same shape share their way
+        ways = [None] * len(shape_ids)
+        for trip in trips:
+            ways[shape_index[trip.shape_id]] = trip.way
+        points = [(seq, lat, lon) for way in ways
+                  for seq, (lat, lon) in sorted(way.nodes.items())]
+        columns["shape_seq"] = np.array([p[0] for p in points], dtype=np.int32)
+        columns["shape_point"] = np.array(
+            [p[1:] for p in points], dtype=np.float64).reshape(-1, 2)
+        columns["shape_offsets"] = _offsets([len(way) for way in ways])
+
+        columns["stop_trip"], columns["stop_trip_offsets"] = _stop_trips(columns)
+
+        for name, array in columns.items():
+            np.save(os.path.join(path, name + ".npy"), array)
+
+        meta = {
+            "stop_classes": stop_classes,
+            "trip_classes": trip_classes,
+            "shape_ids": shape_ids,
+            # only the trips of routes are stored in columns
+            "routes": [{k: v for k, v in vars(r).items() if k != "trips"}
+                       for r in routes],
+            "route_classes": [type(r) for r in routes],
+        }
+        with open(os.path.join(path, cls.META_FILE), 'wb') as f:
+            pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def check_attributes(cls, element, attributes):
+        extra = set(vars(element)) - attributes
+        if extra:
+            raise ValueError(f"{type(element).__name__} has attributes that "
+                             f"can't be stored in columns: {sorted(extra)}")
+
+    @classmethod
+    def add_sorted_keys(cls, columns, name, keys):
+        order = sorted(keys)
+        columns[name] = _strings(order)
+        columns[name + "_index"] = np.array([keys[k] for k in order],
+                                            dtype=np.int32)
+
+    @classmethod
+    def load(cls, path):
+        return ColumnarSchedule(path)
+
+
+class ColumnarSchedule(Schedule):
+    """
+    Read-only schedule over the arrays of a ColumnarCache
+
+    Arrays are memory-mapped, so loading costs a few system calls and
+    processes using the same cache share their pages. They are exposed in
+    the columns dict, e.g. columns["stop_lat"], for callers that only need
+    coordinates or refs. Stops, routes and trips are only created when
+    requested, then kept so that the same object is always returned.
+    A route is created with its trips, and a trip with its route.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.issues = []
+
+        self.columns = {}
+        for name in os.listdir(path):
+            if name.endswith(".npy"):
+                self.columns[name[:-4]] = np.load(os.path.join(path, name),
+                                                  mmap_mode='r')
+
+        with open(os.path.join(path, ColumnarCache.META_FILE), 'rb') as f:
+            self.meta = pickle.load(f)
+
+        # caches written before trips of stops were stored
+        if "stop_trip" not in self.columns:
+            self.columns["stop_trip"], self.columns["stop_trip_offsets"] = \
+                _stop_trips(self.columns)
+
+        self._stop_objects = {}
+        self._route_objects = {}
+        self._trip_objects = {}
+        self._way_objects = {}
+
+    def __getstate__(self):
+        raise TypeError("ColumnarSchedule can't be pickled, pickle the "
+                        "path of its cache instead")
+
+    def _stops_bbox(self):
+        lat = self.columns["stop_lat"]
+        lon = self.columns["stop_lon"]
+        return (float(lat.min()), float(lon.min()),
+                float(lat.max()), float(lon.max()))
+
+    def _search(self, name, key):
+        keys = self.columns[name]
+        i = np.searchsorted(keys, key)
+        if i < len(self.columns[name + "_index"]) and keys[i] == key:
+            return int(self.columns[name + "_index"][i])
+
+    # stops
+
+    @property
+    def stops(self):
+        return _LazySequence(len(self.columns["stop_lat"]), self.stop_at)
+
+    def stop_at(self, i):
+        stop = self._stop_objects.get(i)
+        if stop is not None:
+            return stop
+
+        c = self.columns
+        stop_cls = self.meta["stop_classes"][c["stop_class"][i]]
+        start, end = c["stop_ref_offsets"][i:i + 2]
+        refs = [str(ref) for ref in c["stop_ref"][start:end]]
+
+        stop = stop_cls.__new__(stop_cls)
+        stop.__dict__.update(id=str(c["stop_id"][i]),
+                             lat=float(c["stop_lat"][i]),
+                             lon=float(c["stop_lon"][i]),
+                             name=str(c["stop_name"][i]),
+                             ref=refs[0] if refs else None,
+                             refs=refs)
+        self._stop_objects[i] = stop
+        return stop
+
+    def get_stop(self, stop_id, *args):
+        i = self._search("stop_id_key", stop_id)
+        if i is not None:
+            return self.stop_at(i)
+        if args:
+            return args[0]
+        raise KeyError(stop_id)
+
+    def get_stop_by_ref(self, stop_ref):
+        i = self._search("stop_ref_key", stop_ref)
+        if i is not None:
+            return self.stop_at(i)
+
+    # routes and trips
+
+    @property
+    def routes(self):
+        return _LazySequence(len(self.meta["routes"]), self.route_at)
+
+    @property
+    def trips(self):
+        return _LazySequence(len(self.columns["trip_route"]), self.trip_at)
+
+    def route_at(self, i):
+        route = self._route_objects.get(i)
+        if route is not None:
+            return route
+
+        route_cls = self.meta["route_classes"][i]
+        route = route_cls.__new__(route_cls)
+        route.__dict__.update(self.meta["routes"][i])
+        route.trips = []
+        self._route_objects[i] = route
+
+        c = self.columns
+        start, end = c["route_trip_offsets"][i:i + 2]
+        for trip_index in c["route_trip"][start:end]:
+            route.trips.append(self._make_trip(int(trip_index), route))
+
+        return route
+
+    def _make_trip(self, i, route):
+        c = self.columns
+        trip_cls = self.meta["trip_classes"][c["trip_class"][i]]
+        pattern = c["trip_pattern"][i]
+        start, end = c["pattern_offsets"][pattern:pattern + 2]
+
+        trip = trip_cls.__new__(trip_cls)
+        trip.__dict__.update(
+            id=str(c["trip_id"][i]),
+            headsign=str(c["trip_headsign"][i]),
+            route_id=route.id,
+            network=route.network,
+            operator=route.operator,
+            from_stop=None,
+            to_stop=None,
+            _stops_dict={int(seq): self.stop_at(int(stop)) for seq, stop in
+                         zip(c["pattern_seq"][start:end],
+                             c["pattern_stop"][start:end])},
+            _stops=[],
+            _stops_list_generated=False,
+            way=self._way_at(int(c["trip_shape"][i])),
+            shape_id=self.meta["shape_ids"][c["trip_shape"][i]],
+            occurrences=int(c["trip_occurrences"][i]),
+            route=route)
+        self._trip_objects[i] = trip
+        return trip
+
+    def trip_at(self, i):
+        trip = self._trip_objects.get(i)
+        if trip is None:
+            # trips are created by their route
+            self.route_at(int(self.columns["trip_route"][i]))
+            trip = self._trip_objects[i]
+        return trip
+
+    def _way_at(self, i):
+        way = self._way_objects.get(i)
+        if way is None:
+            c = self.columns
+            start, end = c["shape_offsets"][i:i + 2]
+            way = self._way_objects[i] = WayUnordered()
+            for seq, (lat, lon) in zip(c["shape_seq"][start:end],
+                                       c["shape_point"][start:end]):
+                way.add_node(float(lat), float(lon), int(seq))
+        return way
+
+    def get_route(self, route_id, *args):
+        for i, route in enumerate(self.meta["routes"]):
+            if route["id"] == route_id:
+                return self.route_at(i)
+        if args:
+            return args[0]
+        raise KeyError(route_id)
+
+    def get_trip(self, trip_id, *args):
+        i = self._search("trip_id_key", trip_id)
+        if i is not None:
+            return self.trip_at(i)
+        if args:
+            return args[0]
+        raise KeyError(trip_id)
+
+    # stop usage
+
+    def _stop_usage_at(self, i):
+        c = self.columns
+        start, end = c["stop_trip_offsets"][i:i + 2]
+        return [(self.meta["routes"][c["trip_route"][t]]["id"], str(c["trip_id"][t]))
+                for t in c["stop_trip"][start:end]]
+
+    @property
+    def stop_usage(self):
+        c = self.columns
+        return {str(c["stop_id"][i]): self._stop_usage_at(i)
+                for i in range(len(c["stop_lat"]))
+                if c["stop_trip_offsets"][i] < c["stop_trip_offsets"][i + 1]}
+
+    def get_stop_usage(self, stop_id):
+        i = self._search("stop_id_key", stop_id)
+        if i is None:
+            return []
+        return self._stop_usage_at(i)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("ColumnarSchedule is read-only")
+
+    add_route = add_stop = add_trip = add_route_trip = add_shape_point = \
+        add_stop_time = drop_trips = remove_duplicated_trips = \
+        remove_truncated_trips = reindex_stop = _read_only
+
+
+class _LazySequence(object):
+    """
+    Sequence of elements created by getter on first access
+    """
+
+    def __init__(self, length, getter):
+        self.length = length
+        self.getter = getter
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.getter(j) for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return self.getter(i)
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self.getter(i)
@@ -3,6 +3,27 @@ from collections import defaultdict
 
 from math import cos, pi
 
+from .gtfs.patterns import PatternStatistics
+from .profiling import profiled
+
+
+def expand_bounding_box(bbox, margin=None):
+    """
+    Return bbox, (min lat, min lon, max lat, max lon), expanded by margin
+    meters on each side if set
+    """
+    if margin is not None:
+        margin_lat = margin * (360 / 40075000)
+        len_longitude = cos(bbox[0] * pi / 180) * 40075000
+        margin_lon = margin * (360 / len_longitude)
+        bbox = (float("{0:.6f}".format(bbox[0] - margin_lat)),
+                float("{0:.6f}".format(bbox[1] - margin_lon)),
+                float("{0:.6f}".format(bbox[2] + margin_lat)),
+                float("{0:.6f}".format(bbox[3] + margin_lon)))
+
+    return bbox
+
+
 class Schedule(object):
 
     def __init__(self):
@@ -12,6 +33,34 @@ class Schedule(object):
         self._routes_dict = {}
         self._trips_dict = {}
         self._shapes_dict = defaultdict(list)
+        self._ways_dict = {}
+        self._index_stops()
+        # stop id -> (route id, trip id) of trips serving it, see stop_usage
+        self._stop_usage = None
+
+    def _index_stops(self):
+        # first stop at given coordinates, and first stop with a given ref
+        self._stops_by_coords = {}
+        self._stops_by_ref = {}
+        for stop in self._stops:
+            self._stops_by_coords.setdefault((stop.lat, stop.lon), stop)
+            for ref in stop.refs:
+                self._stops_by_ref.setdefault(ref, stop)
+
+    def __getstate__(self):
+        # indexes are rebuilt when unpickling, which also works for
+        # schedules pickled before they existed
+        state = dict(self.__dict__)
+        state.pop("_stops_by_coords", None)
+        state.pop("_stops_by_ref", None)
+        # stop usage takes a pass over all trips, caches come with it
+        state["_stop_usage"] = self.stop_usage
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_stop_usage", None)
+        self._index_stops()
 
     @property
     def routes(self):
@@ -25,25 +74,18 @@ class Schedule(object):
     def trips(self):
         return self._trips_dict.values()
 
-    def get_bounding_box(self, margin=None):
-        bbox = (min(self.stops, key=lambda s: s.lat).lat,
+    def _stops_bbox(self):
+        return (min(self.stops, key=lambda s: s.lat).lat,
                 min(self.stops, key=lambda s: s.lon).lon,
                 max(self.stops, key=lambda s: s.lat).lat,
                 max(self.stops, key=lambda s: s.lon).lon)
 
-        if margin is not None:
-            margin_lat = margin * (360 / 40075000)
-            len_longitude = cos(bbox[0] * pi / 180) * 40075000
-            margin_lon = margin * (360 / len_longitude)
-            bbox = (float("{0:.6f}".format(bbox[0] - margin_lat)),
-                    float("{0:.6f}".format(bbox[1] - margin_lon)),
-                    float("{0:.6f}".format(bbox[2] + margin_lat)),
-                    float("{0:.6f}".format(bbox[3] + margin_lon)))
-
-        return bbox
+    def get_bounding_box(self, margin=None):
+        return expand_bounding_box(self._stops_bbox(), margin)
 
     def add_route(self, route):
         self._routes_dict[route.id] = route
+        self._stop_usage = None
 
     def find_duplicate_stop(self, stop):
         """
@@ -53,16 +95,18 @@ class Schedule(object):
         Some dataset providers duplicate the stops for each line they are served
         by.
         """
-        for s in self.stops:
-            if s.lat == stop.lat and s.lon == stop.lon:
-                if s.name != stop.name:
-                    print("WARNING: These stops have the same coordinates "
-                          "but not the same name. Name of the first one will be used.")
-                    print(f"\tid={s.id}, refs={s.refs}, name={s.name}")
-                    print(f"\tid={stop.id}, refs={stop.refs}, name={stop.name}")
-                    print("")
+        s = self._stops_by_coords.get((stop.lat, stop.lon))
+        if s is None:
+            return None
 
-                return s
+        if s.name != stop.name:
+            print("WARNING: These stops have the same coordinates "
+                  "but not the same name. Name of the first one will be used.")
+            print(f"\tid={s.id}, refs={s.refs}, name={s.name}")
+            print(f"\tid={stop.id}, refs={stop.refs}, name={stop.name}")
+            print("")
+
+        return s
 
     def add_stop(self, stop, deduplicate=False):
         existing_stop = None
@@ -73,24 +117,68 @@ class Schedule(object):
             self._stops_by_id[stop.id] = existing_stop
             if stop.ref not in existing_stop.refs:
                 existing_stop.add_ref(stop.ref)
+                self._stops_by_ref.setdefault(stop.ref, existing_stop)
                 #print(existing_stop.refs)
         else:
             self._stops.append(stop)
             self._stops_by_id[stop.id] = stop
+            self._stops_by_coords.setdefault((stop.lat, stop.lon), stop)
+            for ref in stop.refs:
+                self._stops_by_ref.setdefault(ref, stop)
 
     def add_trip(self, trip):
         self._trips_dict[trip.id] = trip
+        self._stop_usage = None
         self._shapes_dict[trip.shape_id].append(trip.id)
 
+        # trips with the same shape share the same way
+        way = self._ways_dict.get(trip.shape_id)
+        if way is None:
+            self._ways_dict[trip.shape_id] = trip.way
+        else:
+            trip.way = way
+
+    def add_route_trip(self, trip):
+        """
+        Add trip to its route and to the schedule. Return False if its route
+        is not in the schedule, i.e. was not of interest.
+        """
+        route = self.get_route(trip.route_id, None)
+        if route is None:
+            return False
+
+        route.add_trip(trip)
+        self.add_trip(trip)
+        return True
+
     def add_shape_point(self, shape_id, lat, lon, seq):
-        for trip_id in self._shapes_dict[shape_id]:
-            trip = self.get_trip(trip_id)
-            trip.way.add_node(lat, lon, seq)
+        # skip shapes that are not used by any remaining trip
+        if self._shapes_dict.get(shape_id):
+            self._ways_dict[shape_id].add_node(lat, lon, seq)
 
     def get_stop_by_ref(self, stop_ref):
-        for stop in self.stops:
-            if stop_ref in stop.refs:
-                return stop
+        return self._stops_by_ref.get(stop_ref)
+
+    def reindex_stop(self, stop, old_refs):
+        """
+        Update the index of stops by ref once the refs of stop, already in
+        the schedule, changed from old_refs. Refs of stops must not change
+        without it, get_stop_by_ref would keep returning the stop of old
+        refs.
+        """
+        refs = stop.refs
+        for ref in old_refs:
+            if ref in refs or self._stops_by_ref.get(ref) is not stop:
+                continue
+            # the first other stop with this ref, as when indexing all stops
+            other = next((s for s in self._stops if ref in s.refs), None)
+            if other is None:
+                del self._stops_by_ref[ref]
+            else:
+                self._stops_by_ref[ref] = other
+
+        for ref in refs:
+            self._stops_by_ref.setdefault(ref, stop)
 
     def get_route(self, route_id, *args):
         if args:
@@ -115,14 +203,20 @@ class Schedule(object):
             return self._trips_dict[trip_id]
 
     def drop_trips(self, trip_ids):
+        trip_ids = set(trip_ids)
+        self._stop_usage = None
+
+        # only the shapes of dropped trips need to be updated
+        shape_ids = set()
         for trip_id in trip_ids:
-            del self._trips_dict[trip_id]
+            shape_ids.add(self._trips_dict.pop(trip_id).shape_id)
 
-        for shape_id in self._shapes_dict:
+        for shape_id in shape_ids:
             lst = self._shapes_dict[shape_id]
             lst = [trip_id for trip_id in lst if trip_id not in trip_ids]
             self._shapes_dict[shape_id] = lst
 
+    @profiled("remove_duplicated_trips")
     def remove_duplicated_trips(self):
         removed = 0
         total = len(self.routes)
@@ -137,14 +231,76 @@ class Schedule(object):
 
         return removed
 
-    def remove_truncated_trips(self):
+    @profiled("remove_truncated_trips")
+    def remove_truncated_trips(self, policy="longest"):
+        # trips of all routes grouped in one pass
+        statistics = PatternStatistics.from_routes(self.routes)
+
         removed = 0
         for route in self.routes:
-            trip_ids = route.remove_truncated_trips()
+            trip_ids = route.remove_truncated_trips(policy, statistics)
             removed += len(trip_ids)
             self.drop_trips(trip_ids)
 
         return removed
 
-    def add_stop_time(self, trip, stop_time):
-        trip.add_stop_time(stop_time)
+    def add_stop_time(self, stop_time):
+        # only trips of routes of interest are in the schedule
+        trip = self._trips_dict.get(stop_time.trip_id)
+        if trip is not None:
+            stop = self.get_stop(stop_time.stop_id)
+            trip.add_stop(stop_time.sequence, stop)
+            self._stop_usage = None
+
+    # reverse indexes, from stops to the trips and routes serving them
+
+    @property
+    def stop_usage(self):
+        """
+        Dict of stop ids to the (route id, trip id) of the trips serving
+        them, built on first use in a single pass over the trips of routes,
+        as OSM trips are only known by their route. It is reset when trips
+        are added through the schedule, and must be reset by setting
+        _stop_usage to None when trips of routes are modified directly.
+        """
+        if self._stop_usage is None:
+            usage = {}
+            for route in self.routes:
+                for trip in route.trips:
+                    # a stop may be served twice by a trip
+                    for stop_id in dict.fromkeys(stop.id for stop in trip.stops):
+                        usage.setdefault(stop_id, []).append((route.id, trip.id))
+            self._stop_usage = usage
+
+        return self._stop_usage
+
+    def get_stop_usage(self, stop_id):
+        """
+        Return the (route id, trip id) of the trips serving the stop with
+        id stop_id, or one of its merged stops
+        """
+        stop = self.get_stop(stop_id, None)
+        if stop is None:
+            return []
+        return list(self.stop_usage.get(stop.id, []))
+
+    def get_stop_trips(self, stop_id):
+        usage = self.get_stop_usage(stop_id)
+        trips = []
+        for route in self.get_affected_routes([stop_id]):
+            trip_ids = set(t for r, t in usage if r == route.id)
+            trips.extend(t for t in route.trips if t.id in trip_ids)
+        return trips
+
+    def get_stop_routes(self, stop_id):
+        return self.get_affected_routes([stop_id])
+
+    def get_affected_routes(self, stop_ids):
+        """
+        Return the routes serving at least one of the stops in stop_ids,
+        sorted by id
+        """
+        route_ids = set()
+        for stop_id in stop_ids:
+            route_ids.update(r for r, _ in self.get_stop_usage(stop_id))
+        return [self.get_route(route_id) for route_id in sorted(route_ids)]
@@ -1,6 +1,9 @@
 
 from itertools import zip_longest
 
+from .sequence import StopSequenceDiff
+from ..osm.elements import RefMissingInOsmError
+
 class RouteConflator(object):
 
     def __init__(self, gtfs_schedule, osm_schedule):
@@ -68,14 +71,33 @@ class RouteConflator(object):
             if route.code == route_code:
                 return route
 
+    def diff_trip_stops(self, gtfs_trip, osm_trip):
+        """
+        Return the StopSequenceDiff between the stops of osm_trip and the
+        OSM stops matching the stops of gtfs_trip.
+        """
+        gtfs_stops = []
+        for stop in gtfs_trip.stops:
+            osm_stop = self.osm.get_stop_by_ref(stop.ref)
+            if not osm_stop:
+                raise RefMissingInOsmError(stop.ref)
+            gtfs_stops.append(osm_stop)
+
+        return StopSequenceDiff(osm_trip.stops, gtfs_stops)
+
     def compare_trip_stops(self, gtfs_trip, osm_trip):
-        gtfs_stop_refs = [stop.ref for stop in gtfs_trip.stops]
-        osm_stop_refs  = [stop.ref for stop in osm_trip.stops]
+        try:
+            diff = self.diff_trip_stops(gtfs_trip, osm_trip)
+        except RefMissingInOsmError as e:
+            print(e)
+            return
 
-        if gtfs_stop_refs == osm_stop_refs:
+        if not diff:
             print("Identical")
         else:
             print(f"Updating trip {osm_trip.name}")
+            for line in diff.report():
+                print(f"\t{line}")
             try:
                 osm_trip.merge_gtfs(gtfs_trip, self.osm)
                 print("Trip updated")
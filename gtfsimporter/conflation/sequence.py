@@ -0,0 +1,166 @@
+def myers_diff(old, new):
+    """
+    Compute the shortest edit script between two sequences
+
+    This is Myers' O((N+M)D) algorithm, D being the number of edits, so it is
+    very fast on sequences that are almost identical, which is the common
+    case when comparing an OSM trip with its GTFS counterpart. Items must be
+    comparable with ==.
+
+    Return a list of (op, old_index, new_index) where op is '=' for items
+    present in both sequences, '-' for items only in old and '+' for items
+    only in new. Indexes not relevant for an op are None.
+    """
+    n, m = len(old), len(new)
+
+    # v[k] is the furthest x reached on diagonal k = x - y
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+
+            while x < n and y < m and old[x] == new[y]:
+                x += 1
+                y += 1
+
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+
+    return _backtrack(trace, n, m)
+
+
+def _backtrack(trace, n, m):
+    ops = []
+    x, y = n, m
+
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+
+        while x > prev_x and y > prev_y:
+            ops.append(('=', x - 1, y - 1))
+            x -= 1
+            y -= 1
+
+        if d > 0:
+            if x == prev_x:
+                ops.append(('+', None, y - 1))
+            else:
+                ops.append(('-', x - 1, None))
+
+        x, y = prev_x, prev_y
+
+    ops.reverse()
+    return ops
+
+
+class StopEdit(object):
+
+    INSERT = "insert"
+    DELETE = "delete"
+    MOVE = "move"
+
+    def __init__(self, action, stop, old_index=None, new_index=None):
+        self.action = action
+        self.stop = stop
+        self.old_index = old_index
+        self.new_index = new_index
+
+    def __str__(self):
+        if self.action == self.INSERT:
+            where = f"at position {self.new_index + 1}"
+        elif self.action == self.DELETE:
+            where = f"from position {self.old_index + 1}"
+        else:
+            where = f"from position {self.old_index + 1} to {self.new_index + 1}"
+
+        return f"{self.action} stop refs={self.stop.refs}, name={self.stop.name} {where}"
+
+    def __repr__(self):
+        return "<StopEdit {} id={}, old={}, new={}>".format(
+                self.action, self.stop.id, self.old_index, self.new_index)
+
+
+class StopSequenceDiff(object):
+    """
+    Minimal list of edits to turn the stops of an OSM trip into a new list of
+    stops, usually built from the GTFS trip.
+
+    Stops are compared by id. A stop removed at some position and inserted at
+    another one is reported as a move.
+    """
+
+    def __init__(self, old_stops, new_stops):
+        self.old_stops = old_stops
+        self.new_stops = new_stops
+
+        old_ids = [s.id for s in old_stops]
+        new_ids = [s.id for s in new_stops]
+        self.ops = myers_diff(old_ids, new_ids)
+        self.edits = self._build_edits()
+
+    def _build_edits(self):
+        deleted = {}
+        inserted = {}
+        for op, old_index, new_index in self.ops:
+            if op == '-':
+                deleted.setdefault(self.old_stops[old_index].id, []).append(old_index)
+            elif op == '+':
+                inserted.setdefault(self.new_stops[new_index].id, []).append(new_index)
+
+        # a stop deleted at some position and inserted at another one is moved
+        moves = {}
+        moved_to = set()
+        for stop_id, old_indexes in deleted.items():
+            for old_index, new_index in zip(old_indexes, inserted.get(stop_id, ())):
+                moves[old_index] = new_index
+                moved_to.add(new_index)
+
+        edits = []
+        for op, old_index, new_index in self.ops:
+            if op == '-':
+                stop = self.old_stops[old_index]
+                if old_index in moves:
+                    edits.append(StopEdit(StopEdit.MOVE, stop, old_index,
+                                          moves[old_index]))
+                else:
+                    edits.append(StopEdit(StopEdit.DELETE, stop, old_index))
+            elif op == '+' and new_index not in moved_to:
+                stop = self.new_stops[new_index]
+                edits.append(StopEdit(StopEdit.INSERT, stop, new_index=new_index))
+
+        return edits
+
+    def __len__(self):
+        return len(self.edits)
+
+    def apply(self):
+        """
+        Return the new list of stops. Stops kept or moved are the objects of
+        the old list, so that data attached to them is preserved.
+        """
+        stops = list(self.new_stops)
+        for op, old_index, new_index in self.ops:
+            if op == '=':
+                stops[new_index] = self.old_stops[old_index]
+        for edit in self.edits:
+            if edit.action == StopEdit.MOVE:
+                stops[edit.new_index] = self.old_stops[edit.old_index]
+
+        return stops
+
+    def report(self):
+        return [str(edit) for edit in self.edits]
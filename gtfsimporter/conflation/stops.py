@@ -8,7 +8,7 @@ class StopConflator(object):
         self.osm_stops  = osm_stops
 
     def stops_with_refs_only_in_gtfs(self):
-        osm_refs = self.get_all_refs(self.osm_stops)
+        osm_refs = set(self.get_all_refs(self.osm_stops))
 
         missing_stops = []
         for gtfs_stop in self.gtfs_stops:
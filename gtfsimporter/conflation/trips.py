@@ -0,0 +1,176 @@
+from collections import defaultdict
+from zlib import crc32
+
+import numpy as np
+
+
+class TripMatch(object):
+
+    def __init__(self, osm_trip, gtfs_trip, score):
+        self.osm_trip = osm_trip
+        self.gtfs_trip = gtfs_trip
+        self.score = score
+
+    def __repr__(self):
+        return "<TripMatch osm={}, gtfs={}, score={:.2f}>".format(
+                self.osm_trip.ref, self.gtfs_trip.ref, self.score)
+
+
+class TripMatcher(object):
+    """
+    Match OSM trips to GTFS trips based on their sequence of stops
+
+    Trips are compared on the set of their shingles, i.e. pairs of
+    consecutive stops, so that both the stops and their order count. When
+    the OSM schedule is given, stops are identified by the OSM stop of
+    their refs, see stop_token.
+    GTFS trips are indexed with MinHash signatures split in bands
+    (locality-sensitive hashing): only trips sharing at least one band with
+    an OSM trip are compared to it, instead of comparing all trips with each
+    other. The score of a candidate is the Jaccard similarity of shingles.
+
+    The number of rows per band is picked so that a pair of trips with a
+    similarity equal to the threshold shares a band with a probability above
+    99%, e.g. 32 bands of 2 rows for the default threshold of 0.5.
+    """
+
+    NUM_PERM = 64
+
+    def __init__(self, gtfs_trips, threshold=0.5, shingle_size=2,
+                 osm_schedule=None):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.osm_schedule = osm_schedule
+        self.rows = self.rows_per_band(threshold)
+        self.bands = self.NUM_PERM // self.rows
+
+        # fixed seed: signatures must not change from one run to another
+        rng = np.random.RandomState(0x6775)
+        num_perm = self.NUM_PERM
+        self._a = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+        self.gtfs_trips = list(gtfs_trips)
+        self._shingles = []
+        self._buckets = defaultdict(list)
+        for index, trip in enumerate(self.gtfs_trips):
+            shingles = self.shingles(trip)
+            self._shingles.append(shingles)
+            for key in self._band_keys(shingles):
+                self._buckets[key].append(index)
+
+    @classmethod
+    def rows_per_band(cls, threshold):
+        """
+        Largest number of rows, hence fewest candidates, for which trips with
+        a similarity of threshold are candidates with a 99% probability.
+        """
+        rows = 1
+        for r in (2, 4, 8, 16):
+            bands = cls.NUM_PERM // r
+            if 1 - (1 - threshold ** r) ** bands < 0.99:
+                break
+            rows = r
+
+        return rows
+
+    def stop_token(self, stop):
+        """
+        Token standing for stop in shingles. With the OSM schedule, OSM
+        stops are identified by their id, and GTFS stops by the id of the
+        OSM stop of one of their refs: a GTFS stop merged from refs A and B
+        and the OSM stop only having ref B are then the same token.
+        Otherwise, and for GTFS stops missing in OSM, the smallest ref.
+        """
+        osm_schedule = self.osm_schedule
+        if osm_schedule is not None:
+            if osm_schedule.get_stop(stop.id, None) is stop:
+                return f"osm:{stop.id}"
+            for ref in sorted(stop.refs):
+                osm_stop = osm_schedule.get_stop_by_ref(ref)
+                if osm_stop is not None:
+                    return f"osm:{osm_stop.id}"
+
+        refs = stop.refs
+        if refs:
+            return min(refs)
+        return f"id:{stop.id}"
+
+    def shingles(self, trip):
+        tokens = [self.stop_token(s) for s in trip.stops]
+        size = min(self.shingle_size, len(tokens))
+        return frozenset("|".join(tokens[i:i + size])
+                         for i in range(len(tokens) - size + 1))
+
+    def signature(self, shingles):
+        hashes = np.fromiter((crc32(s.encode()) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # multiply-shift hashing, one hash function per row: products wrap
+        # around at 2^64 and the high bits are kept
+        values = (np.outer(self._a, hashes) + self._b[:, None]) >> np.uint64(32)
+        return values.min(axis=1)
+
+    def _band_keys(self, shingles):
+        if not shingles:
+            return []
+
+        signature = self.signature(shingles)
+        keys = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            keys.append((band, rows.tobytes()))
+        return keys
+
+    def candidates(self, osm_trip):
+        """
+        Return the list of (score, gtfs_trip) of GTFS trips similar to
+        osm_trip, best match first.
+        """
+        shingles = self.shingles(osm_trip)
+
+        indexes = set()
+        for key in self._band_keys(shingles):
+            indexes.update(self._buckets.get(key, ()))
+
+        candidates = []
+        for index in indexes:
+            other = self._shingles[index]
+            score = len(shingles & other) / len(shingles | other)
+            if score >= self.threshold:
+                candidates.append((score, index))
+
+        candidates.sort(key=lambda c: (-c[0], c[1]))
+        return [(score, self.gtfs_trips[index]) for score, index in candidates]
+
+    def match(self, osm_trip, gtfs_route=None):
+        """
+        Return the TripMatch with the most similar GTFS trip, or None if no
+        trip is above the similarity threshold.
+        """
+        for score, gtfs_trip in self.candidates(osm_trip):
+            if gtfs_route is None or gtfs_trip.route_id == gtfs_route.id:
+                return TripMatch(osm_trip, gtfs_trip, score)
+
+    def match_all(self, osm_trips):
+        """
+        Match trips one-to-one: a GTFS trip is matched at most once, pairs
+        with the best score being matched first.
+        """
+        pairs = []
+        for i, osm_trip in enumerate(osm_trips):
+            for score, gtfs_trip in self.candidates(osm_trip):
+                pairs.append((score, i, gtfs_trip))
+
+        pairs.sort(key=lambda p: (-p[0], p[1]))
+
+        matches = []
+        matched_osm = set()
+        matched_gtfs = set()
+        for score, i, gtfs_trip in pairs:
+            if i in matched_osm or gtfs_trip.id in matched_gtfs:
+                continue
+            matched_osm.add(i)
+            matched_gtfs.add(gtfs_trip.id)
+            matches.append(TripMatch(osm_trips[i], gtfs_trip, score))
+
+        return matches
@@ -0,0 +1,572 @@
+import pickle
+import sqlite3
+import weakref
+
+from .common_elements import Schedule
+from .gtfs.elements import WayUnordered
+from .profiling import profiled
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stops (
+    id TEXT PRIMARY KEY,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stops_coords ON stops (lat, lon);
+
+-- ids of stops merged into another one, see Schedule.find_duplicate_stop
+CREATE TABLE IF NOT EXISTS stop_aliases (
+    alias TEXT PRIMARY KEY,
+    stop_id TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stop_refs (
+    ref TEXT NOT NULL,
+    stop_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stop_refs_ref ON stop_refs (ref);
+CREATE INDEX IF NOT EXISTS stop_refs_stop ON stop_refs (stop_id);
+
+CREATE TABLE IF NOT EXISTS routes (
+    id TEXT PRIMARY KEY,
+    ref TEXT,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS routes_ref ON routes (ref);
+
+CREATE TABLE IF NOT EXISTS trips (
+    id TEXT PRIMARY KEY,
+    route_id TEXT NOT NULL,
+    shape_id TEXT,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trips_route ON trips (route_id);
+CREATE INDEX IF NOT EXISTS trips_shape ON trips (shape_id);
+
+CREATE TABLE IF NOT EXISTS stop_times (
+    trip_id TEXT NOT NULL,
+    sequence INTEGER NOT NULL,
+    stop_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stop_times_trip ON stop_times (trip_id);
+-- trips and routes serving a stop, see Schedule.stop_usage
+CREATE INDEX IF NOT EXISTS stop_times_stop ON stop_times (stop_id);
+
+CREATE TABLE IF NOT EXISTS shape_points (
+    shape_id TEXT NOT NULL,
+    sequence INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shape_points_shape ON shape_points (shape_id);
+"""
+
+_INSERTS = {
+    "stops": "INSERT OR REPLACE INTO stops VALUES (?, ?, ?, ?)",
+    "stop_aliases": "INSERT OR REPLACE INTO stop_aliases VALUES (?, ?)",
+    "stop_refs": "INSERT INTO stop_refs VALUES (?, ?)",
+    "routes": "INSERT OR REPLACE INTO routes VALUES (?, ?, ?)",
+    "trips": "INSERT OR REPLACE INTO trips VALUES (?, ?, ?, ?)",
+    "stop_times": "INSERT INTO stop_times VALUES (?, ?, ?)",
+    "shape_points": "INSERT INTO shape_points VALUES (?, ?, ?, ?)",
+}
+
+# attributes of elements stored in their own table, or rebuilt on load
+_STOP_SKIPPED = ("refs",)
+_ROUTE_SKIPPED = ("trips",)
+_TRIP_SKIPPED = ("route", "way", "_stops_dict", "_stops",
+                 "_stops_list_generated")
+
+# SQLite limits the number of parameters of a statement
+_MAX_PARAMS = 500
+
+
+def _dump(element, skipped):
+    state = {k: v for k, v in element.__dict__.items() if k not in skipped}
+    return pickle.dumps((type(element), state), pickle.HIGHEST_PROTOCOL)
+
+
+def _load(data):
+    cls, state = pickle.loads(data)
+    element = cls.__new__(cls)
+    element.__dict__.update(state)
+    return element
+
+
+def _chunks(items, size=_MAX_PARAMS):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _TableView(object):
+    """
+    Iterable over the elements of a table, fetched by batches of batch_size
+    so that they are never all in memory at the same time
+    """
+
+    def __init__(self, schedule, table, materialize, batch_size):
+        self.schedule = schedule
+        self.table = table
+        self.materialize = materialize
+        self.batch_size = batch_size
+
+    def __len__(self):
+        self.schedule.sync()
+        cursor = self.schedule.db.execute(f"SELECT COUNT(*) FROM {self.table}")
+        return cursor.fetchone()[0]
+
+    def __iter__(self):
+        self.schedule.sync()
+        cursor = self.schedule.db.execute(
+            f"SELECT id, data FROM {self.table} ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                return
+            yield from self.materialize(rows)
+
+
+class SqliteSchedule(Schedule):
+    """
+    GTFS schedule stored in a SQLite database instead of memory
+
+    It has the API of Schedule, so that GTFSImporter, conflation and export
+    work unchanged, but only holds the elements in use. Elements are pickled
+    in the database, indexed by id, ref and shape, and rebuilt when they are
+    requested. A route is always rebuilt with its trips, their stops and
+    their way. While they are in use, the same element is always returned
+    for a given id, as trips and conflation compare stops by identity.
+
+    Writes are buffered and inserted by batches of BATCH_SIZE rows in a
+    single transaction, committed by sync, which any read does first.
+    Stop times and shape points are inserted unfiltered, rows of trips and
+    shapes that are not in the schedule being deleted at once by sync.
+    """
+
+    BATCH_SIZE = 10000
+    ROUTES_BATCH_SIZE = 20
+
+    def __init__(self, path):
+        self.path = path
+        self.issues = []
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+        self._pending = {table: [] for table in _INSERTS}
+        self._pending_count = 0
+        # stops of the pending batch, not visible to queries yet
+        self._pending_stops_by_coords = {}
+        self._dirty = False
+
+        # routes without their trips, to which trips are added while loading
+        self._route_stubs = {}
+
+        self._stops = weakref.WeakValueDictionary()
+        self._routes = weakref.WeakValueDictionary()
+        self._ways = weakref.WeakValueDictionary()
+
+    def __getstate__(self):
+        raise TypeError("SqliteSchedule can't be pickled, its database "
+                        "file is the cache")
+
+    def vacuum(self):
+        """
+        Reclaim the space of the rows deleted while loading
+        """
+        self.sync()
+        self.db.execute("VACUUM")
+
+    def close(self):
+        self.sync()
+        self.db.close()
+
+    def _write(self, table, row):
+        self._pending[table].append(row)
+        self._pending_count += 1
+        self._dirty = True
+        if self._pending_count >= self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        for table, rows in self._pending.items():
+            if rows:
+                self.db.executemany(_INSERTS[table], rows)
+                rows.clear()
+        self._pending_count = 0
+        self._pending_stops_by_coords.clear()
+
+    def sync(self):
+        """
+        Write pending rows, filter them and commit
+        """
+        if not self._dirty:
+            self.db.commit()
+            return
+
+        self._flush()
+        # stop times of merged stops reference the stop they were merged in
+        self.db.execute(
+            "UPDATE stop_times SET stop_id = (SELECT stop_id FROM stop_aliases "
+            "WHERE alias = stop_times.stop_id) "
+            "WHERE stop_id IN (SELECT alias FROM stop_aliases)")
+        self.db.execute(
+            "DELETE FROM stop_times WHERE trip_id NOT IN (SELECT id FROM trips)")
+        self.db.execute(
+            "DELETE FROM shape_points "
+            "WHERE shape_id NOT IN "
+            "(SELECT shape_id FROM trips WHERE shape_id IS NOT NULL)")
+        self.db.commit()
+        self._dirty = False
+
+    # stops
+
+    def _stops_bbox(self):
+        self.sync()
+        return self.db.execute(
+            "SELECT MIN(lat), MIN(lon), MAX(lat), MAX(lon) FROM stops").fetchone()
+
+    @property
+    def stops(self):
+        return _TableView(self, "stops", self._materialize_stops,
+                          self.BATCH_SIZE)
+
+    def _materialize_stops(self, rows):
+        # strong references, elements of the weak maps may vanish anytime
+        stops = {}
+        missing = []
+        for stop_id, data in rows:
+            stop = self._stops.get(stop_id)
+            if stop is None:
+                missing.append((stop_id, data))
+            else:
+                stops[stop_id] = stop
+
+        refs = {}
+        for ids in _chunks(i for i, _ in missing):
+            marks = ",".join("?" * len(ids))
+            cursor = self.db.execute(
+                f"SELECT stop_id, ref FROM stop_refs WHERE stop_id IN ({marks}) "
+                f"ORDER BY rowid", ids)
+            for stop_id, ref in cursor:
+                refs.setdefault(stop_id, []).append(ref)
+
+        for stop_id, data in missing:
+            stop = _load(data)
+            stop.refs = refs.get(stop_id, [])
+            self._stops[stop_id] = stops[stop_id] = stop
+
+        return [stops[stop_id] for stop_id, _ in rows]
+
+    def _fetch_stops(self, stop_ids):
+        """
+        Return a dict of the stops with the given ids, aliases included
+        """
+        stop_ids = set(stop_ids)
+        stops = {}
+        for stop_id in stop_ids:
+            stop = self._stops.get(stop_id)
+            if stop is not None:
+                stops[stop_id] = stop
+
+        aliases = {}
+        for ids in _chunks(stop_ids - stops.keys()):
+            marks = ",".join("?" * len(ids))
+            cursor = self.db.execute(
+                f"SELECT alias, stop_id FROM stop_aliases WHERE alias IN ({marks})",
+                ids)
+            aliases.update(cursor)
+
+        wanted = (stop_ids - stops.keys() - aliases.keys()) | set(aliases.values())
+        for ids in _chunks(wanted):
+            marks = ",".join("?" * len(ids))
+            cursor = self.db.execute(
+                f"SELECT id, data FROM stops WHERE id IN ({marks})", ids)
+            for stop in self._materialize_stops(cursor.fetchall()):
+                stops[stop.id] = stop
+
+        for alias, stop_id in aliases.items():
+            stops[alias] = stops[stop_id]
+
+        return stops
+
+    def find_duplicate_stop(self, stop):
+        s = self._pending_stops_by_coords.get((stop.lat, stop.lon))
+        if s is None:
+            row = self.db.execute(
+                "SELECT id, data FROM stops WHERE lat = ? AND lon = ? "
+                "ORDER BY rowid LIMIT 1", (stop.lat, stop.lon)).fetchone()
+            if row is None:
+                return None
+            s = self._materialize_stops([row])[0]
+
+        if s.name != stop.name:
+            print("WARNING: These stops have the same coordinates "
+                  "but not the same name. Name of the first one will be used.")
+            print(f"\tid={s.id}, refs={s.refs}, name={s.name}")
+            print(f"\tid={stop.id}, refs={stop.refs}, name={stop.name}")
+            print("")
+
+        return s
+
+    def add_stop(self, stop, deduplicate=False):
+        existing_stop = None
+        if deduplicate:
+            existing_stop = self.find_duplicate_stop(stop)
+
+        if existing_stop:
+            self._write("stop_aliases", (stop.id, existing_stop.id))
+            if stop.ref not in existing_stop.refs:
+                existing_stop.add_ref(stop.ref)
+                self._write("stop_refs", (stop.ref, existing_stop.id))
+        else:
+            self._stops[stop.id] = stop
+            self._pending_stops_by_coords.setdefault((stop.lat, stop.lon), stop)
+            self._write("stops", (stop.id, stop.lat, stop.lon,
+                                  _dump(stop, _STOP_SKIPPED)))
+            for ref in stop.refs:
+                self._write("stop_refs", (ref, stop.id))
+
+    def get_stop(self, stop_id, *args):
+        self.sync()
+        stop = self._fetch_stops([stop_id]).get(stop_id)
+        if stop is None:
+            if args:
+                return args[0]
+            raise KeyError(stop_id)
+        return stop
+
+    def get_stop_by_ref(self, stop_ref):
+        self.sync()
+        row = self.db.execute(
+            "SELECT stop_id FROM stop_refs WHERE ref = ? ORDER BY rowid LIMIT 1",
+            (stop_ref,)).fetchone()
+        if row is not None:
+            return self._fetch_stops([row[0]])[row[0]]
+
+    def reindex_stop(self, stop, old_refs):
+        self.sync()
+        for ref in set(old_refs).difference(stop.refs):
+            self.db.execute("DELETE FROM stop_refs WHERE ref = ? AND stop_id = ?",
+                            (ref, stop.id))
+        for ref in stop.refs:
+            if ref not in old_refs:
+                self._write("stop_refs", (ref, stop.id))
+
+    # routes and trips
+
+    @property
+    def routes(self):
+        # a route comes with all its trips and their stops
+        return _TableView(self, "routes", self._materialize_routes,
+                          self.ROUTES_BATCH_SIZE)
+
+    @property
+    def trips(self):
+        return _TripsView(self)
+
+    def _materialize_routes(self, rows):
+        routes = {}
+        missing = {}
+        for route_id, data in rows:
+            route = self._routes.get(route_id)
+            if route is None:
+                route = _load(data)
+                route.trips = []
+                self._routes[route_id] = missing[route_id] = route
+            routes[route_id] = route
+
+        if missing:
+            self._load_trips(missing)
+
+        return [routes[route_id] for route_id, _ in rows]
+
+    def _load_trips(self, routes):
+        trips = {}
+        for ids in _chunks(routes):
+            marks = ",".join("?" * len(ids))
+            cursor = self.db.execute(
+                f"SELECT id, route_id, data FROM trips "
+                f"WHERE route_id IN ({marks}) ORDER BY rowid", ids)
+            for trip_id, route_id, data in cursor:
+                trip = _load(data)
+                trip._stops_dict = {}
+                trip._stops = []
+                trip._stops_list_generated = False
+                trip.route = routes[route_id]
+                trip.route.trips.append(trip)
+                trips[trip_id] = trip
+
+        stop_times = []
+        for ids in _chunks(trips):
+            marks = ",".join("?" * len(ids))
+            cursor = self.db.execute(
+                f"SELECT trip_id, sequence, stop_id FROM stop_times "
+                f"WHERE trip_id IN ({marks})", ids)
+            stop_times.extend(cursor)
+
+        stops = self._fetch_stops(stop_id for _, _, stop_id in stop_times)
+        for trip_id, sequence, stop_id in stop_times:
+            trips[trip_id].add_stop(sequence, stops[stop_id])
+
+        ways = self._fetch_ways(set(t.shape_id for t in trips.values()))
+        for trip in trips.values():
+            trip.way = ways[trip.shape_id]
+
+    def _fetch_ways(self, shape_ids):
+        ways = {}
+        for shape_id in shape_ids:
+            way = self._ways.get(shape_id)
+            if way is None:
+                way = self._ways[shape_id] = WayUnordered()
+            ways[shape_id] = way
+
+        for ids in _chunks(i for i in shape_ids if not ways[i].nodes):
+            marks = ",".join("?" * len(ids))
+            cursor = self.db.execute(
+                f"SELECT shape_id, sequence, lat, lon FROM shape_points "
+                f"WHERE shape_id IN ({marks})", ids)
+            for shape_id, sequence, lat, lon in cursor:
+                ways[shape_id].add_node(lat, lon, sequence)
+
+        return ways
+
+    def add_route(self, route):
+        self._route_stubs[route.id] = route
+        self._write("routes", (route.id, route.ref,
+                               _dump(route, _ROUTE_SKIPPED)))
+
+    def get_route(self, route_id, *args):
+        self.sync()
+        route = self._routes.get(route_id)
+        if route is not None:
+            return route
+
+        row = self.db.execute("SELECT id, data FROM routes WHERE id = ?",
+                              (route_id,)).fetchone()
+        if row is None:
+            if args:
+                return args[0]
+            raise KeyError(route_id)
+        return self._materialize_routes([row])[0]
+
+    def add_route_trip(self, trip):
+        # the trips of a route being loaded are not kept in memory
+        route = self._route_stubs.get(trip.route_id)
+        if route is None:
+            return False
+
+        trip.set_route(route)
+        self.add_trip(trip)
+        return True
+
+    def add_trip(self, trip):
+        self._write("trips", (trip.id, trip.route_id, trip.shape_id,
+                              _dump(trip, _TRIP_SKIPPED)))
+
+    def get_trip(self, trip_id, *args):
+        self.sync()
+        row = self.db.execute("SELECT route_id FROM trips WHERE id = ?",
+                              (trip_id,)).fetchone()
+        if row is not None:
+            route = self.get_route(row[0])
+            for trip in route.trips:
+                if trip.id == trip_id:
+                    return trip
+
+        if args:
+            return args[0]
+        raise KeyError(trip_id)
+
+    def add_stop_time(self, stop_time):
+        self._write("stop_times", (stop_time.trip_id, stop_time.sequence,
+                                   stop_time.stop_id))
+
+    def add_shape_point(self, shape_id, lat, lon, seq):
+        self._write("shape_points", (shape_id, seq, lat, lon))
+
+    # stop usage, queried from the stop_times index instead of being built
+
+    _STOP_USAGE_QUERY = (
+        "SELECT DISTINCT stop_times.stop_id, trips.route_id, trips.id "
+        "FROM stop_times JOIN trips ON trips.id = stop_times.trip_id ")
+
+    @property
+    def stop_usage(self):
+        self.sync()
+        usage = {}
+        for stop_id, route_id, trip_id in self.db.execute(
+                self._STOP_USAGE_QUERY + "ORDER BY 2, 3"):
+            usage.setdefault(stop_id, []).append((route_id, trip_id))
+        return usage
+
+    def get_stop_usage(self, stop_id):
+        stop = self.get_stop(stop_id, None)
+        if stop is None:
+            return []
+        return [(route_id, trip_id) for _, route_id, trip_id in self.db.execute(
+            self._STOP_USAGE_QUERY + "WHERE stop_times.stop_id = ? ORDER BY 2, 3",
+            (stop.id,))]
+
+    def drop_trips(self, trip_ids):
+        self.sync()
+        for ids in _chunks(trip_ids):
+            marks = ",".join("?" * len(ids))
+            self.db.execute(f"DELETE FROM trips WHERE id IN ({marks})", ids)
+            self.db.execute(f"DELETE FROM stop_times WHERE trip_id IN ({marks})",
+                            ids)
+
+    def _update_trips(self, trips):
+        self.db.executemany(
+            "UPDATE trips SET data = ? WHERE id = ?",
+            [(_dump(trip, _TRIP_SKIPPED), trip.id) for trip in trips])
+
+    @profiled("remove_duplicated_trips")
+    def remove_duplicated_trips(self):
+        removed = 0
+        total = len(self.routes)
+        print(f"Removing duplicated trips of {total} routes")
+
+        for i, route in enumerate(self.routes, start=1):
+            trip_ids = route.remove_duplicated_trips()
+            removed += len(trip_ids)
+            self.drop_trips(trip_ids)
+            # occurrences of the remaining trips were updated
+            self._update_trips(route.trips)
+
+            print(f"Removing... {i}/{total}")
+
+        self.sync()
+        return removed
+
+    @profiled("remove_truncated_trips")
+    def remove_truncated_trips(self, policy="longest"):
+        removed = 0
+        # routes are materialized one batch at a time, their trips are
+        # grouped route by route
+        for route in self.routes:
+            trip_ids = route.remove_truncated_trips(policy)
+            removed += len(trip_ids)
+            self.drop_trips(trip_ids)
+
+        self.sync()
+        return removed
+
+
+class _TripsView(object):
+    """
+    Trips of all routes, loaded route by route
+    """
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+
+    def __len__(self):
+        self.schedule.sync()
+        return self.schedule.db.execute("SELECT COUNT(*) FROM trips").fetchone()[0]
+
+    def __iter__(self):
+        for route in self.schedule.routes:
+            yield from route.trips
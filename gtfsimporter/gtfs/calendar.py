@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday",
+            "saturday", "sunday"]
+
+
+def parse_date(value):
+    """
+    Date of a GTFS YYYYMMDD string
+    """
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+class ServiceCalendar(object):
+    """
+    Days on which each service of a GTFS dataset runs, from calendar.txt
+    and calendar_dates.txt, both optional.
+
+    Each service is a bitset, an int whose bit i is set if the service runs
+    origin + i days, origin being the first day of the calendar. Checking
+    whether a service runs within a date range is then a single mask.
+    """
+
+    _CALENDAR_FILE = "calendar.txt"
+    _CALENDAR_DATES_FILE = "calendar_dates.txt"
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.services = {}
+
+    def day(self, d):
+        return (d - self.origin).days
+
+    def add_date(self, service_id, d):
+        day = self.day(d)
+        if day >= 0:
+            self.services[service_id] = self.services.get(service_id, 0) | 1 << day
+
+    def remove_date(self, service_id, d):
+        day = self.day(d)
+        if day >= 0:
+            self.services[service_id] = self.services.get(service_id, 0) & ~(1 << day)
+
+    def active_services(self, start, end=None):
+        """
+        Return the ids of the services running at least one day between
+        start and end, both included
+        """
+        end = start if end is None else end
+        first = max(self.day(start), 0)
+        last = self.day(end)
+        if last < first:
+            return set()
+
+        mask = ((1 << (last - first + 1)) - 1) << first
+        return set(service_id for service_id, days in self.services.items()
+                   if days & mask)
+
+    @classmethod
+    def read_rows(cls, importer, filename, columns):
+        """
+        Return the values of columns of each row of filename, as tuples
+        """
+        if not importer.has_table(filename):
+            return []
+        with importer.open_table(filename) as (header, reader):
+            indexes = [header.index(column) for column in columns]
+            return [tuple(row[i] for i in indexes) for row in reader]
+
+    @classmethod
+    def from_feed(cls, importer):
+        """
+        Calendar of the dataset read by importer, a GTFSImporter
+        """
+        calendar = cls.read_rows(
+            importer, cls._CALENDAR_FILE,
+            ["service_id", "start_date", "end_date"] + WEEKDAYS)
+        dates = cls.read_rows(
+            importer, cls._CALENDAR_DATES_FILE,
+            ["service_id", "date", "exception_type"])
+
+        days = [parse_date(row[1]) for row in calendar] + \
+               [parse_date(row[1]) for row in dates]
+        service_calendar = cls(min(days) if days else date.today())
+
+        for service_id, start, end, *weekdays in calendar:
+            start = parse_date(start)
+            end = parse_date(end)
+            weekdays = [day == "1" for day in weekdays]
+
+            service_calendar.services.setdefault(service_id, 0)
+            d = start
+            while d <= end:
+                if weekdays[d.weekday()]:
+                    service_calendar.add_date(service_id, d)
+                d += timedelta(days=1)
+
+        # exceptions: 1 if the service was added on that date, 2 if removed
+        for service_id, d, exception_type in dates:
+            d = parse_date(d)
+            if exception_type == "1":
+                service_calendar.add_date(service_id, d)
+            elif exception_type == "2":
+                service_calendar.remove_date(service_id, d)
+
+        return service_calendar
@@ -0,0 +1,200 @@
+import json
+
+from hashlib import blake2b
+
+from .importer import GTFSImporter
+
+
+_MASK = (1 << 64) - 1
+
+
+def digest(values):
+    """
+    64-bit digest of a sequence of values, stable between runs
+    """
+    data = "\x1f".join(str(v) for v in values).encode()
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+
+class FeedDigest(object):
+    """
+    Digests of a GTFS feed, a directory or a zip archive, keyed by id.
+
+    Rows are read through the mapping of the agency of the feed, so that
+    only the values making up the schedule are hashed, and skipped rows are
+    ignored. Files are streamed: stops and routes are kept as one digest per
+    id, and stop patterns, the headsign and stops of a trip, are the sum of
+    the digests of its stop times, which can be computed row by row whatever
+    the order of stop_times.txt. Memory thus depends on the number of ids,
+    not on the number of stop times.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.importer = GTFSImporter(path)
+
+        # stop id -> digest, route id -> digest
+        self.stops = {}
+        self.routes = {}
+        # route id -> set of stop pattern digests, and set of stop ids
+        self.route_patterns = {}
+        self.route_stops = {}
+
+    def rows(self, table, filename):
+        """
+        Yield the values passed to the element factory by the mapping of
+        table for each row that is not skipped
+        """
+        with self.importer.open_table(filename) as (header, reader):
+            adapt = self.importer.adapter(table, header, lambda *values: values)
+            for row in reader:
+                values = adapt(row)
+                if values is not None:
+                    yield values
+
+    def read(self):
+        importer = self.importer
+
+        # the id is the first argument of element factories
+        for values in self.rows("stops", importer._STOPS_FILE):
+            self.stops[values[0]] = digest(values)
+
+        # only stops for agencies without routes, see StlAgency
+        if importer.agency.routes is None:
+            return self
+
+        for values in self.rows("routes", importer._ROUTES_FILE):
+            self.routes[values[0]] = digest(values)
+
+        trip_routes = {}
+        patterns = {}
+        with importer.open_table(importer._TRIPS_FILE) as (header, reader):
+            make_trip = importer.adapter("trips", header)
+            for row in reader:
+                trip = make_trip(row)
+                if trip is not None and trip.route_id in self.routes:
+                    trip_routes[trip.id] = trip.route_id
+                    patterns[trip.id] = digest([trip.headsign])
+
+        route_stops = {route_id: set() for route_id in self.routes}
+        # the same stops are at the same position in many trips
+        stop_digests = {}
+        for trip_id, stop_id, sequence in self.rows(
+                "stop_times", importer._STOP_TIMES_FILE):
+            route_id = trip_routes.get(trip_id)
+            if route_id is None:
+                continue
+
+            key = (sequence, stop_id)
+            stop_digest = stop_digests.get(key)
+            if stop_digest is None:
+                stop_digest = stop_digests[key] = digest(key)
+
+            patterns[trip_id] = (patterns[trip_id] + stop_digest) & _MASK
+            route_stops[route_id].add(stop_id)
+
+        self.route_stops = route_stops
+        self.route_patterns = {route_id: set() for route_id in self.routes}
+        for trip_id, route_id in trip_routes.items():
+            self.route_patterns[route_id].add(patterns[trip_id])
+
+        return self
+
+
+class FeedDiff(object):
+    """
+    Differences between two versions of a GTFS feed: ids of added, removed
+    and modified stops and routes, number of stop patterns added and removed
+    for each route in both versions, and the routes to export or update
+    again, i.e. added or modified ones, the ones whose stop patterns changed,
+    and the ones serving an added, removed or modified stop.
+
+    Ids are the ones of the new version. A diff is stored as JSON, to be
+    given to other commands with --diff.
+    """
+
+    def __init__(self, stops, routes, patterns, affected_routes):
+        self.stops = stops
+        self.routes = routes
+        self.patterns = patterns
+        self.affected_routes = affected_routes
+
+    @property
+    def affected_stops(self):
+        return self.stops["added"] + self.stops["modified"]
+
+    @classmethod
+    def compare_digests(cls, old, new):
+        return {
+            "added": sorted(set(new) - set(old)),
+            "removed": sorted(set(old) - set(new)),
+            "modified": sorted(i for i in set(old) & set(new)
+                               if old[i] != new[i]),
+        }
+
+    @classmethod
+    def compare(cls, old_path, new_path):
+        """
+        Diff of the feeds at old_path and new_path, read one after the other
+        """
+        old = FeedDigest(old_path).read()
+        new = FeedDigest(new_path).read()
+
+        stops = cls.compare_digests(old.stops, new.stops)
+        routes = cls.compare_digests(old.routes, new.routes)
+
+        patterns = {}
+        for route_id in sorted(set(old.routes) & set(new.routes)):
+            old_patterns = old.route_patterns[route_id]
+            new_patterns = new.route_patterns[route_id]
+            if old_patterns != new_patterns:
+                patterns[route_id] = {
+                    "added": len(new_patterns - old_patterns),
+                    "removed": len(old_patterns - new_patterns),
+                }
+
+        affected = set(routes["added"]) | set(routes["modified"]) | set(patterns)
+
+        # routes of the new version serving changed stops, removed ones
+        # being served by routes of the old version only
+        changed_stops = set(stops["added"]) | set(stops["modified"])
+        for route_id, stop_ids in new.route_stops.items():
+            if not stop_ids.isdisjoint(changed_stops):
+                affected.add(route_id)
+        removed_stops = set(stops["removed"])
+        for route_id, stop_ids in old.route_stops.items():
+            if route_id in new.routes and not stop_ids.isdisjoint(removed_stops):
+                affected.add(route_id)
+
+        return cls(stops, routes, patterns, sorted(affected))
+
+    def as_dict(self):
+        return {
+            "stops": self.stops,
+            "routes": self.routes,
+            "patterns": self.patterns,
+            "affected_routes": self.affected_routes,
+        }
+
+    def write(self, path):
+        with open(path, 'w', encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["stops"], data["routes"], data["patterns"],
+                   data["affected_routes"])
+
+    def print_summary(self):
+        for name, changes in (("Stops", self.stops), ("Routes", self.routes)):
+            print(f"{name}: {len(changes['added'])} added, "
+                  f"{len(changes['removed'])} removed, "
+                  f"{len(changes['modified'])} modified")
+
+        added = sum(p["added"] for p in self.patterns.values())
+        removed = sum(p["removed"] for p in self.patterns.values())
+        print(f"Stop patterns: {added} added, {removed} removed, "
+              f"in {len(self.patterns)} route(s)")
+        print(f"{len(self.affected_routes)} route(s) to export or update")
@@ -3,6 +3,8 @@ from collections import defaultdict
 
 from math import cos, pi
 
+from .patterns import PatternStatistics
+
 class GtfsElement(object):
 
     extra_tags = []
@@ -88,6 +90,10 @@ class GtfsTrip(GtfsElement):
         self.way = WayUnordered()
         self.shape_id = shape_id
 
+        # number of trips of the dataset this trip stands for, duplicates
+        # being removed from the schedule
+        self.occurrences = 1
+
     @property
     def name(self):
         raise NotImplementedError("GtfsTrip-subclass must implement this")
@@ -118,18 +124,6 @@ class GtfsTrip(GtfsElement):
         self._stops_dict[sequence] = stop
         self._stops_list_generated = False
 
-    def is_similar(self, other):
-        if self.route != other.route or self.ref != other.ref:
-            return False
-        if len(self.stops) != len(other.stops):
-            return False
-
-        for self_stop, other_stop in zip(self.stops, other.stops):
-            if self_stop != other_stop:
-                return False
-        else:
-            return True
-
     def __repr__(self):
         return "<Trip id={}, name={}, {} stops>".format(self.id, self.ref, len(self._stops))
 
@@ -156,44 +150,39 @@ class GtfsRoute(GtfsElement):
         self.trips.append(trip)
         trip.set_route(self)
 
-    def has_similar_trip(self, trip, trip_collection):
-        for t in trip_collection:
-            if trip.is_similar(t):
-                return True
-
-        return False
-
     def remove_duplicated_trips(self):
         unique_trips = []
         duplicate_trip_ids = []
+        # trips of a route are duplicates if they have the same ref and stops
+        seen = {}
         for trip in self.trips:
-            if not self.has_similar_trip(trip, unique_trips):
+            key = (trip.ref, tuple(trip.stops))
+            if key not in seen:
+                seen[key] = trip
                 unique_trips.append(trip)
             else:
+                seen[key].occurrences += getattr(trip, "occurrences", 1)
                 duplicate_trip_ids.append(trip.id)
 
         self.trips = unique_trips
 
         return duplicate_trip_ids
 
-    def remove_truncated_trips(self):
+    def remove_truncated_trips(self, policy="longest", statistics=None):
         """
-        For each headsign, this function keeps only the longest trip. The point
-        is to keep only one trip for each direction.
+        For each headsign, this function keeps only the trips of the stop
+        patterns selected by policy, see PatternStatistics.select. The point
+        is to keep only one trip for each direction. statistics, grouping
+        the trips of this route, is computed if not given.
         """
-        dups = {}
-        truncated_trip_ids = []
-        for trip in self.trips:
-            if trip.ref in dups:
-                if len(dups[trip.ref].stops) < len(trip.stops):
-                    truncated_trip_ids.append(dups[trip.ref].id)
-                    dups[trip.ref] = trip
-                else:
-                    truncated_trip_ids.append(trip.id)
-            else:
-                dups[trip.ref] = trip
+        if statistics is None:
+            statistics = PatternStatistics.from_routes([self])
+
+        kept = [p.trip for p in statistics.select(self.id, policy)]
+        kept_ids = set(trip.id for trip in kept)
+        truncated_trip_ids = [t.id for t in self.trips if t.id not in kept_ids]
 
-        self.trips = list(dups.values())
+        self.trips = kept
 
         return truncated_trip_ids
 
@@ -1,3 +0,0 @@
-
-class SkipEntryError(Exception):
-    pass
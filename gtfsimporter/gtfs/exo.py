@@ -1,130 +1,119 @@
 
 
-from .elements import GtfsRoute, GtfsStop, GtfsStopTime, GtfsTrip
-from .exceptions import SkipEntryError
+from .elements import GtfsRoute, GtfsStop, GtfsTrip
+from .mapping import Constant, TableMapping, ROUTE_COLUMNS, STOP_COLUMNS, \
+        STOP_TIME_MAPPING, TRIP_COLUMNS
+
+EXO_REMOTE_URL = "https://exo.quebec/xdata"
+
+# caches pickled when exo stops had their own class
+ExoStop = GtfsStop
+
+
+class ExoRoute(GtfsRoute):
+
+    @property
+    def name(self):
+        return self.get_name()
+
+    def get_name(self):
+        return "Bus {} : {}".format(self.code, self._name)
+
+
+
+class ExoTrip(GtfsTrip):
+
+    @property
+    def name(self):
+        return self.get_name()
+
+    def get_name(self, lang='fr'):
+        return "Bus {} : {}".format(
+                self.route.id, self.headsign)
+
 
 class ExoBaseAgency(object):
 
-    def make_stop(self, row):
-        return ExoStop(row)
+    stops = TableMapping(GtfsStop, STOP_COLUMNS)
 
-    def make_route(self, row):
-        return ExoRoute(row, self.name, "EXO")
+    trips = TableMapping(ExoTrip, TRIP_COLUMNS)
 
-    def make_trip(self, row):
-        return ExoTrip(row)
+    stop_times = STOP_TIME_MAPPING
 
-    def make_stop_time(self, row):
-        return ExoStopTime(row)
+    @property
+    def routes(self):
+        # the network of routes is the agency
+        return TableMapping(ExoRoute, ROUTE_COLUMNS + [Constant(self.name),
+                                                       Constant("EXO")])
 
 class ExoChamblyAgency(ExoBaseAgency):
     id = "CITCRC"
     name = "exo-Chambly-Richelieu-Carignan"
+    provider = "exo-chambly"
+    archive_url = EXO_REMOTE_URL + "/citcrc/google_transit.zip"
 
 class ExoHautSaintLaurentAgency(ExoBaseAgency):
     id = "CITHSL"
     name = "exo-Haut-Saint-Laurent"
+    provider = "exo-haut-st-laurent"
+    archive_url = EXO_REMOTE_URL + "/cithsl/google_transit.zip"
 
 class ExoLaurentidesAgency(ExoBaseAgency):
     id = "CITLA"
     name = "exo-Laurentides"
+    provider = "exo-laurentides"
+    archive_url = EXO_REMOTE_URL + "/citla/google_transit.zip"
 
 class ExoPresquIleAgency(ExoBaseAgency):
     id = "CITPI"
     name = "exo-La Presqu'île"
+    provider = "exo-presquile"
+    archive_url = EXO_REMOTE_URL + "/citpi/google_transit.zip"
 
 class ExoRichelainAgency(ExoBaseAgency):
     id = "CITLR"
     name = "exo-Le Richelain"
+    provider = "exo-st-richelain"
+    archive_url = EXO_REMOTE_URL + "/citlr/google_transit.zip"
 
 class ExoRoussillonAgency(ExoBaseAgency):
     id = "CITROUS"
     name = "exo-Roussillon"
+    provider = "exo-roussillon"
+    archive_url = EXO_REMOTE_URL + "/citrous/google_transit.zip"
 
 class ExoSorelAgency(ExoBaseAgency):
     id = "CITSV"
     name = "exo-Sorel-Varennes"
+    provider = "exo-sorel-varennes"
+    archive_url = EXO_REMOTE_URL + "/citsv/google_transit.zip"
 
 class ExoSudOuestAgency(ExoBaseAgency):
     id = "CITSO"
     name = "exo-Sud-Ouest"
+    provider = "exo-sud-ouest"
+    archive_url = EXO_REMOTE_URL + "/citso/google_transit.zip"
 
 class ExoValleeRichelieuAgency(ExoBaseAgency):
     id = "CITVR"
     name = "exo-Vallée du Richelieu"
+    provider = "exo-vallee-richelieu"
+    archive_url = EXO_REMOTE_URL + "/citvr/google_transit.zip"
 
 class ExoAssomptionAgency(ExoBaseAgency):
     id = "MRCLASSO"
     name = "exo-L'Assomption"
+    provider = "exo-assomption"
+    archive_url = EXO_REMOTE_URL + "/mrclasso/google_transit.zip"
 
 class ExoTerrebonneAgency(ExoBaseAgency):
     id = "MRCLM"
     name = "exo-Terrebonne-Mascouche"
+    provider = "exo-terrebonne"
+    archive_url = EXO_REMOTE_URL + "/mrclm/google_transit.zip"
 
 class ExoSteJulieAgency(ExoBaseAgency):
     id = "OMITSJU"
     name = "exo-Sainte-Julie"
-
-
-class ExoStop(GtfsStop):
-
-    def __init__(self, row):
-        stop_id = row["stop_id"]
-        name = row["stop_name"]
-        ref = row["stop_code"]
-        lat = row["stop_lat"]
-        lon = row["stop_lon"]
-
-        super().__init__(stop_id, lat, lon, name, ref)
-
-
-class ExoRoute(GtfsRoute):
-
-    def __init__(self, row, network, operator):
-        try:
-            route_id = row["route_id"]
-            route_code = row["route_short_name"]
-            route_name = row["route_long_name"]
-        except:
-            print(row)
-
-        super().__init__(route_id, route_code, route_name,
-                         network, operator)
-
-    @property
-    def name(self):
-        return self.get_name()
-
-    def get_name(self):
-        return "Bus {} : {}".format(self.code, self._name)
-
-
-
-class ExoTrip(GtfsTrip):
-
-    def __init__(self, row):
-        trip_id = row["trip_id"]
-        route_id = row["route_id"]
-        headsign = row["trip_headsign"]
-
-        shape_id = row["shape_id"]
-
-        super().__init__(trip_id, route_id, headsign, shape_id=shape_id)
-
-    @property
-    def name(self):
-        return self.get_name()
-
-    def get_name(self, lang='fr'):
-        return "Bus {} : {}".format(
-                self.route.id, self.headsign)
-
-
-class ExoStopTime(GtfsStopTime):
-
-    def __init__(self, row):
-        trip_id = row["trip_id"]
-        stop_id = row["stop_id"]
-        stop_sequence = int(row["stop_sequence"])
-
-        super().__init__(trip_id, stop_id, stop_sequence)
+    provider = "exo-ste-julie"
+    archive_url = EXO_REMOTE_URL + "/omitsju/google_transit.zip"
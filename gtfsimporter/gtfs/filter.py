@@ -0,0 +1,116 @@
+import re
+
+from .calendar import parse_date
+
+
+class GtfsFilter(object):
+    """
+    Part of a GTFS dataset to load: routes with the given ids or refs, of
+    the given agencies, trips whose headsign matches a regular expression,
+    serving at least one stop in a bounding box (south, west, north,
+    east), or running at least one day in dates, a (start, end) tuple of
+    datetime.date. Criteria left to None select everything.
+
+    GTFSImporter applies it while reading each file, so that only the
+    trips of selected routes, their stop times, and the stops and shapes
+    they reference are loaded.
+    """
+
+    def __init__(self, route_ids=None, route_refs=None, agency_ids=None,
+                 headsign=None, bbox=None, dates=None):
+        self.route_ids = set(route_ids) if route_ids is not None else None
+        self.route_refs = set(route_refs) if route_refs is not None else None
+        self.agency_ids = set(agency_ids) if agency_ids is not None else None
+        self.headsign = re.compile(headsign) if headsign is not None else None
+        self.bbox = tuple(bbox) if bbox is not None else None
+        self.dates = tuple(dates) if dates is not None else None
+
+    @property
+    def selects_routes(self):
+        """
+        True if only some routes are selected, stops then being the ones
+        of the selected trips
+        """
+        return self.route_ids is not None or self.route_refs is not None or \
+            self.agency_ids is not None or self.headsign is not None or \
+            self.dates is not None
+
+    @property
+    def selects_trips(self):
+        return self.headsign is not None or self.bbox is not None or \
+            self.dates is not None
+
+    def accepts_agency(self, agency_id):
+        return self.agency_ids is None or agency_id in self.agency_ids
+
+    def accepts_route(self, route):
+        if self.route_ids is not None and route.id not in self.route_ids:
+            return False
+        if self.route_refs is not None and route.ref not in self.route_refs:
+            return False
+        return True
+
+    def accepts_trip(self, trip):
+        return self.headsign is None or \
+            self.headsign.search(trip.headsign) is not None
+
+    def contains(self, lat, lon):
+        south, west, north, east = self.bbox
+        return south <= lat <= north and west <= lon <= east
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Filter built from the --route-ref, --agency, --headsign, --bbox,
+        --date and --diff options, None if none is set
+        """
+        def split(value):
+            return value.split(",") if value else None
+
+        route_refs = split(getattr(args, "route_ref", None))
+        agency_ids = split(getattr(args, "agency", None))
+        headsign = getattr(args, "headsign", None)
+        bbox = split(getattr(args, "bbox", None))
+        if bbox is not None:
+            bbox = [float(coord) for coord in bbox]
+            if len(bbox) != 4:
+                raise ValueError("--bbox expects south,west,north,east")
+
+        dates = getattr(args, "date", None)
+        if dates is not None:
+            dates = [parse_date(d) for d in dates.split("-")]
+            if len(dates) == 1:
+                dates *= 2
+
+        route_ids = None
+        if getattr(args, "diff", None) is not None:
+            # imported here, the diff module imports the importer
+            from .diff import FeedDiff
+            route_ids = FeedDiff.load(args.diff).affected_routes
+
+        if route_ids is None and route_refs is None and agency_ids is None \
+                and headsign is None and bbox is None and dates is None:
+            return None
+
+        return cls(route_ids=route_ids, route_refs=route_refs,
+                   agency_ids=agency_ids, headsign=headsign, bbox=bbox,
+                   dates=dates)
+
+    @classmethod
+    def setup_arguments(cls, parser):
+        parser.add_argument(
+            "--agency",
+            help="List of agency ids whose routes are loaded, comma-separated")
+        parser.add_argument(
+            "--headsign",
+            help="Only load trips whose headsign matches this regular "
+                 "expression")
+        parser.add_argument(
+            "--bbox",
+            help="Only load trips serving a stop in this bounding box, "
+                 "as south,west,north,east. Only stops in it if routes "
+                 "are not loaded")
+        parser.add_argument(
+            "--date",
+            help="Only load trips running on this date, YYYYMMDD, or at "
+                 "least one day of this range, YYYYMMDD-YYYYMMDD")
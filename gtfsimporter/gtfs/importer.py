@@ -1,10 +1,19 @@
 
 import os
 import csv
+import io
+import zipfile
+
+from array import array
+from contextlib import contextmanager
 
 from . import agencies
-from .exceptions import SkipEntryError
-from ..common_elements import Schedule
+from .calendar import ServiceCalendar
+from .elements import GtfsStopTime
+from .filter import GtfsFilter
+from .patterns import parse_time
+from ..common_elements import Schedule, expand_bounding_box
+from ..profiling import profiled
 
 class GTFSImporter():
 
@@ -30,13 +39,11 @@ class GTFSImporter():
         the corresponding agency class capable of handling this dataset. Agency
         classes are listed in the `agencies` variable of gtfs/__init__.py.
         """
-        path = os.path.join(self.path, self._AGENCY_FILE)
-        with open(path, encoding="utf-8-sig") as agencyfile:
-            agencyreader = csv.DictReader(agencyfile)
+        with self.open_table(self._AGENCY_FILE) as (header, agencyreader):
             row = next(agencyreader)
 
-        agency_id = row["agency_id"]
-        agency_name = row["agency_name"]
+        agency_id = row[header.index("agency_id")]
+        agency_name = row[header.index("agency_name")]
         for agency in agencies:
             if agency.id == agency_id and agency.name == agency_name:
                 return agency
@@ -44,30 +51,101 @@ class GTFSImporter():
             raise NotImplementedError(f"Agency '{agency_name}' is not supported yet")
 
 
-    def load_stops(self, schedule=None):
+    def archive_member(self, archive, filename):
+        # files may be in a directory of the archive
+        for name in archive.namelist():
+            if name == filename or name.endswith("/" + filename):
+                return name
+        return None
+
+    def has_table(self, filename):
+        if not os.path.isdir(self.path):
+            with zipfile.ZipFile(self.path) as archive:
+                return self.archive_member(archive, filename) is not None
+        return os.path.exists(os.path.join(self.path, filename))
+
+    @contextmanager
+    def open_table(self, filename):
+        """
+        Open a file of the dataset, a directory or a zip archive, yielding
+        its header and a csv.reader of its rows
+        """
+        if os.path.isdir(self.path):
+            path = os.path.join(self.path, filename)
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                reader = csv.reader(f)
+                yield next(reader, []), reader
+            return
+
+        with zipfile.ZipFile(self.path) as archive:
+            name = self.archive_member(archive, filename)
+            if name is None:
+                raise FileNotFoundError(f"No {filename} in {self.path}")
+            with archive.open(name) as member:
+                f = io.TextIOWrapper(member, encoding="utf-8-sig", newline="")
+                reader = csv.reader(f)
+                yield next(reader, []), reader
+
+    def adapter(self, table, header, factory=None):
+        """
+        Row adapter of the agency mapping of table, see TableMapping.compile
+        """
+        mapping = getattr(self.agency, table)
+        if mapping is None:
+            raise NotImplementedError("Only export-stops currently is supported")
+        if factory is not None:
+            mapping = mapping.with_factory(factory)
+        return mapping.compile(header)
+
+    @profiled("load_stops")
+    def load_stops(self, schedule=None, stop_ids=None, gtfs_filter=None):
+        """
+        Load stops in schedule, only the ones in stop_ids if set, and in the
+        bounding box of gtfs_filter if any
+        """
         if schedule is None:
             schedule = Schedule()
 
-        path = os.path.join(self.path, self._STOPS_FILE)
-        with open(path, encoding="utf-8-sig") as stopsfile:
-            stopsreader = csv.DictReader(stopsfile)
+        bbox = gtfs_filter is not None and gtfs_filter.bbox is not None
+
+        with self.open_table(self._STOPS_FILE) as (header, stopsreader):
+            make_stop = self.adapter("stops", header)
+            id_index = header.index("stop_id")
+            lat_index = header.index("stop_lat")
+            lon_index = header.index("stop_lon")
+
             for row in stopsreader:
-                try:
-                    stop = self.agency.make_stop(row)
-                    schedule.add_stop(stop, deduplicate=True)
-                except SkipEntryError:
+                # filter on raw values, before creating the stop
+                if stop_ids is not None and row[id_index] not in stop_ids:
                     continue
+                if bbox and not gtfs_filter.contains(float(row[lat_index]),
+                                                     float(row[lon_index])):
+                    continue
+
+                stop = make_stop(row)
+                if stop is not None:
+                    schedule.add_stop(stop, deduplicate=True)
 
         return schedule
 
-    def load_routes(self, schedule, routes_of_interest):
-        path = os.path.join(self.path, self._ROUTES_FILE)
-        with open(path, encoding="utf-8-sig") as routesfile:
-            routesreader = csv.DictReader(routesfile)
+    @profiled("load_routes")
+    def load_routes(self, schedule, routes_of_interest, gtfs_filter=None):
+        with self.open_table(self._ROUTES_FILE) as (header, routesreader):
+            make_route = self.adapter("routes", header)
+            # agency_id is optional when a dataset has a single agency
+            agency_index = header.index("agency_id") \
+                if "agency_id" in header else None
+
             for row in routesreader:
-                try:
-                    route = self.agency.make_route(row)
-                except SkipEntryError:
+                if gtfs_filter is not None and not gtfs_filter.accepts_agency(
+                        row[agency_index] if agency_index is not None else ""):
+                    continue
+
+                route = make_route(row)
+                if route is None:
+                    continue
+
+                if gtfs_filter is not None and not gtfs_filter.accepts_route(route):
                     continue
 
                 # We keep only routes if we are specifically interested in them,
@@ -76,63 +154,271 @@ class GTFSImporter():
                     routes_of_interest is None:
                     schedule.add_route(route)
 
+    @profiled("load_trips")
     def load_trips(self, schedule):
-        path = os.path.join(self.path, self._TRIPS_FILE)
-        with open(path, encoding="utf-8-sig") as tripsfile:
-            tripsreader = csv.DictReader(tripsfile)
+        with self.open_table(self._TRIPS_FILE) as (header, tripsreader):
+            make_trip = self.adapter("trips", header)
             for row in tripsreader:
-                try:
-                    trip = self.agency.make_trip(row)
-                except SkipEntryError:
-                    continue
+                trip = make_trip(row)
 
                 # route will exist only if it was deemed of interest by load_routes
-                route = schedule.get_route(trip.route_id, None)
-                if route:
-                    route.add_trip(trip)
-                    schedule.add_trip(trip)
+                if trip is not None:
+                    schedule.add_route_trip(trip)
 
+    @profiled("load_stop_times")
     def load_stop_times(self, schedule):
-        path = os.path.join(self.path, self._STOP_TIMES_FILE)
+        with self.open_table(self._STOP_TIMES_FILE) as (header, timereader):
+            make_stop_time = self.adapter("stop_times", header)
+            for row in timereader:
+                stop_time = make_stop_time(row)
+                if stop_time is not None:
+                    schedule.add_stop_time(stop_time)
+
+
+    @profiled("load_trips")
+    def read_trips(self, route_ids, gtfs_filter, service_ids=None):
+        """
+        Return the trips of routes in route_ids accepted by gtfs_filter, and
+        of services in service_ids if set
+        """
+        trips = []
+
+        with self.open_table(self._TRIPS_FILE) as (header, tripsreader):
+            make_trip = self.adapter("trips", header)
+            route_index = header.index("route_id")
+            service_index = header.index("service_id")
+
+            for row in tripsreader:
+                if row[route_index] not in route_ids:
+                    continue
+                if service_ids is not None and row[service_index] not in service_ids:
+                    continue
+
+                trip = make_trip(row)
+                if trip is not None and gtfs_filter.accepts_trip(trip):
+                    trips.append(trip)
+
+        return trips
+
+    @profiled("load_stop_times")
+    def read_stop_times(self, trip_ids):
+        """
+        Return the stop times of trips in trip_ids, as (trip_id, sequence,
+        stop_id) tuples, much smaller than GtfsStopTime objects
+        """
+        stop_times = []
 
-        with open(path, encoding="utf-8-sig") as timefile:
-            timereader = csv.DictReader(timefile)
+        with self.open_table(self._STOP_TIMES_FILE) as (header, timereader):
+            make_stop_time = self.adapter(
+                "stop_times", header,
+                lambda trip_id, stop_id, sequence: (trip_id, sequence, stop_id))
+            trip_index = header.index("trip_id")
 
             for row in timereader:
-                try:
-                    stop_time = self.agency.make_stop_time(row)
-                except SkipEntryError:
+                if row[trip_index] not in trip_ids:
                     continue
 
-                # get_trip will return an entry only if this trip belongs to a route
-                # we are interested in in the first place
-                trip = schedule.get_trip(stop_time.trip_id, None)
-                if trip is not None:
-                    stop = schedule.get_stop(stop_time.stop_id)
-                    trip.add_stop(stop_time.sequence, stop)
+                stop_time = make_stop_time(row)
+                if stop_time is not None:
+                    stop_times.append(stop_time)
+
+        return stop_times
+
+    @profiled("load_trip_times")
+    def read_trip_times(self, trip_ids):
+        """
+        Return the ids of trips in trip_ids found in stop times, and numpy
+        arrays of the departure from their first stop and arrival at their
+        last stop, in seconds, -1 if not set, see parse_time
+        """
+        # numpy is slow to import, only load it when needed
+        import numpy as np
 
+        # a few thousand different times are repeated over all stop times,
+        # each is only parsed once
+        times = {}
+        trips = {}
+        indexes = array("q")
+        sequences = array("q")
+        arrivals = array("q")
+        departures = array("q")
 
+        with self.open_table(self._STOP_TIMES_FILE) as (header, timereader):
+            trip_index = header.index("trip_id")
+            sequence_index = header.index("stop_sequence")
+            arrival_index = header.index("arrival_time")
+            departure_index = header.index("departure_time")
+
+            for row in timereader:
+                trip_id = row[trip_index]
+                if trip_id not in trip_ids:
+                    continue
+
+                index = trips.get(trip_id)
+                if index is None:
+                    index = trips[trip_id] = len(trips)
+                indexes.append(index)
+                sequences.append(int(row[sequence_index]))
+
+                for value, values in ((row[arrival_index], arrivals),
+                                      (row[departure_index], departures)):
+                    seconds = times.get(value)
+                    if seconds is None:
+                        seconds = times[value] = parse_time(value)
+                    values.append(seconds)
+
+        if not trips:
+            return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        indexes = np.frombuffer(indexes, dtype=np.int64)
+        order = np.lexsort((np.frombuffer(sequences, dtype=np.int64), indexes))
+        indexes = indexes[order]
+        arrivals = np.frombuffer(arrivals, dtype=np.int64)[order]
+        departures = np.frombuffer(departures, dtype=np.int64)[order]
+
+        # stop times of a trip are now consecutive, by sequence
+        starts = np.flatnonzero(np.r_[True, indexes[1:] != indexes[:-1]])
+        ends = np.r_[starts[1:], len(indexes)] - 1
+
+        # a stop time may have only one of its times
+        first = departures[starts]
+        first = np.where(first < 0, arrivals[starts], first)
+        last = arrivals[ends]
+        last = np.where(last < 0, departures[ends], last)
+
+        ids = list(trips)
+        return [ids[i] for i in indexes[starts]], first, last
+
+    @profiled("load_stops")
+    def scan_bounding_box(self, margin=None):
+        """
+        Return the bounding box of the stops of the dataset, the one of
+        Schedule.get_bounding_box once they are loaded, reading only their
+        coordinates
+        """
+        columns = self.agency.stops.columns
+        lat_index = columns.index("stop_lat")
+        lon_index = columns.index("stop_lon")
+
+        with self.open_table(self._STOPS_FILE) as (header, stopsreader):
+            # stops skipped by the agency are not in the schedule either
+            coordinates = self.adapter(
+                "stops", header,
+                lambda *values: (float(values[lat_index]),
+                                 float(values[lon_index])))
+            lats, lons = zip(*filter(None, map(coordinates, stopsreader)))
+
+        return expand_bounding_box((min(lats), min(lons), max(lats), max(lons)),
+                                   margin)
+
+    def scan_stops(self, gtfs_filter):
+        """
+        Return the ids of the stops in the bounding box of gtfs_filter,
+        without creating them
+        """
+        with self.open_table(self._STOPS_FILE) as (header, stopsreader):
+            id_index = header.index("stop_id")
+            lat_index = header.index("stop_lat")
+            lon_index = header.index("stop_lon")
+            return set(row[id_index] for row in stopsreader
+                       if gtfs_filter.contains(float(row[lat_index]),
+                                               float(row[lon_index])))
+
+    def select(self, gtfs_filter):
+        """
+        Return the routes, trips and stop times selected by gtfs_filter
+        """
+        routes = Schedule()
+        self.load_routes(routes, None, gtfs_filter)
+        route_ids = set(route.id for route in routes.routes)
+
+        # services are resolved before trips are read, inactive trips are
+        # then dropped with their stop times without being created
+        service_ids = None
+        if gtfs_filter.dates is not None:
+            calendar = ServiceCalendar.from_feed(self)
+            service_ids = calendar.active_services(*gtfs_filter.dates)
+
+        trips = self.read_trips(route_ids, gtfs_filter, service_ids)
+        stop_times = self.read_stop_times(set(trip.id for trip in trips))
+
+        if gtfs_filter.bbox is not None:
+            in_bbox = self.scan_stops(gtfs_filter)
+            served = set(trip_id for trip_id, _, stop_id in stop_times
+                         if stop_id in in_bbox)
+            trips = [trip for trip in trips if trip.id in served]
+            stop_times = [st for st in stop_times if st[0] in served]
+
+        routes = list(routes.routes)
+        if gtfs_filter.selects_trips:
+            # routes of which no trip was selected
+            served = set(trip.route_id for trip in trips)
+            routes = [route for route in routes if route.id in served]
+
+        return routes, trips, stop_times
+
+    def load_filtered(self, schedule, gtfs_filter):
+        """
+        Load the part of the dataset selected by gtfs_filter in schedule:
+        trips and stop times are selected first, so that only the stops
+        they reference are created
+        """
+        routes, trips, stop_times = self.select(gtfs_filter)
+
+        for route in routes:
+            schedule.add_route(route)
+        for trip in trips:
+            schedule.add_route_trip(trip)
+
+        self.load_stops(schedule, set(stop_id for _, _, stop_id in stop_times))
+        for trip_id, sequence, stop_id in stop_times:
+            schedule.add_stop_time(GtfsStopTime(trip_id, stop_id, sequence))
+
+    def load_filtered_stops(self, gtfs_filter, schedule=None):
+        """
+        Load the stops of the trips selected by gtfs_filter, or the ones in
+        its bounding box if it doesn't select routes
+        """
+        if not gtfs_filter.selects_routes:
+            return self.load_stops(schedule, gtfs_filter=gtfs_filter)
+
+        _, _, stop_times = self.select(gtfs_filter)
+        return self.load_stops(schedule, set(stop_id for _, _, stop_id in stop_times))
+
+    @profiled("load_shapes")
     def load_shapes(self, schedule):
-        path = os.path.join(self.path, self._SHAPES_FILE)
+        with self.open_table(self._SHAPES_FILE) as (header, shapereader):
+            shape_index = header.index("shape_id")
+            lat_index = header.index("shape_pt_lat")
+            lon_index = header.index("shape_pt_lon")
+            seq_index = header.index("shape_pt_sequence")
 
-        with open(path, encoding="utf-8-sig") as shapefile:
-            shapereader = csv.DictReader(shapefile)
             for row in shapereader:
-                shape_id = row["shape_id"]
-                lat = row["shape_pt_lat"]
-                lon = row["shape_pt_lon"]
-                seq = int(row["shape_pt_sequence"])
-
-                schedule.add_shape_point(shape_id, lat, lon, seq)
+                schedule.add_shape_point(row[shape_index],
+                                         float(row[lat_index]),
+                                         float(row[lon_index]),
+                                         int(row[seq_index]))
 
 
     def load(self, route_ids_of_interest=None, unique_trips=False,
-             shapes=False):
-        schedule = Schedule()
-        self.load_stops(schedule)
-        self.load_routes(schedule, route_ids_of_interest)
-        self.load_trips(schedule)
-        self.load_stop_times(schedule)
+             shapes=False, schedule=None, gtfs_filter=None):
+        """
+        Load the dataset in schedule, a new Schedule if not set. Only the
+        part selected by gtfs_filter is read if set.
+        """
+        if schedule is None:
+            schedule = Schedule()
+
+        if gtfs_filter is None and route_ids_of_interest is not None:
+            gtfs_filter = GtfsFilter(route_ids=route_ids_of_interest)
+
+        if gtfs_filter is not None:
+            self.load_filtered(schedule, gtfs_filter)
+        else:
+            self.load_stops(schedule)
+            self.load_routes(schedule, route_ids_of_interest)
+            self.load_trips(schedule)
+            self.load_stop_times(schedule)
 
         if unique_trips:
             schedule.remove_duplicated_trips()
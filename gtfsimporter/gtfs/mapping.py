@@ -0,0 +1,112 @@
+from operator import itemgetter
+
+from .elements import GtfsStopTime
+
+
+# columns that GTFS datasets may leave out, read as empty strings
+OPTIONAL_COLUMNS = set([
+    "agency_id", "parent_station", "route_url", "shape_id", "stop_code",
+    "trip_headsign",
+])
+
+
+class Constant(object):
+    """
+    Argument of a TableMapping factory with the same value for all rows
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class TableMapping(object):
+    """
+    How the rows of a GTFS file become elements, declared by agencies:
+    factory is called with the values of columns, column names or
+    Constant. Rows for which a predicate of skip, a dict of column names to
+    functions of the raw value, returns True are skipped. Values of columns
+    in transforms, a dict of column names to functions, are replaced by
+    their result before the factory is called.
+
+    The mapping is compiled once per file header into a row adapter working
+    on the lists returned by csv.reader, see compile.
+    """
+
+    def __init__(self, factory, columns, skip=None, transforms=None):
+        self.factory = factory
+        self.columns = list(columns)
+        self.skip = dict(skip or {})
+        self.transforms = dict(transforms or {})
+
+    def with_factory(self, factory):
+        """
+        Same mapping, creating elements with factory
+        """
+        return TableMapping(factory, self.columns, self.skip, self.transforms)
+
+    def compile(self, header):
+        """
+        Return a function of a csv.reader row returning its element, or None
+        if the row is skipped. Missing optional columns are read as empty
+        strings, other missing columns raise a ValueError.
+        """
+        positions = {name: i for i, name in enumerate(header)}
+        # values appended to each row: constants, and an empty string
+        # standing for missing columns
+        tail = []
+
+        def position(column):
+            if isinstance(column, Constant):
+                tail.append(column.value)
+                return len(header) + len(tail) - 1
+            if column in positions:
+                return positions[column]
+            if column not in OPTIONAL_COLUMNS:
+                raise ValueError(f"Column '{column}' is missing")
+            positions[column] = len(header) + len(tail)
+            tail.append("")
+            return positions[column]
+
+        indexes = [position(c) for c in self.columns]
+        skips = [(position(c), predicate) for c, predicate in self.skip.items()]
+        transforms = [(self.columns.index(c), f)
+                      for c, f in self.transforms.items()]
+
+        # itemgetter of a single index doesn't return a tuple
+        values = itemgetter(*indexes) if len(indexes) > 1 else \
+            lambda row: (row[indexes[0]],)
+        factory = self.factory
+
+        def adapt(row):
+            if tail:
+                row.extend(tail)
+            for i, predicate in skips:
+                if predicate(row[i]):
+                    return None
+
+            args = values(row)
+            if transforms:
+                args = list(args)
+                for i, f in transforms:
+                    args[i] = f(args[i])
+            return factory(*args)
+
+        return adapt
+
+    def make(self, row):
+        """
+        Element of row, a dict of column names to values, or None
+        """
+        return self.compile(list(row.keys()))(list(row.values()))
+
+
+# arguments of GtfsStop, GtfsRoute without network and operator, GtfsTrip
+STOP_COLUMNS = ["stop_id", "stop_lat", "stop_lon", "stop_name", "stop_code"]
+ROUTE_COLUMNS = ["route_id", "route_short_name", "route_long_name"]
+TRIP_COLUMNS = ["trip_id", "route_id", "trip_headsign", Constant(None),
+                Constant(None), "shape_id"]
+
+# stop times are the same for all agencies
+STOP_TIME_MAPPING = TableMapping(
+    GtfsStopTime, ["trip_id", "stop_id", "stop_sequence"],
+    transforms={"stop_sequence": int})
@@ -0,0 +1,203 @@
+def parse_time(value):
+    """
+    Seconds since the start of the service day of a GTFS time, HH:MM:SS,
+    hours going past 24 for trips ending after midnight. Empty times, left
+    out between timepoints, are -1.
+    """
+    if not value:
+        return -1
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def format_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}"
+
+
+class StopPattern(object):
+    """
+    Trips of a route having the same headsign and stops, i.e. the trips
+    GtfsRoute.remove_duplicated_trips merges. occurrences counts the trips
+    of the dataset, duplicates removed from the schedule included.
+
+    Times are only known once read from the dataset, see
+    PatternStatistics.add_times: departure of the first trip from its first
+    stop, arrival of the last trip at its last stop, and median duration of
+    trips, in seconds.
+    """
+
+    def __init__(self, route_id, ref, stops):
+        self.route_id = route_id
+        self.ref = ref
+        self.stops = stops
+        self.trips = []
+        self.occurrences = 0
+
+        self.first_departure = None
+        self.last_arrival = None
+        self.duration = None
+
+    @property
+    def trip(self):
+        """
+        Trip of the schedule standing for this pattern
+        """
+        return self.trips[0]
+
+    @property
+    def span(self):
+        if self.first_departure is None:
+            return None
+        return self.last_arrival - self.first_departure
+
+    def __len__(self):
+        return len(self.stops)
+
+    def __repr__(self):
+        return "<StopPattern route={}, ref={}, {} stops, {} occurrences>".format(
+            self.route_id, self.ref, len(self.stops), self.occurrences)
+
+
+class PatternStatistics(object):
+    """
+    Stop patterns of the trips of routes, grouped in a single pass over
+    trips, from which representative trips are selected, see select.
+    """
+
+    # policies selecting the patterns kept for each headsign
+    POLICIES = ["longest", "most-frequent", "covering"]
+
+    def __init__(self):
+        # route id -> patterns, in order of first appearance
+        self.routes = {}
+        # trip id -> pattern
+        self.trip_patterns = {}
+
+    @classmethod
+    def from_routes(cls, routes):
+        statistics = cls()
+        for route in routes:
+            statistics.add_route(route)
+        return statistics
+
+    def add_route(self, route):
+        patterns = {}
+        for trip in route.trips:
+            key = (trip.ref, tuple(stop.id for stop in trip.stops))
+            pattern = patterns.get(key)
+            if pattern is None:
+                pattern = patterns[key] = StopPattern(route.id, trip.ref,
+                                                      trip.stops)
+            pattern.trips.append(trip)
+            # trips pickled before occurrences were counted
+            pattern.occurrences += getattr(trip, "occurrences", 1)
+            self.trip_patterns[trip.id] = pattern
+
+        self.routes[route.id] = list(patterns.values())
+
+    def get_patterns(self, route_id):
+        return self.routes.get(route_id, [])
+
+    def add_times(self, trip_ids, departures, arrivals):
+        """
+        Set the times of patterns from the ones of their trips: trip_ids,
+        and numpy arrays of the departure from the first stop and arrival at
+        the last stop of each trip, see GTFSImporter.read_trip_times. Trips
+        merged as duplicates are only counted if they are in trip_ids.
+        """
+        # numpy is slow to import, only load it when needed
+        import numpy as np
+
+        patterns = []
+        indexes = {}
+        trip_patterns = []
+        for trip_id in trip_ids:
+            pattern = self.trip_patterns.get(trip_id)
+            if pattern is None:
+                trip_patterns.append(-1)
+                continue
+            if id(pattern) not in indexes:
+                indexes[id(pattern)] = len(patterns)
+                patterns.append(pattern)
+            trip_patterns.append(indexes[id(pattern)])
+
+        trip_patterns = np.array(trip_patterns, dtype=np.int64)
+        valid = (trip_patterns >= 0) & (departures >= 0) & (arrivals >= 0)
+        trip_patterns = trip_patterns[valid]
+        departures = departures[valid]
+        arrivals = arrivals[valid]
+        if not len(trip_patterns):
+            return
+
+        first_departures = np.full(len(patterns), np.iinfo(np.int64).max)
+        last_arrivals = np.full(len(patterns), -1)
+        np.minimum.at(first_departures, trip_patterns, departures)
+        np.maximum.at(last_arrivals, trip_patterns, arrivals)
+
+        # median duration: middle of the durations of each pattern, sorted
+        durations = arrivals - departures
+        order = np.lexsort((durations, trip_patterns))
+        counts = np.bincount(trip_patterns, minlength=len(patterns))
+        starts = np.cumsum(counts) - counts
+        medians = durations[order][starts + counts // 2]
+
+        for i in np.flatnonzero(counts):
+            pattern = patterns[i]
+            pattern.first_departure = int(first_departures[i])
+            pattern.last_arrival = int(last_arrivals[i])
+            pattern.duration = int(medians[i])
+
+    def read_times(self, importer):
+        """
+        Read the times of trips from the dataset of importer
+        """
+        self.add_times(*importer.read_trip_times(set(self.trip_patterns)))
+
+    def select(self, route_id, policy="longest"):
+        """
+        Return the patterns of route_id kept by policy, for each headsign:
+
+        - longest: the pattern with the most stops, the first one if
+          several have as many
+        - most-frequent: the pattern with the most occurrences, then the
+          most stops, i.e. the one actually run all day rather than a rare
+          longer variant
+        - covering: the fewest patterns serving all the stops served by
+          trips with this headsign, picked greedily, the most frequent one
+          first when they serve as many new stops
+
+        Patterns are returned by headsign, in order of first appearance.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown trip policy '{policy}', expected one "
+                             f"of {', '.join(self.POLICIES)}")
+
+        headsigns = {}
+        for pattern in self.get_patterns(route_id):
+            headsigns.setdefault(pattern.ref, []).append(pattern)
+
+        selected = []
+        for patterns in headsigns.values():
+            if policy == "longest":
+                selected.append(max(patterns, key=len))
+            elif policy == "most-frequent":
+                selected.append(max(patterns,
+                                    key=lambda p: (p.occurrences, len(p))))
+            else:
+                selected.extend(self.cover(patterns))
+
+        return selected
+
+    @classmethod
+    def cover(cls, patterns):
+        missing = set(stop.id for p in patterns for stop in p.stops)
+        # trips without stops still stand for their headsign
+        kept = [] if missing else patterns[:1]
+        while missing:
+            best = max(patterns, key=lambda p: (
+                len(missing.intersection(stop.id for stop in p.stops)),
+                p.occurrences))
+            missing.difference_update(stop.id for stop in best.stops)
+            kept.append(best)
+
+        return [p for p in patterns if p in kept]
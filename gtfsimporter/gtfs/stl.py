@@ -1,42 +1,34 @@
 
+from ..gtfs.elements import GtfsStop
 
-from ..gtfs.elements import GtfsRoute, GtfsStop, GtfsStopTime, GtfsTrip
+from .mapping import TableMapping, STOP_COLUMNS
 
-from .exceptions import SkipEntryError
 
-class StlAgency(object):
-
-    id = "STL"
-    name = "Societe de transport de Laval"
-
-    def make_stop(self, row):
-        return StlStop(row)
+def clean_stl_name(name):
+    # names are suffixed by the stop reference in bracket, eliminate that
+    idx = name.rfind(" [")
+    if idx != -1:
+        name = name[:idx]
 
-    def make_route(self, row):
-        raise NotImplementedError("Only export-stops currently is supported")
+    # some entries have multiple consecutive whitespaces
+    return name.replace("  ", " ")
 
-    def make_trip(self, row):
-        raise NotImplementedError("Only export-stops currently is supported")
 
-    def make_stop_time(self, row):
-        raise NotImplementedError("Only export-stops currently is supported")
+# caches pickled when stl stops had their own class
+StlStop = GtfsStop
 
-class StlStop(GtfsStop):
 
-    def __init__(self, row):
-        stop_id = row["stop_id"]
-        name = row["stop_name"]
-        ref = row["stop_code"]
-        lat = row["stop_lat"]
-        lon = row["stop_lon"]
-
-        # names are suffixed by the stop reference in bracket, eliminate that
-        idx = name.rfind(" [")
-        if idx != -1:
-            name = name[:idx]
+class StlAgency(object):
 
-        # some entries have multiple consecutive whitespaces
-        name = name.replace("  ", " ")
+    id = "STL"
+    name = "Societe de transport de Laval"
+    provider = "stl"
+    archive_url = "http://www.stl.laval.qc.ca/opendata/GTF_STL.zip"
 
-        super().__init__(stop_id, lat, lon, name, ref)
+    stops = TableMapping(GtfsStop, STOP_COLUMNS,
+                         transforms={"stop_name": clean_stl_name})
 
+    # only export-stops currently is supported
+    routes = None
+    trips = None
+    stop_times = None
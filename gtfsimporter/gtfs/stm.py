@@ -1,40 +1,8 @@
 
 
-from .elements import GtfsRoute, GtfsStop, GtfsStopTime, GtfsTrip
-from .exceptions import SkipEntryError
-
-
-class StmAgency(object):
-
-    id = "STM"
-    name = "Société de transport de Montréal"
-
-    def make_stop(self, row):
-        return make_stm_stop(row)
-
-    def make_route(self, row):
-        return make_stm_route(row)
-
-    def make_trip(self, row):
-        return make_stm_trip(row)
-
-    def make_stop_time(self, row):
-        return StmStopTime(row)
-
-def make_stm_stop(row):
-    if row["stop_id"].startswith("STATION_M"):
-        raise SkipEntryError("This stop is for a metro station")
-    if "STATION_M" in row["parent_station"]:
-        raise SkipEntryError("This stop is for a metro line")
-
-    stop_id = row["stop_id"]
-    name = row["stop_name"]
-    ref = row["stop_code"]
-    lat = row["stop_lat"]
-    lon = row["stop_lon"]
-
-        
-    return GtfsStop(stop_id, lat, lon, name, ref)
+from .elements import GtfsRoute, GtfsStop, GtfsTrip
+from .mapping import TableMapping, ROUTE_COLUMNS, STOP_COLUMNS, \
+        STOP_TIME_MAPPING, TRIP_COLUMNS
 
 
 class StmGtfsRoute(GtfsRoute):
@@ -52,20 +20,6 @@ class StmGtfsRoute(GtfsRoute):
             return "Bus {}: {}".format(self.code, self._name)
 
 
-def make_stm_route(row):
-    if "metro" in row["route_url"]:
-        raise SkipEntryError("This stop is for a metro line")
-
-    route_id = row["route_id"]
-    route_code = row["route_short_name"]
-    route_name = row["route_long_name"]
-    agency = row["agency_id"]
-
-    return StmGtfsRoute(route_id, route_code, route_name, agency, agency)
-
-
-
-
 class StmGtfsTrip(GtfsTrip):
 
     extra_locales = ['en']
@@ -99,23 +53,26 @@ class StmGtfsTrip(GtfsTrip):
                 self.route.get_name(lang),
                 self.get_direction(lang))
 
-def make_stm_trip(row):
-    trip_id = row["trip_id"]
-    route_id = row["route_id"]
-    headsign = row["trip_headsign"]
-
-    shape_id = row["shape_id"]
 
-    return StmGtfsTrip(trip_id, route_id, headsign, shape_id=shape_id)
+class StmAgency(object):
 
+    id = "STM"
+    name = "Société de transport de Montréal"
+    provider = "stm"
+    archive_url = "http://stm.info/sites/default/files/gtfs/gtfs_stm.zip"
 
+    # metro stations, and the stops of metro lines, are not bus stops
+    stops = TableMapping(
+        GtfsStop, STOP_COLUMNS,
+        skip={"stop_id": lambda stop_id: stop_id.startswith("STATION_M"),
+              "parent_station": lambda parent: "STATION_M" in parent})
 
-class StmStopTime(GtfsStopTime):
+    # network and operator are both the agency
+    routes = TableMapping(
+        StmGtfsRoute,
+        ROUTE_COLUMNS + ["agency_id", "agency_id"],
+        skip={"route_url": lambda url: "metro" in url})
 
-    def __init__(self, row):
-        trip_id = row["trip_id"]
-        stop_id = row["stop_id"]
-        stop_sequence = int(row["stop_sequence"])
-        
-        super().__init__(trip_id, stop_id, stop_sequence)
+    trips = TableMapping(StmGtfsTrip, TRIP_COLUMNS)
 
+    stop_times = STOP_TIME_MAPPING
@@ -0,0 +1,276 @@
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import zipfile
+import zlib
+
+from contextlib import contextmanager
+from datetime import datetime
+
+from .importer import GTFSImporter
+
+
+class FeedStore(object):
+    """
+    Versions of GTFS feeds stored as content-addressed chunks, so that rows
+    which don't change between versions are stored once.
+
+    Each file of a feed is cut into chunks of consecutive rows, stored
+    compressed in objects/, named after the SHA-256 of their content. Rows
+    sharing a key, e.g. the stop times of a trip, are in the same chunk, and
+    chunks end after a key whose hash is a multiple of BOUNDARY_KEYS: as
+    boundaries depend on the content and not on positions, rows added or
+    removed only change the chunks around them. A version is a JSON
+    manifest in versions/ listing the chunks of each file.
+    """
+
+    MIN_CHUNK_ROWS = 512
+    BOUNDARY_KEYS = 16
+
+    # rows are grouped by this column, the first one for other files
+    KEY_COLUMNS = {
+        "stops.txt": "stop_id",
+        "routes.txt": "route_id",
+        "trips.txt": "trip_id",
+        "stop_times.txt": "trip_id",
+        "shapes.txt": "shape_id",
+        "calendar.txt": "service_id",
+        "calendar_dates.txt": "service_id",
+    }
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.versions_dir = os.path.join(root, "versions")
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def manifest_path(self, name):
+        return os.path.join(self.versions_dir, name + ".json")
+
+    @classmethod
+    def write_file(cls, path, data):
+        # written under another name first, so that a file is either
+        # complete or missing
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def write_chunk(self, rows):
+        """
+        Store rows if they are not already, return their digest and the
+        number of bytes written
+        """
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="\n").writerows(rows)
+        data = buf.getvalue().encode()
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+
+        data = zlib.compress(data)
+        self.write_file(path, data)
+        return digest, len(data)
+
+    def read_chunk(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read()).decode()
+
+    def add_table(self, importer, filename):
+        """
+        Store the chunks of filename, return its manifest entry and the
+        number of bytes written
+        """
+        chunks = []
+        written = 0
+        count = 0
+
+        with importer.open_table(filename) as (header, reader):
+            key_column = self.KEY_COLUMNS.get(filename)
+            key_index = header.index(key_column) if key_column in header else 0
+
+            rows = []
+            previous = None
+            for row in reader:
+                if not row:
+                    continue
+
+                key = row[key_index]
+                if key != previous and len(rows) >= self.MIN_CHUNK_ROWS and \
+                        zlib.crc32(previous.encode()) % self.BOUNDARY_KEYS == 0:
+                    digest, size = self.write_chunk(rows)
+                    chunks.append(digest)
+                    written += size
+                    rows = []
+
+                rows.append(row)
+                previous = key
+                count += 1
+
+            if rows:
+                digest, size = self.write_chunk(rows)
+                chunks.append(digest)
+                written += size
+
+        return {"header": header, "chunks": chunks, "rows": count}, written
+
+    @classmethod
+    def feed_tables(cls, path):
+        """
+        Names of the GTFS files of the feed at path, a directory or a zip
+        archive
+        """
+        if os.path.isdir(path):
+            names = os.listdir(path)
+        else:
+            with zipfile.ZipFile(path) as archive:
+                names = [os.path.basename(n) for n in archive.namelist()]
+        return sorted(n for n in names if n.endswith(".txt"))
+
+    def add(self, path, name=None):
+        """
+        Store the feed at path, a directory or a zip archive, as version
+        name, the current date by default. Return its manifest.
+        """
+        if name is None:
+            name = datetime.now().strftime("%Y%m%d")
+        if os.path.exists(self.manifest_path(name)):
+            raise ValueError(f"Version '{name}' already exists")
+
+        importer = GTFSImporter(path)
+        manifest = {
+            "name": name,
+            "added": datetime.now().isoformat(timespec="seconds"),
+            "source": os.path.abspath(path),
+            "tables": {},
+            "written": 0,
+        }
+        for filename in self.feed_tables(path):
+            table, written = self.add_table(importer, filename)
+            manifest["tables"][filename] = table
+            manifest["written"] += written
+
+        self.write_file(self.manifest_path(name),
+                        json.dumps(manifest, indent=1).encode())
+        return manifest
+
+    def versions(self):
+        """
+        Manifests of stored versions, from the oldest to the latest
+        """
+        if not os.path.isdir(self.versions_dir):
+            return []
+
+        manifests = []
+        for filename in os.listdir(self.versions_dir):
+            if filename.endswith(".json"):
+                with open(os.path.join(self.versions_dir, filename),
+                          encoding="utf-8") as f:
+                    manifests.append(json.load(f))
+        return sorted(manifests, key=lambda m: (m["added"], m["name"]))
+
+    def version(self, name=None):
+        """
+        Manifest of version name, the latest one if not set
+        """
+        if name is None:
+            versions = self.versions()
+            if not versions:
+                raise ValueError(f"No version in {self.root}")
+            return versions[-1]
+
+        if not os.path.exists(self.manifest_path(name)):
+            raise ValueError(f"No version '{name}' in {self.root}")
+        with open(self.manifest_path(name), encoding="utf-8") as f:
+            return json.load(f)
+
+    def importer(self, name=None):
+        """
+        GTFSImporter reading version name, the latest one if not set
+        """
+        return StoredFeedImporter(self, self.version(name))
+
+    def checkout(self, name, output_dir):
+        """
+        Write the files of version name in output_dir
+        """
+        manifest = self.version(name)
+        os.makedirs(output_dir, exist_ok=True)
+
+        for filename, table in manifest["tables"].items():
+            path = os.path.join(output_dir, filename)
+            with open(path, 'w', encoding="utf-8", newline="") as f:
+                csv.writer(f, lineterminator="\n").writerow(table["header"])
+                for digest in table["chunks"]:
+                    f.write(self.read_chunk(digest))
+
+    def remove(self, name):
+        """
+        Remove version name and the chunks no other version uses. Return
+        the number of bytes freed.
+        """
+        self.version(name)
+        os.remove(self.manifest_path(name))
+
+        used = set()
+        for manifest in self.versions():
+            for table in manifest["tables"].values():
+                used.update(table["chunks"])
+
+        freed = 0
+        for digest, path in self.objects():
+            if digest not in used:
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+    def objects(self):
+        """
+        Yield the digest and the path of stored chunks
+        """
+        if not os.path.isdir(self.objects_dir):
+            return
+
+        for prefix in os.listdir(self.objects_dir):
+            directory = os.path.join(self.objects_dir, prefix)
+            for rest in os.listdir(directory):
+                if not rest.endswith(".tmp"):
+                    yield prefix + rest, os.path.join(directory, rest)
+
+    def size(self):
+        return sum(os.path.getsize(path) for _, path in self.objects())
+
+
+class StoredFeedImporter(GTFSImporter):
+    """
+    GTFSImporter reading a version of a FeedStore, one chunk at a time
+    """
+
+    def __init__(self, store, manifest):
+        self.store = store
+        self.manifest = manifest
+        super().__init__(f"{store.root}@{manifest['name']}")
+
+    def has_table(self, filename):
+        return filename in self.manifest["tables"]
+
+    @contextmanager
+    def open_table(self, filename):
+        table = self.manifest["tables"].get(filename)
+        if table is None:
+            raise FileNotFoundError(f"No {filename} in {self.path}")
+
+        # only split on the line terminator of chunks, csv handles newlines
+        # in quoted values
+        lines = itertools.chain.from_iterable(
+            io.StringIO(self.store.read_chunk(digest), newline="\n")
+            for digest in table["chunks"])
+        yield list(table["header"]), csv.reader(lines)
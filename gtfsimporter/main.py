@@ -1,26 +1,111 @@
-
 import sys
 import argparse
+import importlib
 
-from .cli.cache import CacheParser
-from .cli.route import RouteParser
-from .cli.stop import StopParser
+from .profiling import Profiler
+
+# subcommands: name, module and class of their parser, and help. Modules
+# are only imported when their subcommand is run, see build_parser
+COMMANDS = [
+    ("cache", ".cli.cache", "CacheParser",
+     "Cache-related submenu"),
+    ("gtfs", ".cli.gtfs", "GtfsParser",
+     "GTFS dataset-related submenu"),
+    ("stops", ".cli.stop", "StopParser",
+     "stop-related submenu"),
+    ("routes", ".cli.route", "RouteParser",
+     "route-related submenu"),
+    ("pipeline", ".cli.pipeline", "PipelineParser",
+     "Pipeline-related submenu"),
+    ("benchmark", ".cli.benchmark", "BenchmarkParser",
+     "Benchmark-related submenu"),
+    ("server", ".cli.server", "ServerParser",
+     "Keep schedules loaded and serve commands sent with --server"),
+]
+
+def setup_global_arguments(parser):
+    parser.add_argument(
+        "--server",
+        metavar="SOCKET",
+        help="Run the command in the server listening on SOCKET, "
+             "started with the 'server' command")
+    parser.add_argument(
+        "--profile",
+        metavar="JSON_FILE",
+        help="Record time, memory and object counts of each stage of the "
+             "command, print a summary and store it as JSON in JSON_FILE")
+    parser.add_argument(
+        "--profile-cprofile",
+        action="store_true",
+        help="With --profile, also store cProfile statistics of each stage")
+    parser.add_argument(
+        "--profile-tracemalloc",
+        action="store_true",
+        help="With --profile, also store tracemalloc snapshots of each "
+             "stage. Slows the command down significantly")
+
+def selected_command(argv):
+    """
+    Name of the subcommand of argv, its arguments are not parsed
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    setup_global_arguments(parser)
+    parser.add_argument("command", nargs="?")
+
+    args, _ = parser.parse_known_args(argv)
+    return args.command
+
+def build_parser(argv=None):
+    """
+    Build the parser of argv, the command line by default. Only the module
+    of the subcommand of argv is imported, the others are only listed.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    command = selected_command(argv)
 
-def parse_command_line():
     parser = argparse.ArgumentParser()
+    setup_global_arguments(parser)
     subparsers = parser.add_subparsers(dest="command")
 
-    CacheParser.setup_arguments(parser, subparsers)
-    StopParser.setup_arguments(parser, subparsers)
-    RouteParser.setup_arguments(parser, subparsers)
+    for name, module, class_name, help in COMMANDS:
+        if name == command:
+            module = importlib.import_module(module, __package__)
+            getattr(module, class_name).setup_arguments(parser, subparsers,
+                                                        help)
+        else:
+            subparsers.add_parser(name, help=help)
+
+    return parser
+
+def parse_command_line():
+    parser = build_parser()
 
     args = parser.parse_args()
+    if args.server and args.command not in (None, "server"):
+        # forward the command line, without the --server option
+        argv = [a for a in sys.argv[1:] if not a.startswith("--server=")]
+        if "--server" in argv:
+            index = argv.index("--server")
+            del argv[index:index + 2]
+        from .cli.server import ServerParser
+        return ServerParser.run_remote(args.server, argv)
+
+    dispatch(parser, args, sys.argv[1:])
+    return 0
+
+def dispatch(parser, args, argv):
+    if args.profile:
+        Profiler.enable(args.profile_cprofile, args.profile_tracemalloc)
+
     if hasattr(args, "func"):
         args.func(args)
     else:
         parser.print_help()
 
-if __name__ == "__main__":
-    parse_command_line()
-    sys.exit(0)
+    if args.profile:
+        Profiler.print_summary()
+        Profiler.write(args.profile, argv)
 
+if __name__ == "__main__":
+    sys.exit(parse_command_line())
@@ -4,6 +4,8 @@ from math import cos, pi
 
 from functools import partialmethod, partial
 
+from ..conflation.sequence import StopSequenceDiff
+
 class OsmError(Exception):
     pass
 
@@ -19,16 +21,45 @@ class RefMissingInOsmError(OsmError):
         return f"Stop with ref='{self.ref}' missing in OSM"
 
 
-def IdFactory():
-    i = 0
-    while True:
-        i -= 1
-        yield i
+class IdAllocator(object):
+    """
+    Allocate negative ids to elements that don't exist in OSM yet.
+
+    Ids are handed out from a block, a disjoint range of ids identified by its
+    index. Two allocators working on different blocks never collide, and an
+    allocator always hands out the same ids for the same block, no matter
+    which process it runs in. Exports use one block per route so that
+    parallel and serial runs produce identical files.
+
+    Blocks from 1 on hold BLOCK_SIZE ids each, so a route can't create more
+    elements than that. Block 0, used by default, e.g. by stop exports, is
+    not limited: its ids run into the ones of the following blocks, so it
+    must not be used in the same document as them.
+    """
+
+    BLOCK_SIZE = 100000
+
+    def __init__(self, block=0):
+        self.block = block
+        self._first = -(block * self.BLOCK_SIZE) - 1
+        self._next = self._first
+
+    def next_id(self):
+        if self.block and self._first - self._next >= self.BLOCK_SIZE:
+            raise OsmError(f"No more ids available in block {self.block}")
+
+        osm_id = self._next
+        self._next -= 1
+        return osm_id
 
-id_factory = IdFactory()
+id_allocator = IdAllocator()
 
-def GetIdFactory():
-    return id_factory
+def GetIdAllocator():
+    return id_allocator
+
+def SetIdAllocator(allocator):
+    global id_allocator
+    id_allocator = allocator
 
 
 class SupportTagMetaclass(type):
@@ -57,7 +88,7 @@ class OsmElement(object, metaclass=SupportTagMetaclass):
 
     def __init__(self, osm_id, tags, attributes):
         if osm_id is None:
-            osm_id = next(GetIdFactory())
+            osm_id = GetIdAllocator().next_id()
         self.id = osm_id
         if tags is None:
             tags = {}
@@ -108,9 +139,13 @@ class OsmStop(OsmNode):
 
         return stop
 
-    def merge_gtfs(self, gtfs_stop):
+    def merge_gtfs(self, gtfs_stop, osm_schedule=None):
+        old_refs = self.refs
         self.name = gtfs_stop.name
         self.ref = ";".join(gtfs_stop.refs)
+        # the stop is found by its new refs in the schedule it belongs to
+        if osm_schedule is not None:
+            osm_schedule.reindex_stop(self, old_refs)
 
         self.set_tag("highway", "bus_stop")
         self.set_tag("bus", "yes")
@@ -145,6 +180,20 @@ class OsmTrip(OsmElement):
         self.ways = []
         self.error = None
 
+        # edits applied to stops by the last call to update_stops
+        self.stop_edits = []
+
+        # GTFS shape, list of (lat, lon), used when the trip has no way
+        self.shape_id = None
+        self.shape = None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # trips pickled before stop edits and shapes were kept
+        self.__dict__.setdefault("stop_edits", [])
+        self.__dict__.setdefault("shape_id", None)
+        self.__dict__.setdefault("shape", None)
+
     @classmethod
     def fromGtfs(cls, gtfs_trip, osm_schedule):
         trip = cls(None, None, None)
@@ -164,6 +213,10 @@ class OsmTrip(OsmElement):
         
         self.update_stops(osm_schedule, gtfs_trip)
         assert self.stops, f"Empty list stop for trip {self.name}"
+
+        if len(gtfs_trip.way):
+            self.shape_id = gtfs_trip.shape_id
+            self.shape = list(gtfs_trip.way.get_ordered_nodes())
         
         gtfs_from = gtfs_trip.from_stop
         if gtfs_from is None:
@@ -188,9 +241,16 @@ class OsmTrip(OsmElement):
 
             new_stops.append(new_stop)
 
-        if new_stops != self.stops:
+        diff = StopSequenceDiff(self.stops, new_stops)
+        self.stop_edits = diff.edits
+        if diff:
             self.modified = True
-            self.stops = new_stops
+            self.stops = diff.apply()
+
+            # role and stop position of stops still served are preserved,
+            # drop those of removed stops
+            for stop in set(self.stops_data) - set(self.stops):
+                del self.stops_data[stop]
 
 
     def __len__(self):
@@ -263,16 +323,32 @@ class OsmRoute(OsmElement):
 
     def merge_trips(self, gtfs_route, osm_schedule):
         unupdated_trips = self.trips.copy()
+        unmatched_trips = []
 
         for trip in gtfs_route.trips:
             osm_trip = self.get_trip_by_ref(trip.ref)
             if osm_trip is None:
-                osm_trip = OsmTrip.fromGtfs(trip, osm_schedule)
-                self.add_trip(osm_trip)
+                unmatched_trips.append(trip)
             else:
                 osm_trip.merge_gtfs(trip, osm_schedule)
                 unupdated_trips.remove(osm_trip)
 
+        # providers sometimes rename headsigns, remaining trips are then
+        # matched on their sequence of stops
+        if unmatched_trips and unupdated_trips:
+            # imported here as numpy is only needed to match trips
+            from ..conflation.trips import TripMatcher
+
+            matcher = TripMatcher(unmatched_trips, osm_schedule=osm_schedule)
+            for match in matcher.match_all(unupdated_trips):
+                match.osm_trip.merge_gtfs(match.gtfs_trip, osm_schedule)
+                unupdated_trips.remove(match.osm_trip)
+                unmatched_trips.remove(match.gtfs_trip)
+
+        for trip in unmatched_trips:
+            osm_trip = OsmTrip.fromGtfs(trip, osm_schedule)
+            self.add_trip(osm_trip)
+
         # the idea is to have a one-to-one relation between GTFS trips and OSM
         # trips. If some trips were updated but not some others, it might mean
         # that they were removed in the GTFS dataset for instance. Anyway, it
@@ -0,0 +1,134 @@
+import os
+import tempfile
+
+from multiprocessing import Pool
+
+from .elements import GetIdAllocator, IdAllocator, OsmRoute, SetIdAllocator
+from .josm import JosmDocument
+from ..profiling import profiled
+
+
+# Read-only state of worker processes, set once by _init_worker so that
+# schedules are not sent again with every route
+_worker_routes = None
+_worker_osm_schedule = None
+_worker_fragments_dir = None
+_worker_shape_tolerance = None
+
+
+def _init_worker(gtfs_routes, osm_schedule, fragments_dir, shape_tolerance):
+    global _worker_routes, _worker_osm_schedule, _worker_fragments_dir, \
+           _worker_shape_tolerance
+    _worker_routes = gtfs_routes
+    _worker_osm_schedule = osm_schedule
+    _worker_fragments_dir = fragments_dir
+    _worker_shape_tolerance = shape_tolerance
+
+
+def _export_fragment(index):
+    gtfs_route = _worker_routes[index]
+    try:
+        doc = RouteExporter.export_route(index, gtfs_route,
+                                         _worker_osm_schedule,
+                                         _worker_shape_tolerance)
+    except Exception as e:
+        return index, None, str(e)
+
+    path = os.path.join(_worker_fragments_dir, f"route_{index:05d}.osm")
+    with open(path, 'w', encoding="utf-8") as fragment:
+        doc.write(fragment)
+
+    return index, path, None
+
+
+class RouteExporter(object):
+    """
+    Convert GTFS routes to OSM routes and write them in a JOSM document.
+
+    Each route gets its own block of negative ids, based on its position in
+    the list of routes to export. With jobs > 1, routes are converted in
+    worker processes which write one fragment per route, fragments are then
+    merged in route order. Both modes produce the same file.
+
+    Routes are exported right after being converted, so that ids of their
+    geometry, if any, are allocated in the block of the route. Routes
+    failing to be converted or exported are skipped in both modes.
+    """
+
+    def __init__(self, osm_schedule, jobs=1, shape_tolerance=None):
+        self.osm_schedule = osm_schedule
+        self.jobs = jobs
+        self.shape_tolerance = shape_tolerance
+        self.failures = []
+
+    @classmethod
+    def export_route(cls, index, gtfs_route, osm_schedule, shape_tolerance):
+        """
+        Convert gtfs_route and return a JOSM document holding only it, so
+        that a route failing halfway doesn't leave elements in the exported
+        document
+        """
+        # block 0 is left to elements created outside of route exports, the
+        # allocator in use is restored once the route is exported
+        previous_allocator = GetIdAllocator()
+        SetIdAllocator(IdAllocator(index + 1))
+        try:
+            osm_route = OsmRoute.fromGtfs(gtfs_route, osm_schedule)
+            doc = JosmDocument(shape_tolerance)
+            doc.export_routes([osm_route])
+        finally:
+            SetIdAllocator(previous_allocator)
+
+        return doc
+
+    @profiled("export")
+    def export(self, gtfs_routes, out_file):
+        """
+        Export routes to out_file. Routes that failed to be converted are
+        skipped, and listed as (route, error message) in self.failures.
+        """
+        gtfs_routes = list(gtfs_routes)
+        self.failures = []
+
+        if self.jobs > 1 and len(gtfs_routes) > 1:
+            doc = self._export_parallel(gtfs_routes)
+        else:
+            doc = self._export_serial(gtfs_routes)
+
+        with open(out_file, 'w', encoding="utf-8") as output_file:
+            doc.write(output_file)
+
+        return self.failures
+
+    def _export_serial(self, gtfs_routes):
+        doc = JosmDocument(self.shape_tolerance)
+
+        for index, route in enumerate(gtfs_routes):
+            try:
+                fragment = self.export_route(index, route, self.osm_schedule,
+                                             self.shape_tolerance)
+            except Exception as e:
+                self.failures.append((route, str(e)))
+                continue
+
+            doc.container.extend(list(fragment.container))
+
+        return doc
+
+    def _export_parallel(self, gtfs_routes):
+        doc = JosmDocument()
+
+        with tempfile.TemporaryDirectory(prefix="gtfsimporter-") as fragments_dir:
+            initargs = (gtfs_routes, self.osm_schedule, fragments_dir,
+                        self.shape_tolerance)
+            with Pool(self.jobs, _init_worker, initargs) as pool:
+                results = pool.map(_export_fragment, range(len(gtfs_routes)))
+
+            # results are in submission order, so is the merged document
+            for index, path, error in results:
+                if error is not None:
+                    self.failures.append((gtfs_routes[index], error))
+                else:
+                    doc.merge(path)
+
+        return doc
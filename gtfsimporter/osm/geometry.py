@@ -0,0 +1,129 @@
+import numpy as np
+
+from .elements import GetIdAllocator
+from .josm import Node, Way
+
+
+# length in meters of a degree of latitude
+METERS_PER_DEGREE = 40075000 / 360
+
+
+def project(coords):
+    """
+    Project an (n, 2) array of lat/lon to local planar coordinates in meters.
+
+    An equirectangular projection centered on the shape is plenty at the scale
+    of a bus route, and keeps distances cheap to compute.
+    """
+    lat0 = np.radians(coords[:, 0].mean())
+    xy = np.empty_like(coords)
+    xy[:, 0] = coords[:, 1] * METERS_PER_DEGREE * np.cos(lat0)
+    xy[:, 1] = coords[:, 0] * METERS_PER_DEGREE
+    return xy
+
+
+def segment_distances(points, start, end):
+    """
+    Distances from each of points to the segment [start, end]
+    """
+    direction = end - start
+    length2 = direction.dot(direction)
+    if length2 == 0:
+        # closed shape, the segment is a single point
+        return np.hypot(*(points - start).T)
+
+    t = np.clip((points - start).dot(direction) / length2, 0, 1)
+    closest = start + t[:, None] * direction
+    return np.hypot(*(points - closest).T)
+
+
+def simplify(coords, tolerance):
+    """
+    Simplify a line with the Douglas-Peucker algorithm
+
+    coords is an (n, 2) array of lat/lon, tolerance is in meters. Returns a
+    boolean mask of the points to keep. The recursion is unrolled with a
+    stack, and the distances of all points of a span are computed at once.
+    """
+    n = len(coords)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    keep[0] = keep[-1] = True
+    xy = project(coords)
+
+    spans = [(0, n - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+
+        distances = segment_distances(xy[first + 1:last], xy[first], xy[last])
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            spans.append((first, index))
+            spans.append((index, last))
+
+    return keep
+
+
+class GeometryBuilder(object):
+    """
+    Build simplified ways from GTFS shapes
+
+    Trips of the same pattern share their shape, so ways are built once per
+    shape id and nodes are shared between ways when they have the same
+    coordinates. Nodes and ways get ids when they are built, so a builder
+    should be used while the IdAllocator of the exported route is active.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self._ways = {}
+        self._nodes = {}
+        self._exported = set()
+
+    def get_way(self, shape_id, shape):
+        way = self._ways.get(shape_id)
+        if way is None:
+            way = self.build_way(shape)
+            self._ways[shape_id] = way
+
+        return way
+
+    def build_way(self, shape):
+        coords = np.array(shape, dtype=float)
+        keep = simplify(coords, self.tolerance)
+
+        nodes = []
+        for lat, lon in coords[keep]:
+            key = ("{:.7f}".format(lat), "{:.7f}".format(lon))
+            node = self._nodes.get(key)
+            if node is None:
+                node = Node(GetIdAllocator().next_id(), lat, lon)
+                self._nodes[key] = node
+
+            # consecutive points rounded to the same node would create a
+            # zero-length segment
+            if not nodes or nodes[-1] is not node:
+                nodes.append(node)
+
+        return Way(GetIdAllocator().next_id(), nodes)
+
+    def export(self, container):
+        """
+        Export nodes and ways that are not in container yet
+        """
+        for way in self._ways.values():
+            for node in way.nodes:
+                if node.osm_id not in self._exported:
+                    node.export(container)
+                    self._exported.add(node.osm_id)
+
+        for way in self._ways.values():
+            if way.osm_id not in self._exported:
+                way.export(container)
+                self._exported.add(way.osm_id)
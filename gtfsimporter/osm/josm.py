@@ -1,6 +1,8 @@
 
 import xml.etree.ElementTree as ET
 
+from ..profiling import profiled
+
 
 class OsmObject:
 
@@ -59,19 +61,16 @@ class Node(OsmObject):
 
 class Way(OsmObject):
 
-    def __init__(self, way):
-        super().__init__()
-        self.nodes = []
-        for coords in way.get_ordered_nodes():
-            self.nodes.append(Node(*coords))
+    def __init__(self, osm_id, nodes, tags=None, attrs=None):
+        super().__init__(osm_id, tags, attrs)
+        self.nodes = nodes
 
     def export(self, container):
+        # nodes are not exported here as they can be shared by several ways
         way = self.create_element(container, "way")
         for node in self.nodes:
-            node.export(container)
-
             nd = ET.SubElement(way, "nd")
-            nd.set("ref", node.id)
+            nd.set("ref", node.osm_id)
         self.export_tags(way)
 
 class RelationMember:
@@ -123,7 +122,7 @@ class Relation(OsmObject):
 
 class RouteRelation(Relation):
 
-    def __init__(self, trip):
+    def __init__(self, trip, geometry=None):
         super().__init__(trip.id, trip.tags, trip.attributes)
         self.trip = trip
 
@@ -144,6 +143,12 @@ class RouteRelation(Relation):
             way_member = WayRelationMember(way)
             self.add_member(way_member)
 
+        # trips without ways in OSM get the geometry of their GTFS shape
+        if geometry is not None and not trip.ways and \
+                getattr(trip, "shape", None):
+            way = geometry.get_way(trip.shape_id, trip.shape)
+            self.add_member(WayRelationMember(way.osm_id))
+
         assert self.trip.from_stop, f"from_stop is None for {self.trip.name}"
         assert self.trip.to_stop, f"to_stop is None for {self.trip.name}"
         self.add_tag("from", self.trip.from_stop)
@@ -152,21 +157,17 @@ class RouteRelation(Relation):
         if trip.modified:
             self.modified = True
 
-    def export(self, container):
-        #if self.way:
-        #    self.way.export(container)
-        super().export(container)
-
 
 class RouteMasterRelation(Relation):
 
-    def __init__(self, route):
+    def __init__(self, route, geometry=None):
         super().__init__(route.id, route.tags, route.attributes)
         self.route = route
+        self.geometry = geometry
 
         self.route_relations = []
         for trip in self.route.trips:
-            route_rel = RouteRelation(trip)
+            route_rel = RouteRelation(trip, geometry)
             self.add_member(RelationMember("relation", route_rel.osm_id, ""))
             self.route_relations.append(route_rel)
 
@@ -174,6 +175,8 @@ class RouteMasterRelation(Relation):
 
     def export(self, container, export_subrelations=True):
         if export_subrelations:
+            if self.geometry is not None:
+                self.geometry.export(container)
             for route_relation in self.route_relations:
                 route_relation.export(container)
         super().export(container)
@@ -181,7 +184,11 @@ class RouteMasterRelation(Relation):
 
 class JosmDocument(object):
 
-    def __init__(self):
+    def __init__(self, shape_tolerance=None):
+        # when set, trips without ways are exported with the geometry of
+        # their GTFS shape, simplified with this tolerance in meters
+        self.shape_tolerance = shape_tolerance
+
         self.container = ET.Element("osm")
         self.container.set("version", "0.6")
         self.container.set("generator", "GTFS Importer")
@@ -204,9 +211,24 @@ class JosmDocument(object):
 
     def export_routes(self, routes):
         for route in routes:
-            route_master = RouteMasterRelation(route)
+            geometry = None
+            if self.shape_tolerance is not None:
+                # imported here as numpy is only needed to export geometry
+                from .geometry import GeometryBuilder
+                geometry = GeometryBuilder(self.shape_tolerance)
+
+            route_master = RouteMasterRelation(route, geometry)
             route_master.export(self.container)
 
 
+    def merge(self, fil):
+        """
+        Append all elements of another JOSM document, e.g. a fragment written
+        by a worker process, at the end of this document.
+        """
+        fragment = ET.parse(fil).getroot()
+        self.container.extend(list(fragment))
+
+    @profiled("export")
     def write(self, fil):
         self.tree.write(fil, encoding="unicode", xml_declaration=True)
@@ -5,14 +5,18 @@ from pprint import pprint
 from .elements import OsmRoute, OsmStop, OsmTrip
 
 from ..common_elements import Schedule
-from ..validator.issue import *
+from ..profiling import profiled
 
 
+import threading
+
 import overpy
 import requests
 
 class OverpassImporter():
 
+    API_URL = "http://overpass-api.de/api/interpreter"
+
     PLATFORM_QUERY = """
     [out:xml][timeout:30][bbox:{},{},{},{}];
     node["public_transport"="platform"]["ref"]->.all_ref_platforms;
@@ -54,27 +58,29 @@ class OverpassImporter():
     def stops(self):
         return self._stops_dict.values()
 
-    def check_tag(self, schedule, stop, tag_name, expected_value=None):
-        value = getattr(stop, tag_name)
-
-        if not value:
-            issue = AttributeMissingIssue(stop, tag_name, expected_value)
-            schedule.issues.append(issue)
-        elif expected_value and value != expected_value:
-            issue = InvalidAttributeValueIssue(stop, tag_name, value, expected_value)
-            schedule.issues.append(issue)
-
-    def generate_cache(self, overpass_query, path):
+    def query(self, overpass_query):
+        """
+        Return the result of overpass_query in the area, as XML, or None if
+        the query failed
+        """
         query = overpass_query.format(*self.area)
         print(query)
-        r = requests.post("http://overpass-api.de/api/interpreter", data=query)
+        r = requests.post(self.API_URL, data=query)
         if r.status_code != 200:
-            print(f"Something went wrong when generating cache ({r.status_code}), aborting.")
+            print(f"Something went wrong when querying Overpass ({r.status_code}), aborting.")
             print(r.text)
+            return None
+
+        return r.text
+
+    @profiled("osm_query")
+    def generate_cache(self, overpass_query, path):
+        xml = self.query(overpass_query)
+        if xml is None:
             return False
 
         with open(path, 'w') as cache_file:
-            cache_file.write(r.text)
+            cache_file.write(xml)
 
     def generate_cache_stops(self, cache_path):
         """
@@ -89,6 +95,7 @@ class OverpassImporter():
     def generate_cache_routes(self, cache_path):
         self.generate_cache(self.ROUTES_QUERY, cache_path)
 
+    @profiled("osm_parse")
     def load_stops(self, schedule, xml=None):
 
         if xml:
@@ -103,10 +110,6 @@ class OverpassImporter():
             stop = OsmStop(id, lat, lon, node.tags, node.attributes)
             schedule.add_stop(stop)
 
-            #self.check_tag(schedule, stop, "highway", "bus_stop")
-            #self.check_tag(schedule, stop, "bus", "yes")
-            #self.check_tag(schedule, stop, "name")
-
     def _build_master_route(self, schedule, master_relation):
         id = master_relation.id
 
@@ -161,6 +164,7 @@ class OverpassImporter():
         return trip
 
 
+    @profiled("osm_parse")
     def load_routes(self, schedule, xml=None):
         self.load_stops(schedule, xml)
 
@@ -182,3 +186,51 @@ class OverpassImporter():
         #self.load_routes(schedule, xml)
 
         return schedule
+
+
+class OverpassFetch(object):
+    """
+    Overpass query sent in a background thread, as soon as the area is
+    known, e.g. from GTFSImporter.scan_bounding_box, while the caller parses
+    the GTFS dataset: requests releases the GIL while waiting for the
+    response, so both take as long as the slowest one. result waits for
+    the response, its osm_query stage only recording the time the caller
+    was blocked.
+    """
+
+    def __init__(self, area, overpass_query=OverpassImporter.ROUTES_QUERY):
+        self.importer = OverpassImporter(area)
+        self._xml = None
+        self._error = None
+
+        self._thread = threading.Thread(target=self._run, args=(overpass_query,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, overpass_query):
+        try:
+            self._xml = self.importer.query(overpass_query)
+        except Exception as e:
+            self._error = e
+
+    @profiled("osm_query")
+    def result(self):
+        """
+        Wait for the response and return it, as XML
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if self._xml is None:
+            raise RuntimeError("Overpass query failed")
+        return self._xml
+
+    def load_routes(self, schedule=None):
+        """
+        Wait for the response of the routes query and load it in schedule,
+        a new Schedule if not set
+        """
+        if schedule is None:
+            schedule = Schedule()
+        self.importer.load_routes(schedule, self.result())
+        return schedule
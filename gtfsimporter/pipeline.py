@@ -0,0 +1,464 @@
+import hashlib
+import os
+import pickle
+import queue
+import shutil
+import threading
+import time
+import zipfile
+
+from multiprocessing import Pool
+
+from .gtfs import agencies
+
+
+def hash_paths(paths):
+    """
+    Hash the content of files, directories being hashed file by file
+    """
+    h = hashlib.sha1()
+
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, n) for n in sorted(names))
+        else:
+            files = [path]
+
+        for fil in files:
+            h.update(os.path.relpath(fil, path).encode())
+            with open(fil, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+
+    return h.hexdigest()
+
+
+class Provider(object):
+    """
+    Files of a GTFS provider, laid out as in the Makefile
+    """
+
+    def __init__(self, agency, work_dir):
+        self.agency = agency
+        self.name = agency.provider
+        self.work_dir = os.path.join(work_dir, self.name)
+
+        self.archive = os.path.join(self.work_dir,
+                                    os.path.basename(agency.archive_url))
+        self.unpack_dir = os.path.join(self.work_dir, "gtfs")
+        self.gtfs_pickle = os.path.join(self.work_dir, "gtfs.pickle")
+        self.osm_xml = os.path.join(self.work_dir, "osm.xml")
+        self.osm_pickle = os.path.join(self.work_dir, "osm.pickle")
+        self.routes_file = os.path.join(self.work_dir, "routes.osm")
+        self.stops_file = os.path.join(self.work_dir, "stops.osm")
+        self.state_file = os.path.join(self.work_dir, ".pipeline_state")
+
+    @property
+    def stages(self):
+        # agencies without routes, see StlAgency, only have stops exported
+        if self.agency.routes is None:
+            return STOP_STAGES
+        return STAGES
+
+    @property
+    def make_prefix(self):
+        return self.name.upper().replace("-", "_")
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_state(self, state):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.state_file)
+
+
+class Stage(object):
+    """
+    Step of the pipeline of a provider
+
+    A stage runs once its dependencies are done. Unless it is a source
+    stage, its inputs are hashed and it is skipped if the hash matches the
+    one of its last successful run and its outputs still exist. Source
+    stages fetch remote data and always run, except when sources are not
+    refreshed and their outputs exist.
+    """
+
+    name = None
+    deps = []
+    source = False
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def inputs(self):
+        return []
+
+    def outputs(self):
+        raise NotImplementedError("Stage-subclass must implement this")
+
+    def run(self):
+        raise NotImplementedError("Stage-subclass must implement this")
+
+    def outputs_exist(self):
+        return all(os.path.exists(p) for p in self.outputs())
+
+    def input_hash(self):
+        if self.source:
+            return None
+        return hash_paths(self.inputs())
+
+    def execute(self, previous_hash, refresh_sources):
+        """
+        Run the stage if needed, return a StageResult
+        """
+        start = time.perf_counter()
+        try:
+            input_hash = self.input_hash()
+            if self.outputs_exist() and (
+                    (self.source and not refresh_sources) or
+                    (not self.source and input_hash == previous_hash)):
+                status = StageResult.SKIPPED
+            else:
+                os.makedirs(self.provider.work_dir, exist_ok=True)
+                self.run()
+                status = StageResult.DONE
+            error = None
+        except Exception as e:
+            input_hash = None
+            status = StageResult.FAILED
+            error = str(e) or type(e).__name__
+
+        return StageResult(self.provider.name, self.name, status,
+                           time.perf_counter() - start, input_hash, error)
+
+
+class FetchStage(Stage):
+
+    name = "fetch"
+    source = True
+
+    def outputs(self):
+        return [self.provider.archive]
+
+    def run(self):
+        # requests is slow to import, only load it when needed
+        import requests
+
+        tmp_file = self.provider.archive + ".tmp"
+        with requests.get(self.provider.agency.archive_url, stream=True) as r:
+            r.raise_for_status()
+            with open(tmp_file, 'wb') as f:
+                for chunk in r.iter_content(1 << 20):
+                    f.write(chunk)
+        os.replace(tmp_file, self.provider.archive)
+
+
+class ExtractStage(Stage):
+
+    name = "extract"
+    deps = ["fetch"]
+
+    def inputs(self):
+        return [self.provider.archive]
+
+    def outputs(self):
+        return [self.provider.unpack_dir]
+
+    def run(self):
+        shutil.rmtree(self.provider.unpack_dir, ignore_errors=True)
+        with zipfile.ZipFile(self.provider.archive) as archive:
+            archive.extractall(self.provider.unpack_dir)
+
+
+class PickleGtfsStage(Stage):
+
+    name = "pickle-gtfs"
+    deps = ["extract"]
+
+    def inputs(self):
+        return [self.provider.unpack_dir]
+
+    def outputs(self):
+        return [self.provider.gtfs_pickle]
+
+    def run(self):
+        from .cli.loader import DatadirGtfsLoader, PickleGtfsLoader
+
+        schedule = DatadirGtfsLoader.load_gtfs_datadir(self.provider.unpack_dir)
+        PickleGtfsLoader.write_gtfs_pickle(schedule, self.provider.gtfs_pickle,
+                                           "routes")
+
+
+class QueryOsmStage(Stage):
+
+    name = "query-osm"
+    deps = ["extract"]
+    source = True
+
+    def outputs(self):
+        return [self.provider.osm_xml]
+
+    def run(self):
+        from .gtfs.importer import GTFSImporter
+        from .osm.overpass import OverpassImporter
+
+        # only the coordinates of stops are read
+        importer = GTFSImporter(self.provider.unpack_dir)
+        loader = OverpassImporter(importer.scan_bounding_box(1000))
+        loader.generate_cache_routes(self.provider.osm_xml)
+
+
+class PickleOsmStage(Stage):
+
+    name = "pickle-osm"
+    deps = ["query-osm"]
+
+    def inputs(self):
+        return [self.provider.osm_xml]
+
+    def outputs(self):
+        return [self.provider.osm_pickle]
+
+    def run(self):
+        from .common_elements import Schedule
+        from .osm.overpass import OverpassImporter
+
+        with open(self.provider.osm_xml) as f:
+            xml = f.read()
+
+        schedule = Schedule()
+        OverpassImporter(None).load_routes(schedule, xml)
+        with open(self.provider.osm_pickle, 'wb') as f:
+            pickle.dump(schedule, f, pickle.HIGHEST_PROTOCOL)
+
+
+class ExportRoutesStage(Stage):
+
+    name = "export"
+    deps = ["pickle-gtfs", "pickle-osm"]
+
+    def inputs(self):
+        return [self.provider.gtfs_pickle, self.provider.osm_pickle]
+
+    def outputs(self):
+        return [self.provider.routes_file]
+
+    def run(self):
+        from .cli.loader import PickleGtfsLoader, PickleOsmLoader
+        from .osm.export import RouteExporter
+
+        gtfs = PickleGtfsLoader.load_gtfs_pickle(self.provider.gtfs_pickle)
+        osm = PickleOsmLoader.load_osm_pickle(self.provider.osm_pickle)
+
+        failures = RouteExporter(osm).export(gtfs.routes,
+                                             self.provider.routes_file)
+        for route, error in failures:
+            print(f"{self.provider.name}: unable to generate route "
+                  f"{route.ref}: {error}")
+
+
+class ExportStopsStage(Stage):
+
+    name = "export-stops"
+    deps = ["extract"]
+
+    def inputs(self):
+        return [self.provider.unpack_dir]
+
+    def outputs(self):
+        return [self.provider.stops_file]
+
+    def run(self):
+        from .cli.loader import DatadirGtfsLoader
+        from .osm.elements import OsmStop
+        from .osm.josm import JosmDocument
+
+        gtfs = DatadirGtfsLoader.load_only_stops(self.provider.unpack_dir)
+
+        doc = JosmDocument()
+        doc.export_stops([OsmStop.fromGtfs(s) for s in gtfs.stops])
+        with open(self.provider.stops_file, 'w', encoding="utf-8") as f:
+            doc.write(f)
+
+
+STAGES = [
+    FetchStage,
+    ExtractStage,
+    PickleGtfsStage,
+    QueryOsmStage,
+    PickleOsmStage,
+    ExportRoutesStage,
+]
+
+STOP_STAGES = [
+    FetchStage,
+    ExtractStage,
+    ExportStopsStage,
+]
+
+
+def write_makefile(providers, fil):
+    """
+    Write the make variables of providers, included by the Makefile as
+    providers.mk, so that URLs are only declared by agencies
+    """
+    fil.write("# Generated from the agencies of gtfsimporter/gtfs by\n"
+              "# 'python -m gtfsimporter.main pipeline providers', don't edit\n")
+    for provider in providers:
+        remote_url, archive = provider.agency.archive_url.rsplit("/", 1)
+        prefix = provider.make_prefix
+        fil.write(f"\n"
+                  f"{prefix}_ARCHIVE\t:= {archive}\n"
+                  f"{prefix}_REMOTE_URL\t:= {remote_url}\n"
+                  f"$(eval $(call gtfs-providers,{provider.name},{prefix}))\n")
+
+
+class StageResult(object):
+
+    DONE = "done"
+    SKIPPED = "up to date"
+    FAILED = "failed"
+    BLOCKED = "not run"
+
+    def __init__(self, provider, stage, status, elapsed=0, input_hash=None,
+                 error=None):
+        self.provider = provider
+        self.stage = stage
+        self.status = status
+        self.elapsed = elapsed
+        self.input_hash = input_hash
+        self.error = error
+
+
+def _execute_stage(stage, previous_hash, refresh_sources):
+    return stage.execute(previous_hash, refresh_sources)
+
+
+class Pipeline(object):
+    """
+    Run the stages of several providers
+
+    Stages of all providers form a DAG, a stage being submitted to the
+    worker pool as soon as all its dependencies are done, so independent
+    providers, and independent stages of a provider, run concurrently.
+    Stages depending on a failed stage are not run.
+
+    Source stages, waiting for the network, run in threads of the main
+    process, even with a single job: the OSM query of a provider is
+    downloaded while its GTFS dataset is parsed.
+    """
+
+    def __init__(self, providers, jobs=1, refresh_sources=True):
+        self.providers = providers
+        self.jobs = jobs
+        self.refresh_sources = refresh_sources
+        self.results = []
+        self.elapsed = 0
+
+    @classmethod
+    def for_agencies(cls, work_dir, names=None, **kwargs):
+        providers = [Provider(a, work_dir) for a in agencies
+                     if names is None or a.provider in names]
+        return cls(providers, **kwargs)
+
+    def run(self):
+        states = {p.name: p.load_state() for p in self.providers}
+        pending = {}
+        for provider in self.providers:
+            for stage_cls in provider.stages:
+                pending[provider.name, stage_cls.name] = stage_cls(provider)
+
+        finished = {}
+        running = set()
+        results = queue.Queue()
+
+        def submit(stage, pool):
+            key = stage.provider.name, stage.name
+            args = (stage, states[key[0]].get(stage.name), self.refresh_sources)
+            running.add(key)
+            if stage.source:
+                threading.Thread(target=lambda: results.put(_execute_stage(*args)),
+                                 daemon=True).start()
+            elif pool is None:
+                results.put(_execute_stage(*args))
+            else:
+                error = lambda e: results.put(StageResult(
+                    key[0], key[1], StageResult.FAILED, error=str(e)))
+                pool.apply_async(_execute_stage, args, callback=results.put,
+                                 error_callback=error)
+
+        def schedule(pool):
+            ready = []
+            for key, stage in list(pending.items()):
+                deps = [finished.get((key[0], d)) for d in stage.deps]
+                if None in deps:
+                    continue
+
+                del pending[key]
+                if any(s in (StageResult.FAILED, StageResult.BLOCKED)
+                       for s in deps):
+                    self.record(StageResult(key[0], key[1],
+                                            StageResult.BLOCKED), states)
+                    finished[key] = StageResult.BLOCKED
+                else:
+                    ready.append(stage)
+
+            # source stages first, so that they are started before stages
+            # run in the main process without a pool
+            for stage in sorted(ready, key=lambda s: not s.source):
+                submit(stage, pool)
+
+        start = time.perf_counter()
+        pool = Pool(self.jobs) if self.jobs > 1 else None
+        try:
+            schedule(pool)
+            while running:
+                result = results.get()
+                key = result.provider, result.stage
+                running.discard(key)
+                finished[key] = result.status
+                self.record(result, states)
+                schedule(pool)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.elapsed = time.perf_counter() - start
+        return self.results
+
+    def record(self, result, states):
+        self.results.append(result)
+        if result.status == StageResult.BLOCKED:
+            return
+
+        provider = next(p for p in self.providers if p.name == result.provider)
+        state = states[provider.name]
+        if result.status == StageResult.FAILED:
+            # outputs may be partially written, don't trust them next time
+            state.pop(result.stage, None)
+        else:
+            state[result.stage] = result.input_hash
+        provider.save_state(state)
+
+        print(f"{result.provider}: {result.stage} {result.status} "
+              f"({result.elapsed:.1f}s)")
+
+    def print_report(self):
+        print(f"{'provider':<22}{'stage':<14}{'status':<12}{'time':>8}")
+        for result in sorted(self.results, key=lambda r: r.provider):
+            print(f"{result.provider:<22}{result.stage:<14}{result.status:<12}"
+                  f"{result.elapsed:>7.1f}s")
+            if result.error:
+                print(f"\t{result.error}")
+
+        failed = [r for r in self.results if r.status == StageResult.FAILED]
+        print(f"Total: {self.elapsed:.1f}s, {len(failed)} failed stage(s)")
@@ -0,0 +1,197 @@
+import cProfile
+import gc
+import json
+import resource
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from functools import wraps
+
+
+class StageStats(object):
+    """
+    Resources used by all the runs of a stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        # in kilobytes, peak of the process at the end of the stage
+        self.max_rss = 0
+        # variation of the number of objects tracked by the garbage collector
+        self.objects = 0
+        # in bytes, only recorded with tracemalloc, peak above the memory
+        # traced when the stage started
+        self.traced_peak = None
+        self.cprofile = None
+        self.snapshot = None
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "max_rss_kb": self.max_rss,
+            "objects": self.objects,
+            "traced_peak": self.traced_peak,
+        }
+
+
+class Profiler(object):
+    """
+    Record wall time, CPU time, peak RSS and object counts of the stages of
+    a command, declared with the profiled decorator or Profiler.stage.
+
+    Nothing is recorded until enable is called, a disabled stage costing a
+    single attribute lookup. Once enabled, each stage run counts the objects
+    tracked by the garbage collector, which is linear in the size of the
+    heap, so stages are meant to be coarse, e.g. loading a GTFS file.
+    A stage entered again while already running, directly or not, is
+    accounted to the outer run. Only stages of the main thread are
+    recorded, stages run meanwhile by other threads, e.g. downloads, being
+    part of its wall time.
+    """
+
+    enabled = False
+    use_cprofile = False
+    use_tracemalloc = False
+
+    _stats = {}
+    _active = []
+
+    @classmethod
+    def enable(cls, use_cprofile=False, use_tracemalloc=False):
+        cls.enabled = True
+        cls.use_cprofile = use_cprofile
+        cls.use_tracemalloc = use_tracemalloc
+        cls._stats = {}
+        cls._active = []
+        cls._start = (time.perf_counter(), time.process_time())
+
+        if use_tracemalloc:
+            tracemalloc.start()
+
+    @classmethod
+    @contextmanager
+    def stage(cls, name):
+        if not cls.enabled or name in cls._active or \
+                threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        stats = cls._stats.get(name)
+        if stats is None:
+            stats = cls._stats[name] = StageStats(name)
+
+        # cProfile can only profile one stage at a time, the outer one
+        profile = None
+        if cls.use_cprofile and not cls._active:
+            if stats.cprofile is None:
+                stats.cprofile = cProfile.Profile()
+            profile = stats.cprofile
+
+        traced = 0
+        if cls.use_tracemalloc:
+            traced = cls.reset_traced_peak()
+
+        cls._active.append(name)
+        objects = len(gc.get_objects())
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            stats.wall += time.perf_counter() - wall
+            stats.cpu += time.process_time() - cpu
+            stats.objects += len(gc.get_objects()) - objects
+            stats.calls += 1
+            stats.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if cls.use_tracemalloc:
+                peak = tracemalloc.get_traced_memory()[1] - traced
+                stats.traced_peak = max(stats.traced_peak or 0, peak)
+                stats.snapshot = tracemalloc.take_snapshot()
+            cls._active.pop()
+
+    @classmethod
+    def reset_traced_peak(cls):
+        """
+        Reset the peak of traced memory and return the memory traced.
+        tracemalloc.reset_peak is only available from Python 3.9, traces
+        are cleared instead before it, which also drops the allocations
+        made so far by enclosing stages from their snapshots.
+        """
+        reset_peak = getattr(tracemalloc, "reset_peak", None)
+        if reset_peak is not None:
+            reset_peak()
+        else:
+            tracemalloc.clear_traces()
+        return tracemalloc.get_traced_memory()[0]
+
+    @classmethod
+    def stages(cls):
+        return list(cls._stats.values())
+
+    @classmethod
+    def print_summary(cls):
+        wall = time.perf_counter() - cls._start[0]
+        cpu = time.process_time() - cls._start[1]
+
+        print("")
+        print(f"{'stage':<26}{'calls':>6}{'wall (s)':>10}{'cpu (s)':>10}"
+              f"{'rss (MB)':>10}{'objects':>12}")
+        for stats in cls.stages():
+            print(f"{stats.name:<26}{stats.calls:>6}{stats.wall:>10.2f}"
+                  f"{stats.cpu:>10.2f}{stats.max_rss / 1024:>10.1f}"
+                  f"{stats.objects:>12}")
+        print(f"{'total':<26}{'':>6}{wall:>10.2f}{cpu:>10.2f}")
+
+    @classmethod
+    def write(cls, path, argv=None):
+        """
+        Write the stages as JSON to path. cProfile statistics and
+        tracemalloc snapshots taken at the end of each stage, if enabled,
+        are written next to it, as <path>.<stage>.prof and
+        <path>.<stage>.tracemalloc.
+        """
+        report = {
+            "argv": argv,
+            "wall": time.perf_counter() - cls._start[0],
+            "cpu": time.process_time() - cls._start[1],
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "stages": [s.as_dict() for s in cls.stages()],
+        }
+
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        for stats in cls.stages():
+            if stats.cprofile is not None:
+                stats.cprofile.dump_stats(f"{path}.{stats.name}.prof")
+            if stats.snapshot is not None:
+                stats.snapshot.dump(f"{path}.{stats.name}.tracemalloc")
+
+        if cls.use_tracemalloc:
+            tracemalloc.stop()
+
+
+def profiled(name):
+    """
+    Decorator declaring a function as a stage of Profiler
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not Profiler.enabled:
+                return func(*args, **kwargs)
+            with Profiler.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import pickle
+
+from multiprocessing import Pool
+
+from .validator import StopValidator
+from ..profiling import profiled
+
+
+_worker_validator = None
+
+
+def _init_worker(validator):
+    global _worker_validator
+    _worker_validator = validator
+
+
+def _check_refs(refs):
+    return [(ref, list(_worker_validator.iter_ref_issues(ref))) for ref in refs]
+
+
+class IncrementalStopValidator(StopValidator):
+    """
+    Stop validator that only re-evaluates refs that changed since last run
+
+    A fingerprint of the GTFS and OSM stops of each ref is stored in
+    state_file along with the issues found for this ref. On the next run,
+    issues of refs with an unchanged fingerprint are carried over, and rules
+    are evaluated only on the others. Changing rules invalidates the whole
+    state. OSM stops without ref are always checked.
+    """
+
+    STATE_VERSION = 1
+
+    def __init__(self, issues, gtfs_stops, osm_stops, state_file, rules=None):
+        super().__init__(issues, gtfs_stops, osm_stops, rules)
+        self.state_file = state_file
+        self.revalidated = 0
+        self.carried_over = 0
+
+    def rules_fingerprint(self):
+        rules = []
+        for target in sorted(self.rules):
+            for rule in self.rules[target]:
+                params = sorted(vars(rule).items())
+                rules.append(f"{target}:{type(rule).__name__}:{params}")
+
+        return hashlib.sha1("\n".join(rules).encode()).hexdigest()
+
+    @classmethod
+    def gtfs_stop_data(cls, stop):
+        return (stop.id, stop.name, stop.lat, stop.lon, tuple(stop.refs))
+
+    @classmethod
+    def osm_stop_data(cls, stop):
+        # version changes with every edit of a node, but it is missing from
+        # OSM data queried without metadata
+        version = stop.attributes.get("version")
+        return (stop.id, version, str(stop.lat), str(stop.lon),
+                tuple(sorted(stop.tags.items())))
+
+    def fingerprint(self, ref):
+        gtfs_stop = self.gtfs_by_ref.get(ref)
+        osm_stops = self.osm_by_ref.get(ref, [])
+
+        data = (
+            None if gtfs_stop is None else self.gtfs_stop_data(gtfs_stop),
+            [self.osm_stop_data(s) for s in osm_stops],
+        )
+        return hashlib.sha1(repr(data).encode()).digest()
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return {}
+
+        if state.get("version") != self.STATE_VERSION or \
+                state.get("rules") != self.rules_fingerprint():
+            return {}
+
+        return state["refs"]
+
+    def save_state(self, refs_state):
+        state = {
+            "version": self.STATE_VERSION,
+            "rules": self.rules_fingerprint(),
+            "refs": refs_state,
+        }
+
+        # write in a temporary file first so that an interrupted run
+        # doesn't leave a truncated state
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.state_file)
+
+    @profiled("validation")
+    def validate(self, jobs=1):
+        previous = self.load_state()
+        refs = self.get_all_refs()
+
+        fingerprints = {}
+        changed_refs = []
+        for ref in refs:
+            fingerprints[ref] = self.fingerprint(ref)
+            entry = previous.get(ref)
+            if entry is None or entry[0] != fingerprints[ref]:
+                changed_refs.append(ref)
+
+        new_issues = dict(self.check_changed_refs(changed_refs, jobs))
+
+        refs_state = {}
+        for ref in refs:
+            if ref in new_issues:
+                issues = new_issues[ref]
+            else:
+                issues = previous[ref][1]
+            refs_state[ref] = (fingerprints[ref], issues)
+            self.issues.extend(issues)
+
+        self.issues.extend(self.iter_unreferenced_issues())
+
+        self.revalidated = len(changed_refs)
+        self.carried_over = len(refs) - len(changed_refs)
+        self.save_state(refs_state)
+
+    def check_changed_refs(self, refs, jobs):
+        if jobs > 1 and len(refs) > self.SHARD_SIZE:
+            size = self.SHARD_SIZE
+            shards = [refs[i:i + size] for i in range(0, len(refs), size)]
+
+            with Pool(jobs, _init_worker, (self, )) as pool:
+                for results in pool.imap(_check_refs, shards):
+                    yield from results
+        else:
+            for ref in refs:
+                yield ref, list(self.iter_ref_issues(ref))
@@ -1,19 +1,24 @@
 
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 class IssueMetaclass(type):
     """
     This metaclass will add attributes "header" and "line_fmt"
     based on the "fields" attributes. That allows some pretty printing
-    in an array-like fashion.
+    in an array-like fashion. Classes with fields are also listed in
+    "issue_types".
     """
 
+    issue_types = []
+
     def __new__(cls, clsname, bases, dct):
 
         obj = super().__new__(cls, clsname, bases, dct)
         if not 'fields' in dct:
             return obj
 
+        cls.issue_types.append(obj)
+
         fields = dct['fields']
 
         pretty_fields = []
@@ -40,10 +45,26 @@ class IssueMetaclass(type):
 
 class Issue(object, metaclass=IssueMetaclass):
 
+    def values(self):
+        """
+        Return the values of the issue, one for each of its fields
+        """
+        raise NotImplementedError("Issue-subclass must implement this")
+
+    def as_dict(self):
+        names = [name for name, _ in self.fields]
+        record = {"type": type(self).__name__}
+        record.update(zip(names, [str(v) for v in self.values()]))
+        record["report"] = self.report()
+        return record
+
     def format_line(self, *args):
         args = [str(arg) for arg in args]
         return self.line_fmt.format(*args)
 
+    def line(self):
+        return self.format_line(*self.values())
+
 
 class OsmStopMissingIssue(Issue):
     """
@@ -61,11 +82,11 @@ class OsmStopMissingIssue(Issue):
         self.stop = gtfs_stop
         #assert len(self.stop.refs) == 1
 
-    def line(self):
+    def values(self):
         ref = self.stop.refs[0]
         name = self.stop.name
         position = "{}/{}".format(self.stop.lat, self.stop.lon)
-        return self.format_line(ref, name, position)
+        return ref, name, position
 
     def report(self):
         ref = self.stop.refs[0]
@@ -87,8 +108,8 @@ class OsmStopWithUnknownRefIssue(Issue):
         self.stop = osm_stop
         #assert len(self.stop.refs) == 1
 
-    def line(self):
-        return self.format_line(self.stop.id, self.stop.refs[0])
+    def values(self):
+        return self.stop.id, self.stop.refs[0]
 
     def report(self):
         ref = self.stop.refs[0]
@@ -109,9 +130,9 @@ class AttributeMissingIssue(Issue):
         self.attribute = attr_name
         self.value = attr_expected_value
 
-    def line(self):
+    def values(self):
         value = "-" if self.value is None else self.value
-        return self.format_line(self.stop.id, self.attribute, value)
+        return self.stop.id, self.attribute, value
 
     def report(self):
         rep = "OSM Stop with id '{}' is missing attribute '{}'.".format(
@@ -136,10 +157,8 @@ class InvalidAttributeValueIssue(Issue):
         self.current_val = current_value
         self.expected_val = expected_value
 
-    def line(self):
-        return self.format_line(
-            self.stop.id, self.attribute,
-            self.current_val, self.expected_val)
+    def values(self):
+        return self.stop.id, self.attribute, self.current_val, self.expected_val
 
     def report(self):
         rep = "OSM Stop with id '{}' has attribute with unexpected value. '{}' is " \
@@ -158,11 +177,9 @@ class NodesTooFarIssue(Issue):
         ("Distance", None)
     )
 
-    def line(self):
+    def values(self):
         distance = "{:.1f}".format(self.distance)
-        return self.format_line(
-            self.osm_stop.id, self.gtfs_stop.id, self.gtfs_stop.refs[0],
-            distance)
+        return self.osm_stop.id, self.gtfs_stop.id, self.gtfs_stop.refs[0], distance
 
     def __init__(self, osm_stop, gtfs_stop, distance):
         self.osm_stop = osm_stop
@@ -174,16 +191,103 @@ class NodesTooFarIssue(Issue):
         return rep.format(self.osm_stop.id, self.gtfs_stop.id, self.distance)
 
 
+class DuplicateRefIssue(Issue):
+
+    description = "OSM Stops Sharing The Same 'ref' Tag"
+    fields = (
+        ("Reference", 10),
+        ("OSM Stop IDs", 40)
+    )
+
+    def __init__(self, ref, osm_stops):
+        self.ref = ref
+        self.stops = osm_stops
+
+    def values(self):
+        ids = ", ".join(str(s.id) for s in self.stops)
+        return self.ref, ids
+
+    def report(self):
+        ids = ", ".join(str(s.id) for s in self.stops)
+        return "OSM Stops '{}' share the same ref '{}'".format(ids, self.ref)
+
+
+class NameMismatchIssue(Issue):
+
+    description = "Nodes with common ref in GTFS and OSM but different names"
+    fields = (
+        ("OSM Stop ID", 12),
+        ("Reference", 10),
+        ("OSM Name", 30),
+        ("GTFS Name", 30)
+    )
+
+    def __init__(self, osm_stop, gtfs_stop, ref):
+        self.osm_stop = osm_stop
+        self.gtfs_stop = gtfs_stop
+        self.ref = ref
+
+    def values(self):
+        return self.osm_stop.id, self.ref, self.osm_stop.name, self.gtfs_stop.name
+
+    def report(self):
+        rep = "OSM Stop '{}' is named '{}' but GTFS Stop '{}' is named '{}'"
+        return rep.format(self.osm_stop.id, self.osm_stop.name,
+                          self.gtfs_stop.id, self.gtfs_stop.name)
+
+
 class IssueList:
+    """
+    Collect issues and stream them to sinks as they are produced
 
-    def __init__(self):
+    Issues are kept in memory only if keep is set, for print_report. The
+    number of issues of each type is always counted, but only the first
+    max_per_type issues of each type are kept and written, and only one out
+    of sample_every if set.
+    """
+
+    def __init__(self, sinks=None, keep=True, max_per_type=None,
+                 sample_every=None):
         self.issues = []
+        self.sinks = sinks if sinks is not None else []
+        self.keep = keep
+        self.max_per_type = max_per_type
+        self.sample_every = sample_every
+
+        self.counts = Counter()
+        self.written = Counter()
 
     def append(self, issue):
-        self.issues.append(issue)
+        issue_cls = type(issue)
+        self.counts[issue_cls] += 1
+
+        if self.sample_every and (self.counts[issue_cls] - 1) % self.sample_every:
+            return
+        if self.max_per_type is not None and \
+                self.written[issue_cls] >= self.max_per_type:
+            return
+
+        self.written[issue_cls] += 1
+        if self.keep:
+            self.issues.append(issue)
+        for sink in self.sinks:
+            sink.write(issue)
 
     def extend(self, issues):
-        self.issues.extend(issues)
+        for issue in issues:
+            self.append(issue)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def print_summary(self):
+        for issue_cls, count in self.counts.items():
+            written = self.written[issue_cls]
+            line = f"{issue_cls.description}: {count}"
+            if written != count:
+                line += f" ({written} reported)"
+            print(line)
 
     def print_report(self):
         issues_by_type = defaultdict(list)
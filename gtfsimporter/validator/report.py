@@ -0,0 +1,110 @@
+import csv
+import json
+import sqlite3
+
+from collections import defaultdict
+
+from .issue import IssueMetaclass
+
+
+class IssueSink(object):
+    """
+    Destination of issues, written one at a time as they are produced
+    """
+
+    def write(self, issue):
+        raise NotImplementedError("IssueSink-subclass must implement this")
+
+    def close(self):
+        pass
+
+
+class TableSink(IssueSink):
+    """
+    Pretty table of IssueList.print_report. Only the formatted lines are
+    kept until close, as issues are grouped by type.
+    """
+
+    def __init__(self, fil):
+        self.fil = fil
+        self.lines_by_type = defaultdict(list)
+
+    def write(self, issue):
+        self.lines_by_type[type(issue)].append(issue.line())
+
+    def close(self):
+        for issue_cls, lines in self.lines_by_type.items():
+            print("\n", file=self.fil)
+            print("**", issue_cls.description, "**", file=self.fil)
+
+            print(issue_cls.header, file=self.fil)
+            for line in lines:
+                print(line, file=self.fil)
+
+        self.lines_by_type.clear()
+
+
+class JsonLinesSink(IssueSink):
+
+    def __init__(self, fil):
+        self.fil = fil
+
+    def write(self, issue):
+        self.fil.write(json.dumps(issue.as_dict(), ensure_ascii=False))
+        self.fil.write("\n")
+
+
+class CsvSink(IssueSink):
+    """
+    One column per field name of all issue types, left empty for issues
+    that don't have that field.
+    """
+
+    def __init__(self, fil):
+        columns = ["type"]
+        for issue_cls in IssueMetaclass.issue_types:
+            for name, _ in issue_cls.fields:
+                if name not in columns:
+                    columns.append(name)
+        columns.append("report")
+
+        self.writer = csv.DictWriter(fil, columns)
+        self.writer.writeheader()
+
+    def write(self, issue):
+        self.writer.writerow(issue.as_dict())
+
+
+class SqliteSink(IssueSink):
+    """
+    Store issues in the "issues" table of a SQLite database, fields being
+    stored as a JSON object. Rows are inserted in batches.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS issues "
+                        "(type TEXT, fields TEXT, report TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS issues_type ON issues(type)")
+        self.rows = []
+
+    def write(self, issue):
+        record = issue.as_dict()
+        issue_type = record.pop("type")
+        report = record.pop("report")
+        self.rows.append((issue_type, json.dumps(record, ensure_ascii=False),
+                          report))
+
+        if len(self.rows) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany("INSERT INTO issues VALUES (?, ?, ?)", self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,118 @@
+from haversine import haversine
+
+from .issue import *
+
+
+class Rule(object):
+    """
+    Base class of validation rules
+
+    A rule is registered against the type of element it checks, its target.
+    Its check method is called once per element of that type and returns the
+    list of issues found, empty if none.
+    """
+
+    target = None
+
+    def check(self, *args):
+        raise NotImplementedError("Rule-subclass must implement this")
+
+
+class OsmStopRule(Rule):
+    """
+    Rule checking a single OSM stop: check(osm_stop)
+    """
+
+    target = "osm_stop"
+
+
+class StopRefRule(Rule):
+    """
+    Rule checking the stops sharing a ref: check(ref, gtfs_stop, osm_stops).
+    gtfs_stop is None if the ref only exists in OSM, osm_stops is empty if
+    the ref only exists in the GTFS dataset.
+    """
+
+    target = "stop_ref"
+
+
+class MissingRefRule(StopRefRule):
+
+    def check(self, ref, gtfs_stop, osm_stops):
+        if gtfs_stop is not None and not osm_stops:
+            return [OsmStopMissingIssue(gtfs_stop)]
+        return []
+
+
+class DistanceRule(StopRefRule):
+
+    def __init__(self, max_distance=50):
+        # in meters
+        self.max_distance = max_distance
+
+    def check(self, ref, gtfs_stop, osm_stops):
+        issues = []
+        if gtfs_stop is None:
+            return issues
+
+        for osm_stop in osm_stops:
+            dist = haversine((osm_stop.lat, osm_stop.lon),
+                             (gtfs_stop.lat, gtfs_stop.lon)) * 1000
+
+            if dist >= self.max_distance:
+                issues.append(NodesTooFarIssue(osm_stop, gtfs_stop, dist))
+
+        return issues
+
+
+class DuplicateRefRule(StopRefRule):
+
+    def check(self, ref, gtfs_stop, osm_stops):
+        if len(osm_stops) > 1:
+            return [DuplicateRefIssue(ref, osm_stops)]
+        return []
+
+
+class NameMismatchRule(StopRefRule):
+
+    def check(self, ref, gtfs_stop, osm_stops):
+        if gtfs_stop is None:
+            return []
+
+        return [NameMismatchIssue(osm_stop, gtfs_stop, ref)
+                for osm_stop in osm_stops if osm_stop.name != gtfs_stop.name]
+
+
+class RequiredTagRule(OsmStopRule):
+
+    def __init__(self, tag_name, expected_value=None):
+        self.tag_name = tag_name
+        self.expected_value = expected_value
+
+    def check(self, osm_stop):
+        # OSM data also contain stop positions of routes, only platforms
+        # are expected to be tagged as bus stops
+        if osm_stop.get_tag("public_transport") != "platform":
+            return []
+
+        value = osm_stop.get_tag(self.tag_name)
+
+        if not value:
+            return [AttributeMissingIssue(osm_stop, self.tag_name,
+                                          self.expected_value)]
+        elif self.expected_value and value != self.expected_value:
+            return [InvalidAttributeValueIssue(osm_stop, self.tag_name, value,
+                                               self.expected_value)]
+        return []
+
+
+def default_rules(max_distance=50):
+    return [
+        MissingRefRule(),
+        DistanceRule(max_distance),
+        DuplicateRefRule(),
+        NameMismatchRule(),
+        RequiredTagRule("highway", "bus_stop"),
+        RequiredTagRule("bus", "yes"),
+        RequiredTagRule("name"),
+    ]
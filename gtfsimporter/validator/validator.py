@@ -1,61 +1,126 @@
-
-from haversine import haversine
+from multiprocessing import Pool
 
 from .issue import *
+from .rules import default_rules
+from ..profiling import profiled
+
+
+# Validator of worker processes, set once by _init_worker
+_worker_validator = None
+
+
+def _init_worker(validator):
+    global _worker_validator
+    _worker_validator = validator
+
+
+def _check_shard(shard):
+    refs, with_unreferenced = shard
+    return list(_worker_validator.iter_issues(refs, with_unreferenced))
+
 
 class StopValidator(object):
+    """
+    Validate GTFS and OSM stops against a set of rules
+
+    Stops are indexed by ref once, then all rules are evaluated in a single
+    pass over the refs: rules targeting "stop_ref" get the GTFS and OSM stops
+    of each ref, rules targeting "osm_stop" get each OSM stop. Refs can be
+    split in shards evaluated by worker processes.
 
-    def __init__(self, issues, gtfs_stops, osm_stops):
+    Issues are appended to the issue list as they are found, so that they
+    can be streamed to a report without being all held in memory.
+    """
+
+    SHARD_SIZE = 1000
+
+    def __init__(self, issues, gtfs_stops, osm_stops, rules=None):
         self.issues = issues
         self.gtfs_by_ref = {}
         self.osm_by_ref = {}
         self.osm_without_ref = []
 
         self.populate_by_ref(self.gtfs_by_ref, gtfs_stops)
-        self.populate_by_ref(self.osm_by_ref,
-                             osm_stops,
-                             self.osm_without_ref)
+        self.populate_osm_by_ref(osm_stops)
 
-    def populate_by_ref(self, dic, stop_list, lst=None):
-        for stop in stop_list:
-            if not stop.refs and lst:
-                lst.append(stop)
+        self.rules = {}
+        if rules is None:
+            rules = default_rules()
+        for rule in rules:
+            self.register(rule)
 
+    def register(self, rule):
+        self.rules.setdefault(rule.target, []).append(rule)
+
+    def populate_by_ref(self, dic, stop_list):
+        for stop in stop_list:
             for ref in stop.refs:
                 dic[ref] = stop
 
+    def populate_osm_by_ref(self, stop_list):
+        # several OSM stops can share a ref, they are all kept
+        for stop in stop_list:
+            if not stop.refs:
+                self.osm_without_ref.append(stop)
+
+            for ref in stop.refs:
+                self.osm_by_ref.setdefault(ref, []).append(stop)
+
     def get_common_refs(self):
         osm_refs = set(self.osm_by_ref.keys())
         gtfs_refs = set(self.gtfs_by_ref.keys())
 
         return osm_refs & gtfs_refs
 
-    def validate(self):
-        self.find_inconsistent_refs()
-        self.check_distance()
-
-    def check_distance(self, max_distance=50):
-        max_distance = max_distance / 1000
-        for ref in self.get_common_refs():
-            osm_stop = self.osm_by_ref[ref]
-            gtfs_stop = self.gtfs_by_ref[ref]
-
-            dist = haversine((osm_stop.lat, osm_stop.lon),
-                             (gtfs_stop.lat, gtfs_stop.lon))
-
-            if dist >= max_distance:
-                issue = NodesTooFarIssue(osm_stop, gtfs_stop, dist * 1000)
-                self.issues.append(issue)
-
-    def find_inconsistent_refs(self):
-        gtfs = set(self.gtfs_by_ref.keys())
-        osm = set(self.osm_by_ref.keys())
-
-        missing_stops = gtfs - osm
-        for stop_ref in missing_stops:
-            issue = OsmStopMissingIssue(self.gtfs_by_ref[stop_ref])
-            self.issues.append(issue)
-
-        #for stop_ref in osm - gtfs:
-        #    issue = OsmStopWithUnknownRefIssue(self.osm_by_ref[stop_ref])
-        #    self.issues.append(issue)
+    def get_all_refs(self):
+        return sorted(set(self.gtfs_by_ref) | set(self.osm_by_ref))
+
+    def iter_issues(self, refs, with_unreferenced=True):
+        """
+        Evaluate all rules on the stops of refs, and on OSM stops without ref
+        if with_unreferenced is set. Yield issues as they are found.
+        """
+        for ref in refs:
+            yield from self.iter_ref_issues(ref)
+
+        if with_unreferenced:
+            yield from self.iter_unreferenced_issues()
+
+    def iter_ref_issues(self, ref):
+        gtfs_stop = self.gtfs_by_ref.get(ref)
+        osm_stops = self.osm_by_ref.get(ref, [])
+
+        for rule in self.rules.get("stop_ref", []):
+            yield from rule.check(ref, gtfs_stop, osm_stops)
+
+        # stops with several refs are checked along with their first ref
+        for osm_stop in osm_stops:
+            if osm_stop.refs[0] == ref:
+                for rule in self.rules.get("osm_stop", []):
+                    yield from rule.check(osm_stop)
+
+    def iter_unreferenced_issues(self):
+        for osm_stop in self.osm_without_ref:
+            for rule in self.rules.get("osm_stop", []):
+                yield from rule.check(osm_stop)
+
+    def check_refs(self, refs, with_unreferenced=True):
+        return list(self.iter_issues(refs, with_unreferenced))
+
+    @profiled("validation")
+    def validate(self, jobs=1):
+        refs = self.get_all_refs()
+
+        if jobs > 1 and len(refs) > self.SHARD_SIZE:
+            # contiguous shards, the last one also checking stops without
+            # ref, consumed in order so that issues come in the same order
+            # whatever the number of jobs
+            size = self.SHARD_SIZE
+            shards = [(refs[i:i + size], i + size >= len(refs))
+                      for i in range(0, len(refs), size)]
+
+            with Pool(jobs, _init_worker, (self, )) as pool:
+                for issues in pool.imap(_check_shard, shards):
+                    self.issues.extend(issues)
+        else:
+            self.issues.extend(self.iter_issues(refs))
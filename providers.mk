@@ -1,31 +1,58 @@
+# Generated from the agencies of gtfsimporter/gtfs by
+# 'python -m gtfsimporter.main pipeline providers', don't edit
+
+EXO_CHAMBLY_ARCHIVE	:= google_transit.zip
+EXO_CHAMBLY_REMOTE_URL	:= https://exo.quebec/xdata/citcrc
+$(eval $(call gtfs-providers,exo-chambly,EXO_CHAMBLY))
+
+EXO_HAUT_ST_LAURENT_ARCHIVE	:= google_transit.zip
+EXO_HAUT_ST_LAURENT_REMOTE_URL	:= https://exo.quebec/xdata/cithsl
+$(eval $(call gtfs-providers,exo-haut-st-laurent,EXO_HAUT_ST_LAURENT))
+
+EXO_LAURENTIDES_ARCHIVE	:= google_transit.zip
+EXO_LAURENTIDES_REMOTE_URL	:= https://exo.quebec/xdata/citla
+$(eval $(call gtfs-providers,exo-laurentides,EXO_LAURENTIDES))
+
+EXO_PRESQUILE_ARCHIVE	:= google_transit.zip
+EXO_PRESQUILE_REMOTE_URL	:= https://exo.quebec/xdata/citpi
+$(eval $(call gtfs-providers,exo-presquile,EXO_PRESQUILE))
+
+EXO_ST_RICHELAIN_ARCHIVE	:= google_transit.zip
+EXO_ST_RICHELAIN_REMOTE_URL	:= https://exo.quebec/xdata/citlr
+$(eval $(call gtfs-providers,exo-st-richelain,EXO_ST_RICHELAIN))
+
+EXO_ROUSSILLON_ARCHIVE	:= google_transit.zip
+EXO_ROUSSILLON_REMOTE_URL	:= https://exo.quebec/xdata/citrous
+$(eval $(call gtfs-providers,exo-roussillon,EXO_ROUSSILLON))
+
+EXO_SOREL_VARENNES_ARCHIVE	:= google_transit.zip
+EXO_SOREL_VARENNES_REMOTE_URL	:= https://exo.quebec/xdata/citsv
+$(eval $(call gtfs-providers,exo-sorel-varennes,EXO_SOREL_VARENNES))
+
+EXO_SUD_OUEST_ARCHIVE	:= google_transit.zip
+EXO_SUD_OUEST_REMOTE_URL	:= https://exo.quebec/xdata/citso
+$(eval $(call gtfs-providers,exo-sud-ouest,EXO_SUD_OUEST))
+
+EXO_VALLEE_RICHELIEU_ARCHIVE	:= google_transit.zip
+EXO_VALLEE_RICHELIEU_REMOTE_URL	:= https://exo.quebec/xdata/citvr
+$(eval $(call gtfs-providers,exo-vallee-richelieu,EXO_VALLEE_RICHELIEU))
+
+EXO_ASSOMPTION_ARCHIVE	:= google_transit.zip
+EXO_ASSOMPTION_REMOTE_URL	:= https://exo.quebec/xdata/mrclasso
+$(eval $(call gtfs-providers,exo-assomption,EXO_ASSOMPTION))
+
+EXO_TERREBONNE_ARCHIVE	:= google_transit.zip
+EXO_TERREBONNE_REMOTE_URL	:= https://exo.quebec/xdata/mrclm
+$(eval $(call gtfs-providers,exo-terrebonne,EXO_TERREBONNE))
+
+EXO_STE_JULIE_ARCHIVE	:= google_transit.zip
+EXO_STE_JULIE_REMOTE_URL	:= https://exo.quebec/xdata/omitsju
+$(eval $(call gtfs-providers,exo-ste-julie,EXO_STE_JULIE))
 
 STL_ARCHIVE	:= GTF_STL.zip
-STL_REMOTE_URL 	:= http://www.stl.laval.qc.ca/opendata
+STL_REMOTE_URL	:= http://www.stl.laval.qc.ca/opendata
 $(eval $(call gtfs-providers,stl,STL))
 
 STM_ARCHIVE	:= gtfs_stm.zip
-STM_REMOTE_URL 	:= http://stm.info/sites/default/files/gtfs
+STM_REMOTE_URL	:= http://stm.info/sites/default/files/gtfs
 $(eval $(call gtfs-providers,stm,STM))
-
-EXO_ARCHIVE	:= google_transit.zip
-EXO_REMOTE_URL	:= https://exo.quebec/xdata
-
-define exo-gtfs-providers
-$(2)_ARCHIVE 	:= $(EXO_ARCHIVE)
-$(2)_REMOTE_URL	:= $(EXO_REMOTE_URL)/$(3)
-
-$(eval $(call gtfs-providers,$(1),$(2)))
-endef
-
-$(eval $(call exo-gtfs-providers,exo-chambly,EXO_CRC,citcrc))
-$(eval $(call exo-gtfs-providers,exo-haut-st-laurent,EXO_HSL,cithsl))
-$(eval $(call exo-gtfs-providers,exo-laurentides,EXO_LA,citla))
-$(eval $(call exo-gtfs-providers,exo-presquile,EXO_PI,citpi))
-$(eval $(call exo-gtfs-providers,exo-st-richelain,EXO_LR,citlr))
-$(eval $(call exo-gtfs-providers,exo-roussillon,EXO_ROUS,citrous))
-$(eval $(call exo-gtfs-providers,exo-sorel-varennes,EXO_SV,citsv))
-$(eval $(call exo-gtfs-providers,exo-sud-ouest,EXO_SO,citso))
-$(eval $(call exo-gtfs-providers,exo-vallee-richelieu,EXO_VR,citvr))
-$(eval $(call exo-gtfs-providers,exo-assomption,EXO_ASSO,mrclasso))
-$(eval $(call exo-gtfs-providers,exo-terrebonne,EXO_TERREBONNE,mrclm))
-$(eval $(call exo-gtfs-providers,exo-ste-julie,EXO_STE_JULIE,omitsju))